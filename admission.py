@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Admission control for Schrimp Chat Server
+Caps connections globally and per IP, and enforces handshake deadlines and
+idle timeouts from a single timer wheel instead of per-socket timeouts
+"""
+
+import socket
+import threading
+import time
+from server_log import log
+from metrics import CONNECTIONS_REJECTED, HANDSHAKE_TIMEOUTS, IDLE_REAPED
+
+
+DEFAULT_BACKLOG = socket.SOMAXCONN
+DEFAULT_MAX_CLIENTS = 10000      # connections per server process, 0 for no limit
+DEFAULT_MAX_PER_IP = 100         # connections from one address, 0 for no limit
+DEFAULT_HANDSHAKE_TIMEOUT = 30.0 # seconds for each of the password and username prompts
+DEFAULT_IDLE_TIMEOUT = 0.0       # seconds without input before a client is dropped, 0 disables
+
+WHEEL_RESOLUTION = 1.0           # seconds per wheel slot
+WHEEL_SLOTS = 512                # later deadlines take another turn of the wheel
+
+# Session phases
+PHASE_AUTH = 'auth'
+PHASE_USERNAME = 'username'
+PHASE_CHAT = 'chat'
+
+REJECT_SERVER_FULL = "Server is full, please try again later.\n"
+REJECT_TOO_MANY = "Too many connections from your address.\n"
+
+
+# ==============================================================================
+# TIMER WHEEL
+# ==============================================================================
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) insertion, one slot visited per tick"""
+
+    def __init__(self, resolution=WHEEL_RESOLUTION, slots=WHEEL_SLOTS):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(slots)]
+        self.position = 0
+        self.time = time.monotonic()   # time of the current slot
+        self.lock = threading.Lock()
+
+    def schedule(self, item, when):
+        """Put an item in the slot of its deadline, capped at one turn away"""
+        ticks = int((when - self.time) / self.resolution) + 1
+        ticks = min(max(ticks, 1), len(self.slots) - 1)
+        with self.lock:
+            self.slots[(self.position + ticks) % len(self.slots)].append(item)
+
+    def advance(self, now):
+        """Move up to `now` and return the items of every slot passed"""
+        due = []
+        with self.lock:
+            while self.time + self.resolution <= now:
+                self.time += self.resolution
+                self.position = (self.position + 1) % len(self.slots)
+                slot = self.slots[self.position]
+                if slot:
+                    due.extend(slot)
+                    slot.clear()
+        return due
+
+
+# ==============================================================================
+# SESSIONS
+# ==============================================================================
+
+class Session:
+    """Admission state of one connection"""
+
+    __slots__ = ('connection', 'ip', 'phase', 'phase_started', 'scheduled', 'reaped', 'done')
+
+    def __init__(self, connection, ip, phase):
+        self.connection = connection
+        self.ip = ip
+        self.phase = phase
+        self.phase_started = time.monotonic()
+        self.scheduled = False   # True while the session sits in a wheel slot
+        self.reaped = False
+        self.done = False
+
+
+class AdmissionControl:
+    """Connection caps plus the deadline reaper of one server process"""
+
+    def __init__(self, max_clients=DEFAULT_MAX_CLIENTS, max_per_ip=DEFAULT_MAX_PER_IP,
+                 handshake_timeout=DEFAULT_HANDSHAKE_TIMEOUT, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.max_clients = max_clients
+        self.max_per_ip = max_per_ip
+        self.handshake_timeout = handshake_timeout
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.per_ip = {}               # {ip: open connections}
+        self.sessions = {}             # {connection: Session} of every open connection
+        self.wheel = TimerWheel()
+
+    # --------------------------------------------------------------------------
+    # CONNECTION CAPS
+    # --------------------------------------------------------------------------
+
+    def admit(self, ip):
+        """Count a new connection, or return the notice to send if it is refused"""
+        with self.lock:
+            if self.max_clients and self.connections >= self.max_clients:
+                notice = REJECT_SERVER_FULL
+            elif self.max_per_ip and self.per_ip.get(ip, 0) >= self.max_per_ip:
+                notice = REJECT_TOO_MANY
+            else:
+                self.connections += 1
+                self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+                return None
+        CONNECTIONS_REJECTED.inc()
+        log.warning('admission.reject', "Refused connection from {ip}: {reason}", ip=ip, reason=notice.strip())
+        return notice
+
+    def adopt(self, ip):
+        """Count a connection taken over from a previous process, whatever the caps"""
+        with self.lock:
+            self.connections += 1
+            self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+
+    def release(self, ip):
+        with self.lock:
+            self.connections -= 1
+            count = self.per_ip.get(ip, 0) - 1
+            if count > 0:
+                self.per_ip[ip] = count
+            else:
+                self.per_ip.pop(ip, None)
+
+    # --------------------------------------------------------------------------
+    # DEADLINES
+    # --------------------------------------------------------------------------
+
+    def open(self, connection, ip, phase):
+        """Start tracking an admitted connection in its first handshake phase"""
+        session = Session(connection, ip, phase)
+        self.sessions[connection] = session
+        self._schedule(session)
+        return session
+
+    def enter(self, session, phase):
+        """Move a session to its next phase, restarting the deadline"""
+        session.phase = phase
+        session.phase_started = time.monotonic()
+        if phase == PHASE_CHAT:
+            session.connection.last_activity = session.phase_started
+        # A pending wheel entry finds the new deadline and reschedules itself
+        if not session.scheduled:
+            self._schedule(session)
+
+    def close(self, session):
+        """Stop tracking a session and free its connection slot"""
+        if not session.done:
+            session.done = True
+            self.sessions.pop(session.connection, None)
+            self.release(session.ip)
+
+    def _deadline(self, session):
+        if session.phase != PHASE_CHAT:
+            return session.phase_started + self.handshake_timeout if self.handshake_timeout else None
+        if not self.idle_timeout:
+            return None
+        return session.connection.last_activity + self.idle_timeout
+
+    def _schedule(self, session):
+        deadline = self._deadline(session)
+        if deadline is not None:
+            session.scheduled = True
+            self.wheel.schedule(session, deadline)
+
+    def expire(self, now=None):
+        """Advance the wheel and disconnect every session past its deadline"""
+        if now is None:
+            now = time.monotonic()
+        for session in self.wheel.advance(now):
+            session.scheduled = False
+            if session.done or session.reaped:
+                continue
+            deadline = self._deadline(session)
+            if deadline is None:
+                continue
+            if deadline > now:
+                # Activity or a phase change pushed the deadline back
+                self._schedule(session)
+                continue
+            self._reap(session)
+
+    def _reap(self, session):
+        if session.phase == PHASE_CHAT:
+            IDLE_REAPED.inc()
+            notice = f"Disconnected after {self.idle_timeout:.0f} seconds of inactivity.\n"
+        else:
+            HANDSHAKE_TIMEOUTS.inc()
+            notice = f"No {session.phase} received in {self.handshake_timeout:.0f} seconds, closing.\n"
+        log.info('admission.reap', "Reaped {ip} in {phase} phase", ip=session.ip, phase=session.phase)
+        session.reaped = True
+        session.connection.disconnect(notice)
+
+    def run_reaper(self, running):
+        """Drive the wheel from a thread while running() is true"""
+        while running():
+            time.sleep(self.wheel.resolution)
+            self.expire()
+
+
+def refuse(sock, notice):
+    """Send a refusal notice without blocking and close a raw socket"""
+    try:
+        sock.setblocking(False)
+        sock.send(notice.encode('utf-8'))
+    except socket.error:
+        pass
+    finally:
+        sock.close()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Event-loop Chat Server - Schrimp
+Runs authentication, registration and the message loop of every client as
+coroutines on a single asyncio loop instead of one thread per connection
+"""
+
+import asyncio
+import os
+import signal
+import socket
+import time
+from server import ChatServer
+from handoff import spawn_successor
+from connection import StreamConnection
+from server_log import log
+from metrics import CONNECTIONS_ACCEPTED
+
+# Raising the open-file limit is only possible on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def raise_file_limit():
+    """Raise the soft open-file limit to the hard limit so we can hold many sockets"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else 1 << 20
+    if soft == resource.RLIM_INFINITY or soft >= target:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ValueError, OSError):
+        pass
+
+
+# ==============================================================================
+# EVENT-LOOP CHAT SERVER
+# ==============================================================================
+
+class AsyncChatServer(ChatServer):
+    """Chat server running every client on one asyncio event loop"""
+
+    # --------------------------------------------------------------------------
+    # SERVER MANAGEMENT
+    # --------------------------------------------------------------------------
+
+    loop = None
+    handle_signals = False
+
+    def start(self):
+        """Starts the chat server"""
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            log.error('server.start', "Server startup error: {error}", error=e)
+        finally:
+            self.stop()
+
+    async def serve(self):
+        """Listen and serve clients until the server is stopped"""
+        raise_file_limit()
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        listener, adopted = self.take_over()
+        if listener is not None:
+            self.server_socket = await asyncio.start_server(
+                self.handle_client_async,
+                sock=listener,
+                backlog=self.backlog
+            )
+        else:
+            self.server_socket = await asyncio.start_server(
+                self.handle_client_async,
+                self.host,
+                self.port,
+                reuse_address=True,
+                reuse_port=self.reuse_port or None,
+                backlog=self.backlog
+            )
+        self.running = True
+        reaper = asyncio.ensure_future(self.run_reaper())
+        if self.federation:
+            self.federation.start()
+        self.start_metrics()
+        self.print_banner()
+        for client in adopted:
+            asyncio.ensure_future(self.handle_adopted_client_async(client))
+        self.start_handoff_listener()
+        if self.handle_signals:
+            self.loop.add_signal_handler(signal.SIGTERM, self.request_drain)
+            if self.handoff_path:
+                self.loop.add_signal_handler(signal.SIGHUP, spawn_successor)
+
+        try:
+            await self.stopped.wait()
+            if self.draining:
+                await self.drain_clients_async()
+        finally:
+            reaper.cancel()
+            self.server_socket.close()
+
+    async def run_reaper(self):
+        """Drive the admission timer wheel from the event loop"""
+        while True:
+            await asyncio.sleep(self.admission.wheel.resolution)
+            self.admission.expire()
+
+    def dispatch(self, callback, *args):
+        """Stream connections belong to the event loop, hand bus callbacks over to it"""
+        if self.loop is None:
+            callback(*args)
+        else:
+            try:
+                self.loop.call_soon_threadsafe(callback, *args)
+            except RuntimeError:
+                # Loop already closed during shutdown
+                pass
+
+    # --------------------------------------------------------------------------
+    # CLIENT HANDLING
+    # --------------------------------------------------------------------------
+
+    async def handle_client_async(self, reader, writer):
+        """Handles a connected client"""
+        CONNECTIONS_ACCEPTED.inc()
+        ip = writer.get_extra_info('peername')[0]
+        notice = self.admission.admit(ip)
+        if notice:
+            writer.write(notice.encode('utf-8'))
+            writer.close()
+            return
+
+        client_socket = StreamConnection(
+            reader,
+            writer,
+            self.high_water,
+            self.slow_consumer_policy,
+            self.outbound_stats
+        )
+        client_address = client_socket.address
+        log.debug('client.accept', "New connection from {ip}:{port}", ip=client_address[0], port=client_address[1])
+        accepted_at = time.perf_counter()
+        session = self.open_client(client_socket, ip)
+
+        try:
+            # ------------------------------------------------------------------
+            # AUTHENTICATION PROCESS
+            # ------------------------------------------------------------------
+
+            if not self.auth_handler.send_welcome_message(client_socket):
+                authenticated = await self.auth_handler.authenticate_client_async(client_socket)
+                if not self.password_checked(session, authenticated):
+                    return
+
+            # ------------------------------------------------------------------
+            # USER REGISTRATION
+            # ------------------------------------------------------------------
+
+            pseudo = await self.auth_handler.get_username_async(client_socket, client_address, self.client_manager)
+            if pseudo is None:
+                return
+            self.register_client(client_socket, pseudo, ip, session, accepted_at)
+
+            # ------------------------------------------------------------------
+            # MESSAGE HANDLING LOOP
+            # ------------------------------------------------------------------
+
+            await self.message_handler.handle_message_loop_async(
+                client_socket,
+                pseudo,
+                self.client_manager,
+                lambda: self.running,
+                self.security_manager
+            )
+
+        except asyncio.CancelledError:
+            # Loop shutdown, the client is cleaned up below
+            pass
+        except Exception as e:
+            log.error('client.error', "Error with client {address}: {error}", address=client_address, error=e)
+        finally:
+            self.finish_client(client_socket, session)
+
+    async def handle_adopted_client_async(self, adopted):
+        """Serve a client taken over from the previous process, already past its handshake"""
+        reader, writer = await asyncio.open_connection(sock=adopted.sock)
+        client_socket = StreamConnection(
+            reader,
+            writer,
+            self.high_water,
+            self.slow_consumer_policy,
+            self.outbound_stats
+        )
+        session = self.adopt_client(client_socket, adopted)
+        try:
+            await self.message_handler.handle_message_loop_async(
+                client_socket,
+                adopted.username,
+                self.client_manager,
+                lambda: self.running,
+                self.security_manager
+            )
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.error('client.error', "Error with client {address}: {error}", address=adopted.address, error=e)
+        finally:
+            self.finish_client(client_socket, session)
+
+    # --------------------------------------------------------------------------
+    # DRAIN AND HOT RESTART
+    # --------------------------------------------------------------------------
+
+    def install_signal_handlers(self):
+        """Signals are handled by the event loop once it runs"""
+        self.handle_signals = True
+
+    def request_drain(self):
+        super().request_drain()
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def drain_clients_async(self):
+        """Stop accepting, tell every client about the restart and let their output flush"""
+        connections = await self.loop.run_in_executor(None, self.drain_clients)
+        for client_socket in connections:
+            client_socket.abort()
+
+    def call_on_loop(self, callback, *args):
+        """Run a callback on the event loop from another thread and return its result"""
+        async def call():
+            return callback(*args)
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+    def handoff_listener_socket(self):
+        """Duplicate of the listening socket, once the loop stopped accepting"""
+        listener = socket.socket(fileno=os.dup(self.server_socket.sockets[0].fileno()))
+        self.close_listener()
+        return listener
+
+    def freeze_clients(self, connections):
+        """Pause the client transports, returns {connection: input not processed yet}"""
+        async def freeze():
+            return {connection: await connection.freeze() for connection in connections}
+        return asyncio.run_coroutine_threadsafe(freeze(), self.loop).result()
+
+    def complete_handoff(self, count):
+        super().complete_handoff(count)
+        self.loop.call_soon_threadsafe(self.stopped.set)
@@ -3,7 +3,10 @@
 Authentication handler for Schrimp Chat Server
 """
 
-import socket
+import asyncio
+from client_manager import DEFAULT_ROOM
+from binary_protocol import BINARY_REQUEST, PROMPT_PASSWORD, PROMPT_USERNAME, encode_event, hello_event
+from bus import HubUnavailable
 
 
 # ==============================================================================
@@ -36,7 +39,42 @@ class AuthHandler:
         if not self.password:
             return True
             
-        password_attempt = client_socket.recv(1024).decode('utf-8').strip()
+        password_attempt = (self._readline(client_socket, PROMPT_PASSWORD) or '').strip()
+        return self._check_password(client_socket, password_attempt)
+    
+    async def authenticate_client_async(self, client_socket):
+        """Authenticate client with password (event-loop version)"""
+        if not self.password:
+            return True
+            
+        password_attempt = (await self._readline_async(client_socket, PROMPT_PASSWORD) or '').strip()
+        return self._check_password(client_socket, password_attempt)
+    
+    def _readline(self, client_socket, prompt):
+        """Next answer of the client, switching protocol first if it asks for the binary one"""
+        line = client_socket.readline()
+        if self._switch_protocol(client_socket, line, prompt):
+            line = client_socket.readline()
+        return line
+    
+    async def _readline_async(self, client_socket, prompt):
+        """Next answer of the client, switching protocol first if it asks for the binary one (event-loop version)"""
+        line = await client_socket.readline()
+        if self._switch_protocol(client_socket, line, prompt):
+            line = await client_socket.readline()
+        return line
+    
+    def _switch_protocol(self, client_socket, line, prompt):
+        """Move a client that sent the binary request to the framed protocol, True if it did"""
+        if line is None or client_socket.binary or line.strip() != BINARY_REQUEST:
+            return False
+        client_socket.use_binary()
+        # The prompt went out as text, hello tells the client what is expected
+        client_socket.send(encode_event(hello_event(prompt)), encoded=True)
+        return True
+    
+    def _check_password(self, client_socket, password_attempt):
+        """Compare a password attempt and tell the client the outcome"""
         if password_attempt == self.password:
             client_socket.send("Authentication successful!\nEnter your username: ".encode('utf-8'))
             return True
@@ -45,24 +83,69 @@ class AuthHandler:
             return False
     
     def get_username(self, client_socket, client_address, client_manager):
-        """Get and validate username from client"""
-        pseudo_input = client_socket.recv(1024).decode('utf-8').strip()
-        pseudo = pseudo_input if pseudo_input else f"Anonymous_{client_address[1]}"
+        """Get and validate username from client, None if it left first"""
+        pseudo = self._resolve_username(self._readline(client_socket, PROMPT_USERNAME), client_address)
         
-        # Check if username is already taken
-        while client_manager.is_username_taken(pseudo):
-            client_socket.send(f"Username '{pseudo}' is already taken. Choose another: ".encode('utf-8'))
-            pseudo_input = client_socket.recv(1024).decode('utf-8').strip()
-            pseudo = pseudo_input if pseudo_input else f"Anonymous_{client_address[1]}"
+        # Reserve the username atomically, ask again while it is taken
+        try:
+            while pseudo is not None and not client_manager.reserve_username(pseudo, client_socket):
+                self._send_username_taken(client_socket, pseudo)
+                pseudo = self._resolve_username(self._readline(client_socket, PROMPT_USERNAME), client_address)
+        except HubUnavailable:
+            self._send_server_unavailable(client_socket)
+            return None
         
         return pseudo
     
-    def send_connection_info(self, client_socket, pseudo, client_count):
+    async def get_username_async(self, client_socket, client_address, client_manager):
+        """Get and validate username from client, None if it left first (event-loop version)"""
+        pseudo = self._resolve_username(await self._readline_async(client_socket, PROMPT_USERNAME), client_address)
+        
+        # Reserve the username atomically, ask again while it is taken
+        try:
+            while pseudo is not None and not await self._reserve_username_async(pseudo, client_socket, client_manager):
+                self._send_username_taken(client_socket, pseudo)
+                pseudo = self._resolve_username(await self._readline_async(client_socket, PROMPT_USERNAME), client_address)
+        except HubUnavailable:
+            self._send_server_unavailable(client_socket)
+            return None
+        
+        return pseudo
+    
+    async def _reserve_username_async(self, pseudo, client_socket, client_manager):
+        """Reserve a username, off the event loop when it waits for the bus hub"""
+        if client_manager.bus is None:
+            return client_manager.reserve_username(pseudo, client_socket)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, client_manager.reserve_username, pseudo, client_socket)
+    
+    def _resolve_username(self, line, client_address):
+        """Turn a username line into a pseudo, with an anonymous fallback, None at end of stream"""
+        if line is None:
+            return None
+        pseudo_input = line.strip()
+        return pseudo_input if pseudo_input else f"Anonymous_{client_address[1]}"
+    
+    def _send_username_taken(self, client_socket, pseudo):
+        """Ask the client for another username"""
+        client_socket.send(f"Username '{pseudo}' is already taken. Choose another: ".encode('utf-8'))
+    
+    def _send_server_unavailable(self, client_socket):
+        """Tell the client its username could not be checked"""
+        client_socket.send("Server error: usernames cannot be checked right now, try again later. "
+                           "Connection closed.\n".encode('utf-8'))
+    
+    def send_connection_info(self, client_socket, pseudo, client_count, room=DEFAULT_ROOM):
         """Send connection information to newly connected client"""
         info_msg = f"\nConnected as: {pseudo}\n"
         info_msg += f"Connected users: {client_count}\n"
+        info_msg += f"Room: #{room}\n"
         info_msg += "Type your messages and press Enter\n"
         info_msg += "Type '/quit' to leave\n"
-        info_msg += "Type '/users' to see connected users\n"
+        info_msg += "Type '/users [page]' to see connected users, '/users <prefix>' to search\n"
+        info_msg += "Type '/join <room>', '/leave' or '/rooms' to switch rooms\n"
+        info_msg += "Type '/history [N]' to see recent messages\n"
+        info_msg += "Type '/msg <user> <text>' to write privately, '/inbox' to read private messages\n"
+        info_msg += "Write @user to mention someone\n"
         info_msg += "-" * 30 + "\n"
         client_socket.send(info_msg.encode('utf-8'))
\ No newline at end of file
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Broadcast fan-out micro-benchmark for Schrimp Chat Server
+Compares the per-message CPU cost of encoding once per recipient against
+the encode-once frame shared by every recipient, for growing room sizes
+
+Usage: python benchmarks/bench_broadcast.py [messages]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from client_manager import ClientManager
+from server_log import log
+
+
+ROOM_SIZES = (10, 100, 1000, 10000)
+MESSAGE = "[12:00:00] alice: the quick brown fox jumps over the lazy dog"
+
+
+class NullConnection:
+    """Connection stub that accepts frames like a queue would"""
+
+    binary = False
+
+    def __init__(self):
+        self.last_frame = None
+
+    def send(self, data, encoded=False):
+        self.last_frame = data
+        return len(data)
+
+
+def legacy_broadcast(client_manager, message, exclude_client=None):
+    """Previous fan-out, encoding the message again for every recipient"""
+    for client_socket in list(client_manager.clients.keys()):
+        if client_socket != exclude_client:
+            client_socket.send((message + "\n").encode('utf-8'))
+
+
+def build_room(size):
+    """Client manager filled with `size` stub connections"""
+    client_manager = ClientManager()
+    for index in range(size):
+        client_manager.add_client(NullConnection(), f"user{index}", '127.0.0.1')
+    return client_manager
+
+
+def measure(broadcast, client_manager, messages):
+    """CPU microseconds spent per broadcast message"""
+    start = time.process_time()
+    for _ in range(messages):
+        broadcast(client_manager, MESSAGE)
+    return (time.process_time() - start) * 1e6 / messages
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) >= 2 else 200
+    log.configure(level='warning')
+
+    print(f"{'room size':>10} {'per-recipient encode':>22} {'encode once':>14} {'speedup':>8}")
+    for size in ROOM_SIZES:
+        client_manager = build_room(size)
+        rounds = max(1, messages * 100 // size)
+        legacy = measure(legacy_broadcast, client_manager, rounds)
+        shared = measure(lambda manager, message: manager.broadcast_message(message), client_manager, rounds)
+        print(f"{size:>10} {legacy:>19.1f} us {shared:>11.1f} us {legacy / shared:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
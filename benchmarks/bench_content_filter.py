@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Content filter benchmark for Schrimp Chat Server
+Compares the previous per-word lowercase/replace loop against the compiled
+single-pass matcher for growing banned word lists
+
+Usage: python benchmarks/bench_content_filter.py [messages]
+"""
+
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from secure import ContentFilter
+
+
+WORD_COUNTS = (10, 1000, 10000)
+
+
+def legacy_filter(banned_words, message):
+    """Previous ContentFilter.filter_message loop"""
+    for word in banned_words:
+        if word.lower() in message.lower():
+            message = message.replace(word, "*" * len(word))
+    return message
+
+
+def random_words(count, generator):
+    """Distinct lowercase words of 4 to 10 letters"""
+    words = set()
+    while len(words) < count:
+        words.add(''.join(generator.choice(string.ascii_lowercase) for _ in range(generator.randint(4, 10))))
+    return sorted(words)
+
+
+def random_messages(count, words, generator):
+    """Chat-sized messages, some of them containing a banned word"""
+    messages = []
+    for _ in range(count):
+        parts = [''.join(generator.choice(string.ascii_letters) for _ in range(generator.randint(2, 8)))
+                 for _ in range(25)]
+        if generator.random() < 0.3:
+            parts[generator.randrange(len(parts))] = generator.choice(words).upper()
+        messages.append(' '.join(parts))
+    return messages
+
+
+def per_message(function, messages):
+    """Microseconds spent per message"""
+    start = time.perf_counter()
+    for message in messages:
+        function(message)
+    return (time.perf_counter() - start) * 1e6 / len(messages)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) >= 2 else 2000
+    generator = random.Random(42)
+
+    print(f"{'words':>6} {'compile':>10} {'legacy loop':>13} {'compiled':>10} {'speedup':>9}")
+    for word_count in WORD_COUNTS:
+        words = random_words(word_count, generator)
+        messages = random_messages(count, words, generator)
+
+        content_filter = ContentFilter(max_length=10000)
+        start = time.perf_counter()
+        content_filter.set_banned_words(words)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        legacy = per_message(lambda message: legacy_filter(words, message), messages[:max(20, count * 10 // word_count)])
+        compiled = per_message(content_filter.filter_message, messages)
+        print(f"{word_count:>6} {compile_ms:>7.1f} ms {legacy:>10.1f} us {compiled:>7.1f} us {legacy / compiled:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Message pipeline benchmark for Schrimp Chat Server
+Compares the per-message strftime with the per-second timestamp cache, then
+measures the reader-side cost of a chat message to a room of 100 clients
+with the deferred stages inline and on a worker, and prints the time of
+every stage as recorded by the pipeline
+
+Usage: python benchmarks/bench_pipeline.py [messages]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from client_manager import ClientManager
+from message_handler import MessageHandler
+from pipeline import TimestampCache
+from server_log import log
+
+
+ROOM_SIZE = 100
+MESSAGE = "the quick brown fox jumps over the lazy dog"
+
+
+class NullConnection:
+    """Connection stub that accepts frames like a queue would"""
+
+    binary = False
+
+    def send(self, data, encoded=False):
+        return len(data)
+
+
+def per_call(function, calls):
+    """CPU microseconds per call of a function, counting the calling thread only"""
+    start = time.thread_time()
+    for _ in range(calls):
+        function()
+    return (time.thread_time() - start) * 1e6 / calls
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) >= 2 else 20000
+    log.configure(level='warning')
+
+    cache = TimestampCache()
+    print("Timestamp of a chat line:")
+    print(f"  strftime per message: {per_call(lambda: datetime.now().strftime('%H:%M:%S'), messages):.2f} us")
+    print(f"  per-second cache:     {per_call(cache.now, messages):.2f} us")
+
+    client_manager = ClientManager()
+    for index in range(ROOM_SIZE):
+        client_manager.add_client(NullConnection(), f"user{index}", '127.0.0.1')
+    sender = next(iter(client_manager.clients))
+
+    print(f"Chat message to {ROOM_SIZE} clients, reader thread:")
+    for workers in (0, 1):
+        handler = MessageHandler(stage_workers=workers)
+        cost = per_call(lambda: handler.process_message(MESSAGE, 'user0', sender, client_manager), messages)
+        handler.close()
+        print(f"  {workers} stage workers: {cost:.1f} us")
+
+    print("Stage timings (sampled):")
+    for stage in handler.pipeline.stages + handler.pipeline.deferred:
+        histogram = stage.seconds
+        if histogram.count:
+            print(f"  {stage.name:<12} {histogram.total / histogram.count * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Protocol cost benchmark for Schrimp Chat Server
+Measures what a bot spends to get the fields of a chat message from a text
+line (regex over the formatted line) and from a binary frame, then the cost
+for the server of a chat message to a room of 100 text clients, with none
+and with some of them speaking the binary protocol
+
+Usage: python benchmarks/bench_protocol.py [messages]
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import binary_protocol
+from binary_protocol import FrameBuffer, FRAME_HEADER, chat_event, encode_event, packb, unpackb
+from client_manager import ClientManager, encode_frame
+from message_handler import MessageHandler
+from server_log import log
+
+
+ROOM_SIZE = 100
+BATCH = 16
+MESSAGE = "the quick brown fox jumps over the lazy dog"
+LINE_PATTERN = re.compile(r'^\[(\d\d:\d\d:\d\d)\] ([^:]+): (.*)$')
+
+
+class NullConnection:
+    """Connection stub that accepts frames like a queue would"""
+
+    def __init__(self, binary=False):
+        self.binary = binary
+
+    def send(self, data, encoded=False):
+        return len(data)
+
+
+def per_call(function, calls):
+    """CPU microseconds per call of a function"""
+    start = time.process_time()
+    for _ in range(calls):
+        function()
+    return (time.process_time() - start) * 1e6 / calls
+
+
+def parse_line(data):
+    match = LINE_PATTERN.match(data.decode('utf-8').rstrip("\n"))
+    return match.group(1), match.group(2), match.group(3)
+
+
+def parse_frame(data):
+    event = unpackb(data[FRAME_HEADER.size:])
+    return event['ts'], event['user'], event['text']
+
+
+def build_room(binary_clients):
+    client_manager = ClientManager()
+    for index in range(ROOM_SIZE):
+        client_manager.add_client(NullConnection(index < binary_clients), f"user{index}", '127.0.0.1')
+    return client_manager
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) >= 2 else 20000
+    log.configure(level='warning')
+    codec = "msgpack" if binary_protocol.msgpack is not None else "built-in msgpack subset"
+    print(f"Codec: {codec}")
+
+    line = encode_frame(f"[12:00:00] alice: {MESSAGE}")
+    frame = encode_event(chat_event('alice', 'general', MESSAGE))
+    print(f"Client side, one chat message ({len(line)} bytes as text, {len(frame)} as a frame):")
+    print(f"  text line parse:   {per_call(lambda: parse_line(line), messages):.2f} us")
+    print(f"  frame decode:      {per_call(lambda: parse_frame(frame), messages):.2f} us")
+
+    # Clients may batch events in one frame, the server always sends them one by one
+    payload = packb([chat_event('alice', 'general', MESSAGE)] * BATCH)
+    batch = FRAME_HEADER.pack(len(payload)) + payload
+    def decode_batch():
+        frame_buffer = FrameBuffer()
+        frame_buffer.feed(batch)
+        frame_buffer.pop_all()
+    print(f"  batch of {BATCH} events: {per_call(decode_batch, messages // BATCH) / BATCH:.2f} us per event")
+
+    print(f"Server side, chat message to {ROOM_SIZE} clients:")
+    handler = MessageHandler()
+    for binary_clients in (0, 10, ROOM_SIZE):
+        client_manager = build_room(binary_clients)
+        sender = next(iter(client_manager.clients))
+        cost = per_call(lambda: handler.process_message(MESSAGE, 'user0', sender, client_manager),
+                        messages // 10)
+        print(f"  {binary_clients:>3} binary clients:  {cost:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Load generator for Schrimp Chat Server
+Opens many nc-style clients from one event loop against a running (or
+spawned) server, scripts the password/username handshake, sends timestamped
+messages at a fixed rate and reports join throughput, broadcast latency
+percentiles, message rates and the server's CPU and memory
+
+Usage: python benchmarks/load_test.py SCENARIO [--port PORT] [--password PW]
+                                      [--clients N] [--senders N] [--rate R]
+                                      [--duration S] [--spawn] [--json PATH]
+
+Scenarios:
+- idle-crowd: many clients connect and stay silent (memory per client)
+- chat-storm: a share of the clients chat as fast as the rate allows
+- slow-consumers: chat storm where some clients barely read
+- join-storm: every client connects at once (handshake throughput)
+
+The server rate limit applies per user and per IP, and every simulated
+client comes from 127.0.0.1: start the server with a high --rate-limit,
+or use --spawn which does it for you
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from async_server import raise_file_limit
+
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Reproducible profiles, every field can be overridden on the command line
+SCENARIOS = {
+    'idle-crowd': dict(clients=2000, senders=0, rate=0.0, duration=20.0, slow=0.0, concurrency=200),
+    'chat-storm': dict(clients=200, senders=50, rate=5.0, duration=20.0, slow=0.0, concurrency=200),
+    'slow-consumers': dict(clients=200, senders=20, rate=10.0, duration=20.0, slow=0.1, concurrency=200),
+    'join-storm': dict(clients=2000, senders=0, rate=0.0, duration=0.0, slow=0.0, concurrency=2000),
+}
+
+LATENCY_MARKER = b": lt "        # chat frames sent by this tool: "[..] user: lt <ns> <padding>"
+SLOW_READ_BYTES = 1024          # a slow consumer reads this much per second
+DRAIN_SECONDS = 2.0             # wait for in-flight messages after the last send
+MAX_LATENCY_SAMPLES = 1000000   # reservoir size for latency percentiles
+SAMPLE_INTERVAL = 0.5           # seconds between two server RSS samples
+HANDSHAKE_TIMEOUT = 30.0
+
+
+def percentiles(values, points=(50, 90, 99, 99.9)):
+    """{'p50': .., ..., 'max': ..} of a list, empty when there are no values"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {}
+    for point in points:
+        index = min(len(ordered) - 1, int(len(ordered) * point / 100))
+        result[f"p{point:g}"] = round(ordered[index], 3)
+    result['max'] = round(ordered[-1], 3)
+    return result
+
+
+# ==============================================================================
+# SERVER PROCESS SAMPLING
+# ==============================================================================
+
+def process_tree(pid):
+    """A process and all of its descendants, read from /proc"""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as children:
+                    pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def sample_process(pid):
+    """(cpu seconds, rss bytes) summed over a process tree, None without /proc"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    page = os.sysconf('SC_PAGE_SIZE')
+    cpu = 0.0
+    rss = 0
+    try:
+        for current in process_tree(pid):
+            with open(f"/proc/{current}/stat") as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            with open(f"/proc/{current}/statm") as statm:
+                rss += int(statm.read().split()[1]) * page
+    except (OSError, IndexError, ValueError):
+        return None
+    return cpu, rss
+
+
+# ==============================================================================
+# SIMULATED CLIENTS
+# ==============================================================================
+
+class LoadStats:
+    """Counters shared by every simulated client"""
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.joined = 0
+        self.join_failures = 0
+        self.join_latencies = []     # milliseconds
+        self.sent = 0
+        self.received = 0
+        self.rate_limited = 0
+        self.latencies = []          # milliseconds, reservoir sampled
+        self.latency_count = 0
+
+    def record_latency(self, milliseconds):
+        self.latency_count += 1
+        if len(self.latencies) < MAX_LATENCY_SAMPLES:
+            self.latencies.append(milliseconds)
+        else:
+            slot = self.random.randrange(self.latency_count)
+            if slot < MAX_LATENCY_SAMPLES:
+                self.latencies[slot] = milliseconds
+
+
+async def expect(reader, buffer, *markers):
+    """Read until one of the markers shows up, returns it and the data after it"""
+    while True:
+        for marker in markers:
+            position = buffer.find(marker)
+            if position >= 0:
+                return marker, buffer[position + len(marker):]
+        data = await reader.read(4096)
+        if not data:
+            raise ConnectionError("server closed the connection during the handshake")
+        buffer += data
+
+
+class SimulatedClient:
+    """One nc-style client: handshake, then read frames and optionally chat"""
+
+    def __init__(self, config, stats, index, sender, slow):
+        self.config = config
+        self.stats = stats
+        self.username = f"{config.prefix}{index}"
+        self.sender = sender
+        self.slow = slow
+        self.reader = None
+        self.writer = None
+
+    async def join(self, semaphore):
+        """Connect and register, recording the handshake time"""
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                self.reader, self.writer = await asyncio.open_connection(self.config.host, self.config.port)
+                await asyncio.wait_for(self._handshake(), HANDSHAKE_TIMEOUT)
+            except (OSError, ConnectionError, asyncio.TimeoutError):
+                self.stats.join_failures += 1
+                self.close()
+                return False
+            self.stats.joined += 1
+            self.stats.join_latencies.append((time.perf_counter() - started) * 1000)
+            return True
+
+    async def _handshake(self):
+        prompt_password = b"Enter password: "
+        prompt_username = b"Enter your username: "
+        prompt, rest = await expect(self.reader, b"", prompt_password, prompt_username)
+        if prompt == prompt_password:
+            self.writer.write((self.config.password or '').encode('utf-8') + b"\n")
+            _, rest = await expect(self.reader, rest, prompt_username)
+        self.writer.write(self.username.encode('utf-8') + b"\n")
+        await expect(self.reader, rest, b"Connected as: ")
+
+    async def receive(self, stop_time):
+        """Count the latency frames received until the connection ends"""
+        pending = b""
+        while True:
+            try:
+                data = await self.reader.read(SLOW_READ_BYTES if self.slow else 65536)
+            except (OSError, ConnectionError):
+                return
+            if not data:
+                return
+            now = time.perf_counter_ns()
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                position = line.find(LATENCY_MARKER)
+                if position >= 0:
+                    self.stats.received += 1
+                    try:
+                        sent_ns = int(line[position + len(LATENCY_MARKER):].split(b" ", 1)[0])
+                    except ValueError:
+                        continue
+                    self.stats.record_latency((now - sent_ns) / 1e6)
+                elif line.startswith(b"Rate limit exceeded"):
+                    self.stats.rate_limited += 1
+            if self.slow:
+                await asyncio.sleep(1.0)
+
+    async def chat(self, stop_time, rate):
+        """Send timestamped messages at a fixed rate until stop_time"""
+        interval = 1.0 / rate
+        padding = b"x" * self.config.message_bytes
+        # Spread the senders over the first interval so they do not fire in lockstep
+        next_send = time.perf_counter() + self.stats.random.random() * interval
+        while next_send < stop_time:
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+            self.writer.write(b"lt %d %s\n" % (time.perf_counter_ns(), padding))
+            self.stats.sent += 1
+            next_send += interval
+            if self.writer.transport.get_write_buffer_size() > 65536:
+                await self.writer.drain()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# ==============================================================================
+# SCENARIO RUN
+# ==============================================================================
+
+async def run_scenario(config, server_pid):
+    """Join every client, run the traffic phase and return the results"""
+    raise_file_limit()
+    stats = LoadStats(config.seed)
+    layout = random.Random(config.seed)
+    slow_count = int(config.clients * config.slow)
+    slow_indexes = set(layout.sample(range(config.senders, config.clients), min(slow_count, config.clients - config.senders)))
+    clients = [SimulatedClient(config, stats, index, index < config.senders, index in slow_indexes)
+               for index in range(config.clients)]
+
+    # Join phase
+    semaphore = asyncio.Semaphore(config.concurrency)
+    before_join = sample_process(server_pid) if server_pid else None
+    join_started = time.perf_counter()
+    results = await asyncio.gather(*(client.join(semaphore) for client in clients))
+    join_seconds = time.perf_counter() - join_started
+    joined = [client for client, ok in zip(clients, results) if ok]
+
+    # Traffic phase
+    after_join = sample_process(server_pid) if server_pid else None
+    traffic_started = time.perf_counter()
+    stop_time = traffic_started + config.duration
+    receivers = [asyncio.ensure_future(client.receive(stop_time)) for client in joined]
+    senders = [client.chat(stop_time, config.rate) for client in joined if client.sender and config.rate > 0]
+    peak_rss = after_join[1] if after_join else 0
+
+    async def watch_memory():
+        nonlocal peak_rss
+        while True:
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            sample = sample_process(server_pid)
+            if sample:
+                peak_rss = max(peak_rss, sample[1])
+
+    watcher = asyncio.ensure_future(watch_memory()) if server_pid else None
+    await asyncio.gather(*senders, asyncio.sleep(config.duration))
+    if senders:
+        await asyncio.sleep(DRAIN_SECONDS)
+    traffic_seconds = time.perf_counter() - traffic_started
+    after_traffic = sample_process(server_pid) if server_pid else None
+    if watcher:
+        watcher.cancel()
+
+    for client in clients:
+        client.close()
+    for receiver in receivers:
+        receiver.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+
+    sent_seconds = max(config.duration, 1e-9)
+    expected = stats.sent * max(len(joined) - 1, 0)
+    result = {
+        'join': {
+            'clients': config.clients,
+            'joined': stats.joined,
+            'failed': stats.join_failures,
+            'seconds': round(join_seconds, 3),
+            'per_second': round(stats.joined / join_seconds, 1) if join_seconds else None,
+            'latency_ms': percentiles(stats.join_latencies),
+        },
+        'messages': {
+            'sent': stats.sent,
+            'received': stats.received,
+            'expected': expected,
+            'delivery_ratio': round(stats.received / expected, 4) if expected else None,
+            'sent_per_second': round(stats.sent / sent_seconds, 1),
+            'delivered_per_second': round(stats.received / traffic_seconds, 1) if traffic_seconds else None,
+            'rate_limited': stats.rate_limited,
+            'slow_consumers': len(slow_indexes),
+        },
+        'latency_ms': percentiles(stats.latencies),
+    }
+    if server_pid and before_join and after_join and after_traffic:
+        cpu_join = after_join[0] - before_join[0]
+        cpu_traffic = after_traffic[0] - after_join[0]
+        result['server'] = {
+            'pid': server_pid,
+            'cpu_percent_join': round(cpu_join / join_seconds * 100, 1) if join_seconds else None,
+            'cpu_percent_traffic': round(cpu_traffic / traffic_seconds * 100, 1) if traffic_seconds else None,
+            'rss_mb_before': round(before_join[1] / 1e6, 1),
+            'rss_mb_joined': round(after_join[1] / 1e6, 1),
+            'rss_mb_peak': round(max(peak_rss, after_traffic[1]) / 1e6, 1),
+            'rss_kb_per_client': round((after_join[1] - before_join[1]) / max(stats.joined, 1) / 1e3, 2),
+        }
+    return result
+
+
+# ==============================================================================
+# SERVER SPAWNING
+# ==============================================================================
+
+def spawn_server(config):
+    """Start chat_server.py on the target port with the rate limit and caps out of the way"""
+    command = [sys.executable, os.path.join(REPO_ROOT, 'chat_server.py'), str(config.port)]
+    if config.password is not None:
+        command.append(config.password)
+    command += ['--rate-limit', '100000000', '--max-clients', '0', '--max-per-ip', '0', '--log-level', 'warning']
+    command += shlex.split(config.server_args)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection((config.host, config.port), timeout=0.5).close()
+            # Let the welcome of the probe connection go through before the run
+            time.sleep(0.2)
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"server did not start: {' '.join(command)}")
+
+
+# ==============================================================================
+# MAIN FUNCTION
+# ==============================================================================
+
+def parse_arguments():
+    """Parse command line arguments, filling defaults from the scenario"""
+    parser = argparse.ArgumentParser(description="Schrimp chat server load generator")
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3031)
+    parser.add_argument('--password', default=None)
+    parser.add_argument('--clients', type=int, help="Simulated clients")
+    parser.add_argument('--senders', type=int, help="Clients that send messages")
+    parser.add_argument('--rate', type=float, help="Messages per second per sender")
+    parser.add_argument('--duration', type=float, help="Seconds of traffic after the join phase")
+    parser.add_argument('--slow', type=float, help="Share of non-sending clients that barely read")
+    parser.add_argument('--concurrency', type=int, help="Handshakes in progress at once")
+    parser.add_argument('--message-bytes', type=int, default=32, help="Padding added to each message")
+    parser.add_argument('--seed', type=int, default=1, help="Seed of every random choice")
+    parser.add_argument('--server-pid', type=int, default=None, help="Sample CPU/RSS of this process tree")
+    parser.add_argument('--spawn', action='store_true', help="Start a local server on --port for the run")
+    parser.add_argument('--server-args', default='', help="Extra chat_server.py arguments with --spawn")
+    parser.add_argument('--json', default=None, metavar='PATH', help="Write the results as JSON ('-' for stdout)")
+    config = parser.parse_args()
+
+    for name, value in SCENARIOS[config.scenario].items():
+        if getattr(config, name) is None:
+            setattr(config, name, value)
+    config.senders = min(config.senders, config.clients)
+    config.prefix = f"lt{os.getpid() % 10000}_"
+    return config
+
+
+def print_report(report):
+    """Human readable summary of a run"""
+    join, messages, latency = report['join'], report['messages'], report['latency_ms']
+    print(f"Scenario {report['scenario']}: {join['clients']} clients")
+    print(f"  join:      {join['joined']} joined, {join['failed']} failed in {join['seconds']} s "
+          f"({join['per_second']}/s), handshake ms {join['latency_ms']}")
+    if messages['sent']:
+        print(f"  messages:  {messages['sent']} sent ({messages['sent_per_second']}/s), "
+              f"{messages['received']} delivered ({messages['delivered_per_second']}/s), "
+              f"delivery ratio {messages['delivery_ratio']}, {messages['rate_limited']} rate limited")
+        print(f"  latency:   ms {latency}")
+    server = report.get('server')
+    if server:
+        print(f"  server:    cpu {server['cpu_percent_join']}% during join, {server['cpu_percent_traffic']}% during traffic, "
+              f"rss {server['rss_mb_before']} -> {server['rss_mb_joined']} MB (peak {server['rss_mb_peak']} MB, "
+              f"{server['rss_kb_per_client']} kB/client)")
+
+
+def main():
+    config = parse_arguments()
+    process = spawn_server(config) if config.spawn else None
+    server_pid = process.pid if process else config.server_pid
+
+    try:
+        results = asyncio.run(run_scenario(config, server_pid))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    parameters = {name: getattr(config, name)
+                  for name in ('clients', 'senders', 'rate', 'duration', 'slow', 'concurrency', 'message_bytes', 'seed')}
+    report = {
+        'scenario': config.scenario,
+        'parameters': parameters,
+        'server_args': config.server_args,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    report.update(results)
+
+    print_report(report)
+    if config.json == '-':
+        print(json.dumps(report, indent=2))
+    elif config.json:
+        with open(config.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
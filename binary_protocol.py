@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Binary protocol for Schrimp Chat Server
+Optional framed protocol for bots and rich clients, negotiated on the same
+port as the text protocol: a client answers the first login prompt with the
+line '/binary' and waits for the hello event, from then on both sides send
+frames made of a 4-byte big-endian length and a msgpack payload holding one
+event (a map); a client may also send a batch of events (an array of maps)
+in one frame
+
+Server events, by their 't' key:
+  hello    version, prompt: 'password' or 'username', the answer expected next
+  text     text: any server output without a typed form (prompts, replies)
+  msg      ts, user, text and room, or to for a private message
+  mention  ts, user, room, text: a room message naming the client
+  join     user, room
+  leave    user, room
+  roster   add, remove: users connected or gone, full once with the whole roster
+
+Client events:
+  line     text: anything a text client would type (password, commands...)
+  msg      text, optional to for a private message
+  join     room
+  leave
+"""
+
+import struct
+import time
+from collections import deque
+from line_reader import MAX_LINE_LENGTH
+
+# The C implementation is used when installed, the subset below otherwise
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+PROTOCOL_VERSION = 1
+BINARY_REQUEST = '/binary'     # line switching a connection to the binary protocol
+MAX_FRAME_LENGTH = 64 * 1024   # largest payload accepted from a client
+
+FRAME_HEADER = struct.Struct('!I')
+
+# Login prompts a hello event can announce
+PROMPT_PASSWORD = 'password'
+PROMPT_USERNAME = 'username'
+
+# Event types
+EVENT_HELLO = 'hello'
+EVENT_TEXT = 'text'
+EVENT_MESSAGE = 'msg'
+EVENT_MENTION = 'mention'
+EVENT_JOIN = 'join'
+EVENT_LEAVE = 'leave'
+EVENT_ROSTER = 'roster'
+EVENT_LINE = 'line'
+
+
+# ==============================================================================
+# MSGPACK SUBSET
+# ==============================================================================
+
+# nil, booleans, integers, floats, str, bin, arrays and maps: all events need
+_INT_FORMATS = (
+    (0, 0xff, 0xcc, struct.Struct('!B')),
+    (0, 0xffff, 0xcd, struct.Struct('!H')),
+    (0, 0xffffffff, 0xce, struct.Struct('!I')),
+    (0, 0xffffffffffffffff, 0xcf, struct.Struct('!Q')),
+    (-0x80, 0x7f, 0xd0, struct.Struct('!b')),
+    (-0x8000, 0x7fff, 0xd1, struct.Struct('!h')),
+    (-0x80000000, 0x7fffffff, 0xd2, struct.Struct('!i')),
+    (-0x8000000000000000, 0x7fffffffffffffff, 0xd3, struct.Struct('!q')),
+)
+_FLOAT = struct.Struct('!d')
+_SIZES = (struct.Struct('!B'), struct.Struct('!H'), struct.Struct('!I'))
+
+# Fixed size values by type code
+_FIXED = {code: fmt for _, _, code, fmt in _INT_FORMATS}
+_FIXED[0xcb] = _FLOAT
+_FIXED[0xca] = struct.Struct('!f')
+
+# Sized values by type code: (size format, kind)
+_SIZED = {
+    0xd9: (_SIZES[0], 'str'), 0xda: (_SIZES[1], 'str'), 0xdb: (_SIZES[2], 'str'),
+    0xc4: (_SIZES[0], 'bin'), 0xc5: (_SIZES[1], 'bin'), 0xc6: (_SIZES[2], 'bin'),
+    0xdc: (_SIZES[1], 'array'), 0xdd: (_SIZES[2], 'array'),
+    0xde: (_SIZES[1], 'map'), 0xdf: (_SIZES[2], 'map'),
+}
+
+
+def _pack_size(out, size, fix_code, fix_limit, codes):
+    """Type code and length of a sized value, codes for 8, 16 and 32-bit lengths"""
+    if size < fix_limit:
+        out.append(fix_code | size)
+        return
+    for code, fmt in zip(codes, _SIZES):
+        if code is not None and size < 1 << (fmt.size * 8):
+            out.append(code)
+            out += fmt.pack(size)
+            return
+    raise ValueError("value too large for msgpack")
+
+
+def _pack(obj, out):
+    # Exact type checks first, in the order events use them most
+    kind = type(obj)
+    if kind is str:
+        data = obj.encode('utf-8')
+        if len(data) < 32:
+            out.append(0xa0 | len(data))
+        else:
+            _pack_size(out, len(data), 0xa0, 32, (0xd9, 0xda, 0xdb))
+        out += data
+    elif kind is dict:
+        _pack_size(out, len(obj), 0x80, 16, (None, 0xde, 0xdf))
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    elif kind is int and 0 <= obj < 0x80:
+        out.append(obj)
+    elif obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        if -0x20 <= obj < 0:
+            out.append(obj & 0xff)
+            return
+        for low, high, code, fmt in _INT_FORMATS:
+            if low <= obj <= high:
+                out.append(code)
+                out += fmt.pack(obj)
+                return
+        raise ValueError("integer too large for msgpack")
+    elif isinstance(obj, float):
+        out.append(0xcb)
+        out += _FLOAT.pack(obj)
+    elif isinstance(obj, str):
+        _pack(str(obj), out)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        _pack_size(out, len(obj), 0, 0, (0xc4, 0xc5, 0xc6))
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        _pack_size(out, len(obj), 0x90, 16, (None, 0xdc, 0xdd))
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _pack(dict(obj), out)
+    else:
+        raise TypeError(f"cannot encode {type(obj).__name__} in msgpack")
+
+
+def _unpack(data, offset):
+    """Decode the value at offset, returns it with the offset that follows"""
+    code = data[offset]
+    offset += 1
+    if code & 0xe0 == 0xa0:
+        end = offset + (code & 0x1f)
+        if end > len(data):
+            raise ValueError("truncated msgpack value")
+        return data[offset:end].decode('utf-8'), end
+    if code < 0x80:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if code < 0x90:
+        return _unpack_items(data, offset, code & 0x0f, 'map')
+    if code < 0xa0:
+        return _unpack_items(data, offset, code & 0x0f, 'array')
+    if code == 0xc0:
+        return None, offset
+    if code == 0xc2:
+        return False, offset
+    if code == 0xc3:
+        return True, offset
+
+    fmt = _FIXED.get(code)
+    if fmt is not None:
+        return fmt.unpack_from(data, offset)[0], offset + fmt.size
+    sized = _SIZED.get(code)
+    if sized is None:
+        raise ValueError(f"unsupported msgpack type 0x{code:02x}")
+    fmt, kind = sized
+    size = fmt.unpack_from(data, offset)[0]
+    offset += fmt.size
+    if kind in ('str', 'bin'):
+        return _unpack_bytes(data, offset, size, kind)
+    return _unpack_items(data, offset, size, kind)
+
+
+def _unpack_bytes(data, offset, size, kind):
+    end = offset + size
+    if end > len(data):
+        raise ValueError("truncated msgpack value")
+    value = bytes(data[offset:end])
+    return (value.decode('utf-8') if kind == 'str' else value), end
+
+
+def _unpack_items(data, offset, count, kind):
+    if kind == 'array':
+        items = []
+        for _ in range(count):
+            item, offset = _unpack(data, offset)
+            items.append(item)
+        return items, offset
+    items = {}
+    for _ in range(count):
+        key, offset = _unpack(data, offset)
+        value, offset = _unpack(data, offset)
+        try:
+            items[key] = value
+        except TypeError:
+            raise ValueError("unhashable msgpack map key")
+    return items, offset
+
+
+def packb(obj):
+    """Encode a value in msgpack"""
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def unpackb(data):
+    """Decode one msgpack value, ValueError if the data is not exactly that"""
+    if msgpack is not None:
+        try:
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        except Exception as e:
+            raise ValueError(f"malformed msgpack: {e}")
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    try:
+        value, offset = _unpack(data, 0)
+    except (IndexError, struct.error, RecursionError) as e:
+        raise ValueError(f"malformed msgpack: {e}")
+    if offset != len(data):
+        raise ValueError("extra data after msgpack value")
+    return value
+
+
+# ==============================================================================
+# FRAMES AND EVENTS
+# ==============================================================================
+
+def encode_event(event):
+    """Length-prefixed frame of one event"""
+    payload = packb(event)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def wrap_text(data):
+    """Frame of encoded server text, for output that has no typed event"""
+    return encode_event({'t': EVENT_TEXT, 'text': data.decode('utf-8', 'replace')})
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def hello_event(prompt):
+    return {'t': EVENT_HELLO, 'version': PROTOCOL_VERSION, 'prompt': prompt}
+
+
+def chat_event(user, room, text):
+    return {'t': EVENT_MESSAGE, 'ts': _now_ms(), 'user': user, 'room': room, 'text': text}
+
+
+def private_event(user, to, text):
+    return {'t': EVENT_MESSAGE, 'ts': _now_ms(), 'user': user, 'to': to, 'text': text}
+
+
+def mention_event(user, room, text):
+    return {'t': EVENT_MENTION, 'ts': _now_ms(), 'user': user, 'room': room, 'text': text}
+
+
+def join_event(user, room):
+    return {'t': EVENT_JOIN, 'user': user, 'room': room}
+
+
+def leave_event(user, room):
+    return {'t': EVENT_LEAVE, 'user': user, 'room': room}
+
+
+def roster_event(added=(), removed=(), full=False):
+    event = {'t': EVENT_ROSTER, 'add': list(added), 'remove': list(removed)}
+    if full:
+        event['full'] = True
+    return event
+
+
+def event_line(event):
+    """Line a text client would type for a client event, None for anything else"""
+    if not isinstance(event, dict):
+        return None
+    kind = event.get('t')
+    text = event.get('text')
+    if kind == EVENT_LINE:
+        line = text
+    elif kind == EVENT_MESSAGE:
+        to = event.get('to')
+        line = f"/msg {to} {text}" if isinstance(to, str) and isinstance(text, str) else text
+    elif kind == EVENT_JOIN:
+        room = event.get('room')
+        line = f"/join {room}" if isinstance(room, str) else None
+    elif kind == EVENT_LEAVE:
+        line = "/leave"
+    else:
+        line = None
+    if not isinstance(line, str):
+        return None
+    # A line break inside an event would split the text lines sent to others
+    return line.replace("\r", " ").replace("\n", " ")
+
+
+# ==============================================================================
+# FRAME BUFFER
+# ==============================================================================
+
+class FrameBuffer:
+    """Incremental buffer turning received frames into lines, in place of a LineBuffer"""
+
+    def __init__(self, max_line_length=MAX_LINE_LENGTH, max_frame_length=MAX_FRAME_LENGTH):
+        self.max_line_length = max_line_length
+        self.max_frame_length = max_frame_length
+        self.buffer = bytearray()
+        self.lines = deque()
+
+    @classmethod
+    def after(cls, line_buffer):
+        """Frame buffer taking over a connection from a line buffer, with every byte it had not consumed"""
+        frame_buffer = cls(line_buffer.max_line_length)
+        frame_buffer.feed(line_buffer.pending_bytes())
+        return frame_buffer
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def feed(self, data):
+        """Append received bytes and queue the lines of every frame they complete"""
+        buffer = self.buffer
+        buffer += data
+        consumed = 0
+        header_size = FRAME_HEADER.size
+
+        while len(buffer) - consumed >= header_size:
+            length = FRAME_HEADER.unpack_from(buffer, consumed)[0]
+            if length > self.max_frame_length:
+                buffer.clear()
+                raise ConnectionResetError(f"frame of {length} bytes is too large")
+            end = consumed + header_size + length
+            if end > len(buffer):
+                break
+            self._push(bytes(buffer[consumed + header_size:end]))
+            consumed = end
+
+        if consumed:
+            del buffer[:consumed]
+
+    def finish(self):
+        """Drop an incomplete frame at end of stream"""
+        self.buffer.clear()
+
+    def pending_bytes(self):
+        """Lines and partial frame not consumed yet, re-encoded as frames"""
+        frames = b"".join(encode_event({'t': EVENT_LINE, 'text': line}) for line in self.lines)
+        return frames + bytes(self.buffer)
+
+    def pop_line(self):
+        """Oldest complete line, or None"""
+        return self.lines.popleft() if self.lines else None
+
+    def pop_all(self):
+        """Every complete line, oldest first"""
+        lines = list(self.lines)
+        self.lines.clear()
+        return lines
+
+    def _push(self, payload):
+        try:
+            decoded = unpackb(payload)
+        except ValueError as e:
+            self.buffer.clear()
+            raise ConnectionResetError(f"malformed frame: {e}")
+        for event in decoded if isinstance(decoded, list) else (decoded,):
+            line = event_line(event)
+            if line is not None:
+                self.lines.append(line[:self.max_line_length])
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Local message bus for Schrimp Chat Server
+Connects the worker processes of one machine over a Unix domain socket so
+they share broadcast frames, private messages, join/leave events and the
+username registry
+"""
+
+import itertools
+import os
+import selectors
+import socket
+import struct
+import threading
+from server_log import log
+
+
+# Message kinds
+PUBLISH = 1    # room, frame, chat flag, binary event (may be empty)
+RESERVE = 2    # request id, username
+RESERVED = 3   # request id, '1' or '0'
+RELEASE = 4    # username
+JOIN = 5       # username, ip, room
+LEAVE = 6      # username
+MOVE = 7       # username, room
+DIRECT = 8     # username, frame, binary event (may be empty)
+
+MESSAGE_HEADER = struct.Struct('!IB')   # payload length, kind
+FIELD_HEADER = struct.Struct('!I')      # field length
+
+RESERVE_TIMEOUT = 2.0                   # seconds a worker waits for the hub's answer
+MAX_PEER_BACKLOG = 64 * 1024 * 1024     # bytes queued for a worker before it is dropped
+
+
+class HubUnavailable(ConnectionError):
+    """The bus hub did not answer, nothing can be decided cluster-wide"""
+
+
+def encode_message(kind, *fields):
+    """Serialize a bus message made of byte or str fields"""
+    parts = []
+    for field in fields:
+        if isinstance(field, str):
+            field = field.encode('utf-8')
+        parts.append(FIELD_HEADER.pack(len(field)))
+        parts.append(field)
+    payload = b"".join(parts)
+    return MESSAGE_HEADER.pack(len(payload), kind) + payload
+
+
+def decode_messages(buffer, max_length=None):
+    """Pop every complete message from a bytearray as (kind, [fields], raw bytes),
+    ValueError for a malformed message or one longer than max_length"""
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= MESSAGE_HEADER.size:
+        length, kind = MESSAGE_HEADER.unpack_from(buffer, offset)
+        if max_length is not None and length > max_length:
+            raise ValueError(f"message of {length} bytes is too large")
+        end = offset + MESSAGE_HEADER.size + length
+        if end > len(buffer):
+            break
+        fields = []
+        position = offset + MESSAGE_HEADER.size
+        while position < end:
+            if position + FIELD_HEADER.size > end:
+                raise ValueError("truncated message field")
+            (field_length,) = FIELD_HEADER.unpack_from(buffer, position)
+            position += FIELD_HEADER.size
+            if position + field_length > end:
+                raise ValueError("truncated message field")
+            fields.append(bytes(buffer[position:position + field_length]))
+            position += field_length
+        messages.append((kind, fields, bytes(buffer[offset:end])))
+        offset = end
+    if offset:
+        del buffer[:offset]
+    return messages
+
+
+# ==============================================================================
+# BUS HUB
+# ==============================================================================
+
+class _Peer:
+    """Hub-side state of one connected worker"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbound = bytearray()
+        self.outbound = bytearray()
+        self.usernames = set()   # names reserved or registered by this worker
+
+
+class BusHub:
+    """Relays bus messages between workers and owns the cluster username registry"""
+
+    def __init__(self, path, chat_log=None):
+        self.path = path
+        self.chat_log = chat_log   # persists chat frames once for the whole cluster
+        self.registry = {}         # {username: peer owning it}
+        self.joined = {}           # {username: [ip, room]} of registered users
+        self.peers = {}            # {socket: _Peer}
+        self.running = False
+        self.selector = selectors.DefaultSelector()
+
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server_socket.bind(path)
+        self.server_socket.listen(64)
+        self.server_socket.setblocking(False)
+
+    def serve_forever(self):
+        """Run the hub loop until stop() is called"""
+        self.running = True
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        while self.running:
+            for key, events in self.selector.select(timeout=0.5):
+                if key.fileobj is self.server_socket:
+                    self._accept()
+                    continue
+                peer = self.peers.get(key.fileobj)
+                if peer is None:
+                    continue
+                if events & selectors.EVENT_READ:
+                    self._read(peer)
+                if events & selectors.EVENT_WRITE and peer.sock in self.peers:
+                    self._flush(peer)
+
+    def stop(self):
+        """Stop the loop and remove the socket file"""
+        self.running = False
+        try:
+            self.server_socket.close()
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _accept(self):
+        try:
+            sock, _ = self.server_socket.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        peer = _Peer(sock)
+        self.peers[sock] = peer
+        self.selector.register(sock, selectors.EVENT_READ)
+
+        # Bring the new worker's roster up to date
+        for username, (ip, room) in self.joined.items():
+            self._send(peer, encode_message(JOIN, username, ip, room))
+
+    def _read(self, peer):
+        try:
+            data = peer.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(peer)
+            return
+        peer.inbound += data
+        for kind, fields, raw in decode_messages(peer.inbound):
+            self._handle(peer, kind, fields, raw)
+
+    def _handle(self, peer, kind, fields, raw):
+        if kind == PUBLISH:
+            self._forward(peer, raw)
+            room, frame, chat = fields[:3]
+            if self.chat_log and chat == b'1':
+                self.chat_log.append(room.decode('utf-8'), frame)
+        elif kind == RESERVE:
+            request_id, username = fields[0], fields[1].decode('utf-8')
+            available = username not in self.registry
+            if available:
+                self.registry[username] = peer
+                peer.usernames.add(username)
+            self._send(peer, encode_message(RESERVED, request_id, b'1' if available else b'0'))
+        elif kind == RELEASE:
+            self._release(peer, fields[0].decode('utf-8'))
+        elif kind == JOIN:
+            username, ip, room = (field.decode('utf-8') for field in fields)
+            self.registry[username] = peer
+            peer.usernames.add(username)
+            self.joined[username] = [ip, room]
+            self._forward(peer, raw)
+        elif kind == LEAVE:
+            self._release(peer, fields[0].decode('utf-8'))
+        elif kind == MOVE:
+            username, room = (field.decode('utf-8') for field in fields)
+            if username in self.joined:
+                self.joined[username][1] = room
+                self._forward(peer, raw)
+        elif kind == DIRECT:
+            # Only the worker holding the user gets a private frame
+            owner = self.registry.get(fields[0].decode('utf-8'))
+            if owner is not None and owner is not peer:
+                self._send(owner, raw)
+
+    def _release(self, peer, username):
+        """Free a username owned by a worker, announcing it if it was registered"""
+        if self.registry.get(username) is not peer:
+            return
+        del self.registry[username]
+        peer.usernames.discard(username)
+        if self.joined.pop(username, None) is not None:
+            self._forward(peer, encode_message(LEAVE, username))
+
+    def _forward(self, origin, raw):
+        for peer in list(self.peers.values()):
+            if peer is not origin:
+                self._send(peer, raw)
+
+    def _send(self, peer, raw):
+        if not peer.outbound:
+            try:
+                sent = peer.sock.send(raw)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self._drop(peer)
+                return
+            if sent == len(raw):
+                return
+            raw = raw[sent:]
+            self.selector.modify(peer.sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        peer.outbound += raw
+        if len(peer.outbound) > MAX_PEER_BACKLOG:
+            log.warning('bus.drop', "Bus: dropping a worker that stopped reading")
+            self._drop(peer)
+
+    def _flush(self, peer):
+        try:
+            sent = peer.sock.send(peer.outbound)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._drop(peer)
+            return
+        del peer.outbound[:sent]
+        if not peer.outbound:
+            self.selector.modify(peer.sock, selectors.EVENT_READ)
+
+    def _drop(self, peer):
+        """Forget a worker that went away and everyone connected through it"""
+        if self.peers.pop(peer.sock, None) is None:
+            return
+        try:
+            self.selector.unregister(peer.sock)
+        except (KeyError, ValueError):
+            pass
+        peer.sock.close()
+        for username in list(peer.usernames):
+            self._release(peer, username)
+
+
+# ==============================================================================
+# BUS CLIENT
+# ==============================================================================
+
+class BusClient:
+    """Worker-side bus connection, applies remote events to the local ClientManager"""
+
+    def __init__(self, path, client_manager, deliver, deliver_direct=None, on_lost=None):
+        self.client_manager = client_manager
+        self.deliver = deliver     # callable(room, frame, chat, event) for frames from other workers
+        self.deliver_direct = deliver_direct   # callable(username, frame, event) for private frames
+        self.on_lost = on_lost     # callable() run once if the hub goes away
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.send_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        self.pending = {}          # {request id: [threading.Event, result]}
+        self.connected = True
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def publish(self, room, frame, chat=False, event=None):
+        """Send a broadcast frame and its binary event to every other worker"""
+        self._send(encode_message(PUBLISH, room or '', frame, b'1' if chat else b'0', event or b''))
+
+    def send_direct(self, username, frame, event=None):
+        """Send a private frame and its binary event to the worker holding a user"""
+        self._send(encode_message(DIRECT, username, frame, event or b''))
+
+    def reserve(self, username):
+        """Claim a username cluster-wide, False if another worker holds it,
+        HubUnavailable when the hub cannot be reached or does not answer in time"""
+        if not self.connected:
+            raise HubUnavailable("bus hub unreachable")
+        request_id = str(next(self.request_ids))
+        waiter = [threading.Event(), None]   # result stays None until the hub answers
+        self.pending[request_id] = waiter
+        try:
+            self._send(encode_message(RESERVE, request_id, username))
+            waiter[0].wait(RESERVE_TIMEOUT)
+            if waiter[1] is None:
+                raise HubUnavailable("bus hub did not answer")
+            return waiter[1]
+        finally:
+            self.pending.pop(request_id, None)
+
+    def release(self, username):
+        self._send(encode_message(RELEASE, username))
+
+    def announce_join(self, username, ip, room):
+        self._send(encode_message(JOIN, username, ip, room))
+
+    def announce_leave(self, username):
+        self._send(encode_message(LEAVE, username))
+
+    def announce_move(self, username, room):
+        self._send(encode_message(MOVE, username, room))
+
+    def close(self):
+        self.connected = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _send(self, raw):
+        if not self.connected:
+            return
+        try:
+            with self.send_lock:
+                self.sock.sendall(raw)
+        except OSError:
+            self.connected = False
+
+    def _read_loop(self):
+        buffer = bytearray()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                lost = self.connected
+                self.connected = False
+                if lost:
+                    log.error('bus.lost', "Bus: lost connection to the hub")
+                    # Wake logins waiting for an answer that will never come
+                    for waiter in list(self.pending.values()):
+                        waiter[0].set()
+                    if self.on_lost:
+                        self.on_lost()
+                return
+            buffer += data
+            for kind, fields, _ in decode_messages(buffer):
+                self._handle(kind, fields)
+
+    def _handle(self, kind, fields):
+        if kind == PUBLISH:
+            room, frame, chat, event = fields
+            self.deliver(room.decode('utf-8') or None, frame, chat == b'1', event or None)
+        elif kind == RESERVED:
+            waiter = self.pending.get(fields[0].decode('utf-8'))
+            if waiter is not None:
+                waiter[1] = fields[1] == b'1'
+                waiter[0].set()
+        elif kind == JOIN:
+            self.client_manager.add_remote(*(field.decode('utf-8') for field in fields))
+        elif kind == LEAVE:
+            self.client_manager.remove_remote(fields[0].decode('utf-8'))
+        elif kind == MOVE:
+            self.client_manager.move_remote(*(field.decode('utf-8') for field in fields))
+        elif kind == DIRECT and self.deliver_direct:
+            self.deliver_direct(fields[0].decode('utf-8'), fields[1], fields[2] or None)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Persistent chat log for Schrimp Chat Server
+Append-only segmented transcript written by a background thread with group
+commit, plus a sparse timestamp/offset index per segment so replays and
+history queries seek straight into a memory-mapped segment
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from server_log import log
+
+
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024   # roll over to a new segment past this size
+DEFAULT_INDEX_INTERVAL = 64 * 1024         # bytes of log between two index entries
+
+# Record: crc32, body length, timestamp, room length, then room and frame bytes.
+# The crc covers everything after itself, so a torn tail is detected on recovery
+RECORD_HEADER = struct.Struct('<IIdH')
+# Index entry: timestamp and offset of the first record of an indexed block
+INDEX_ENTRY = struct.Struct('<dQ')
+
+
+def encode_record(timestamp, room, frame):
+    """Serialize one log record"""
+    room_bytes = room.encode('utf-8')
+    body_length = len(room_bytes) + len(frame)
+    header_tail = RECORD_HEADER.pack(0, body_length, timestamp, len(room_bytes))[4:]
+    crc = zlib.crc32(frame, zlib.crc32(room_bytes, zlib.crc32(header_tail)))
+    return struct.pack('<I', crc) + header_tail + room_bytes + frame
+
+
+def scan_records(buffer, offset=0):
+    """Yield (offset, end, timestamp, room, frame) until the end or a damaged record"""
+    size = len(buffer)
+    while offset + RECORD_HEADER.size <= size:
+        crc, body_length, timestamp, room_length = RECORD_HEADER.unpack_from(buffer, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + body_length
+        if end > size or room_length > body_length:
+            return
+        if zlib.crc32(buffer[offset + 4:end]) != crc:
+            return
+        room = bytes(buffer[start:start + room_length]).decode('utf-8')
+        yield offset, end, timestamp, room, bytes(buffer[start + room_length:end])
+        offset = end
+
+
+# ==============================================================================
+# CHAT LOG
+# ==============================================================================
+
+class ChatLog:
+    """Append-only segmented chat log with a background group-commit writer"""
+
+    def __init__(self, directory, segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 index_interval=DEFAULT_INDEX_INTERVAL, sync=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.sync = sync
+
+        # Counters
+        self.records_written = 0
+        self.batches_written = 0
+
+        self.segments = []        # [(seq, first timestamp or None)] oldest first
+        self.segments_lock = threading.Lock()
+        self.pending = deque()    # (timestamp, room, frame) waiting for the writer
+        self.closed = False
+        self._condition = threading.Condition()
+
+        os.makedirs(directory, exist_ok=True)
+        self.recovery_seconds = self._recover()
+
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    # --------------------------------------------------------------------------
+    # WRITING
+    # --------------------------------------------------------------------------
+
+    def append(self, room, frame, timestamp=None):
+        """Queue a frame for the writer thread, never blocks on disk"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._condition:
+            if self.closed:
+                return
+            self.pending.append((timestamp, room, frame))
+            self._condition.notify()
+
+    def close(self):
+        """Write everything still queued, sync and stop the writer"""
+        with self._condition:
+            if self.closed:
+                return
+            self.closed = True
+            self._condition.notify()
+        self._writer.join()
+        self.log_file.close()
+        self.index_file.close()
+
+    def _write_loop(self):
+        """Write queued records in batches, one fsync per batch"""
+        while True:
+            with self._condition:
+                while not self.pending and not self.closed:
+                    self._condition.wait()
+                if not self.pending:
+                    return
+                batch = list(self.pending)
+                self.pending.clear()
+
+            try:
+                self._write_batch(batch)
+            except OSError as e:
+                log.error('chat_log.write', "Chat log write error: {error}", error=e)
+
+    def _write_batch(self, batch):
+        """Append a batch of records, rolling segments and extending the index"""
+        records = []
+        index_entries = []
+
+        for timestamp, room, frame in batch:
+            record = encode_record(timestamp, room, frame)
+            if self.active_size and self.active_size + len(record) > self.segment_bytes:
+                self._commit(records, index_entries)
+                records, index_entries = [], []
+                self._roll_segment()
+
+            if self.active_size == 0:
+                with self.segments_lock:
+                    self.segments[-1] = (self.active_seq, timestamp)
+            if self.active_size == 0 or self.active_size - self.last_indexed >= self.index_interval:
+                index_entries.append(INDEX_ENTRY.pack(timestamp, self.active_size))
+                self.last_indexed = self.active_size
+
+            records.append(record)
+            self.active_size += len(record)
+
+        self._commit(records, index_entries)
+        self.records_written += len(batch)
+        self.batches_written += 1
+
+    def _commit(self, records, index_entries):
+        """Write records and index entries of the active segment and sync them"""
+        if records:
+            self.log_file.write(b"".join(records))
+            self.log_file.flush()
+        if index_entries:
+            self.index_file.write(b"".join(index_entries))
+            self.index_file.flush()
+        if self.sync and records:
+            os.fsync(self.log_file.fileno())
+
+    def _roll_segment(self):
+        """Close the active segment and start the next one"""
+        self.log_file.close()
+        self.index_file.close()
+        with self.segments_lock:
+            self.segments.append((self.active_seq + 1, None))
+        self._open_active(self.active_seq + 1)
+
+    def _open_active(self, seq):
+        """Open a segment and its index for appending"""
+        self.active_seq = seq
+        self.log_file = open(self._path(seq, 'log'), 'ab')
+        self.index_file = open(self._path(seq, 'idx'), 'ab')
+        self.active_size = self.log_file.tell()
+
+    # --------------------------------------------------------------------------
+    # RECOVERY
+    # --------------------------------------------------------------------------
+
+    def _recover(self):
+        """Load the segment list and repair the tail of the last segment, returns seconds spent"""
+        start = time.perf_counter()
+        seqs = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                      if name.endswith('.log') and name[:-4].isdigit())
+        if not seqs:
+            seqs = [1]
+
+        for seq in seqs:
+            self.segments.append((seq, self._first_timestamp(seq)))
+
+        # Only the last segment can end with a torn write: validate it from its
+        # last intact index entry, index what follows and cut the damaged tail
+        seq = seqs[-1]
+        index = self._load_index(seq)
+        valid_end = 0
+        with open(self._path(seq, 'log'), 'a+b') as log_file:
+            size = log_file.seek(0, os.SEEK_END)
+            if size:
+                with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    while index and next(scan_records(buffer, index[-1][1]), None) is None:
+                        index.pop()
+                    last_indexed = index[-1][1] if index else None
+                    for offset, end, timestamp, _, _ in scan_records(buffer, last_indexed or 0):
+                        if last_indexed is None or offset - last_indexed >= self.index_interval:
+                            index.append((timestamp, offset))
+                            last_indexed = offset
+                        valid_end = end
+            else:
+                index = []
+            if valid_end < size:
+                log_file.truncate(valid_end)
+
+        with open(self._path(seq, 'idx'), 'wb') as index_file:
+            index_file.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+
+        self._open_active(seq)
+        self.last_indexed = index[-1][1] if index else 0
+        self.segments[-1] = (seq, index[0][0] if index else None)
+        return time.perf_counter() - start
+
+    def _first_timestamp(self, seq):
+        """Timestamp of the first record of a segment, None if it is empty"""
+        index = self._load_index(seq)
+        if index:
+            return index[0][0]
+        for _, _, timestamp, _, _ in self._iter_segment(seq):
+            return timestamp
+        return None
+    # --------------------------------------------------------------------------
+    # READING
+    # --------------------------------------------------------------------------
+
+    def read_since(self, timestamp, room=None):
+        """Yield (timestamp, room, frame) of records logged at or after a timestamp"""
+        with self.segments_lock:
+            segments = [segment for segment in self.segments if segment[1] is not None]
+        if not segments:
+            return
+
+        # Last segment starting at or before the timestamp, via its first record
+        position = max(bisect.bisect_right([first for _, first in segments], timestamp) - 1, 0)
+        for number, (seq, _) in enumerate(segments[position:]):
+            offset = self._seek_time(seq, timestamp) if number == 0 else 0
+            for _, _, record_time, record_room, frame in self._iter_segment(seq, offset):
+                if record_time >= timestamp and (room is None or record_room == room):
+                    yield record_time, record_room, frame
+
+    def read_tail(self, max_bytes, room=None):
+        """Yield (timestamp, room, frame) of roughly the last max_bytes of the log"""
+        with self.segments_lock:
+            segments = [seq for seq, first in self.segments if first is not None]
+
+        # Walk back over whole segments, then seek inside the oldest one needed
+        needed = max_bytes
+        start = len(segments)
+        offset = 0
+        while start > 0 and needed > 0:
+            start -= 1
+            size = os.path.getsize(self._path(segments[start], 'log'))
+            if size >= needed:
+                offset = self._seek_offset(segments[start], size - needed)
+            needed -= size
+
+        for number, seq in enumerate(segments[start:]):
+            for _, _, record_time, record_room, frame in self._iter_segment(seq, offset if number == 0 else 0):
+                if room is None or record_room == room:
+                    yield record_time, record_room, frame
+
+    def _iter_segment(self, seq, offset=0):
+        """Yield records of a segment from an indexed offset through a read-only mmap"""
+        try:
+            log_file = open(self._path(seq, 'log'), 'rb')
+        except FileNotFoundError:
+            return
+        with log_file:
+            if os.fstat(log_file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                for record in scan_records(buffer, offset):
+                    yield record
+
+    def _seek_time(self, seq, timestamp):
+        """Offset of the last indexed block starting at or before a timestamp"""
+        index = self._load_index(seq)
+        position = bisect.bisect_right([entry[0] for entry in index], timestamp) - 1
+        return index[position][1] if position >= 0 else 0
+
+    def _seek_offset(self, seq, offset):
+        """First indexed offset at or after a byte position"""
+        index = self._load_index(seq)
+        offsets = [entry[1] for entry in index]
+        position = bisect.bisect_left(offsets, offset)
+        return offsets[position] if position < len(offsets) else (offsets[-1] if offsets else 0)
+
+    def _load_index(self, seq):
+        """Read the sparse index of a segment as [(timestamp, offset)]"""
+        try:
+            with open(self._path(seq, 'idx'), 'rb') as index_file:
+                data = index_file.read()
+        except FileNotFoundError:
+            return []
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        return list(INDEX_ENTRY.iter_unpack(data[:usable]))
+
+    def _path(self, seq, extension):
+        return os.path.join(self.directory, f"{seq:010d}.{extension}")
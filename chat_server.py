@@ -3,46 +3,224 @@
 Simple Chat Server - Schrimp
 Main entry point for the chat server application
 
-Usage: python chat_server.py [port] [password]
+Usage: python chat_server.py [port] [password] [--mode threaded|async]
+                             [--high-water BYTES] [--slow-policy drop-oldest|disconnect]
+                             [--history-bytes BYTES] [--history-replay N]
+                             [--log-dir PATH] [--log-segment-bytes BYTES]
+                             [--banned-words PATH] [--rate-limit N] [--workers N]
+                             [--link-port PORT] [--peer HOST:PORT ...] [--link-secret SECRET]
+                             [--log-level LEVEL] [--log-json] [--no-log-content]
+                             [--metrics-port PORT] [--backlog N] [--max-clients N]
+                             [--max-per-ip N] [--handshake-timeout SECONDS]
+                             [--idle-timeout SECONDS] [--inbox-size N]
+                             [--drain-timeout SECONDS] [--handoff-path PATH] [--takeover]
+                             [--stage-workers N]
 Client connection: nc <server_ip> <port>
+Bots and rich clients: answer the first prompt with '/binary' to switch to the
+framed protocol of binary_protocol.py, on the same port
 
 Arguments:
 - port: Server port (default: 3031)
 - password: Optional password for authentication
+- --mode: 'threaded' runs one thread per client (default),
+          'async' runs every client on a single event loop
+- --high-water: Bytes queued per client before the slow-consumer policy applies
+- --slow-policy: 'drop-oldest' discards the oldest queued messages (default),
+                 'disconnect' evicts the client
+- --history-bytes: Memory budget for recent messages kept for replay (0 disables)
+- --history-replay: Number of recent messages replayed to a client on join
+- --log-dir: Directory of the persistent chat log (disabled when omitted)
+- --log-segment-bytes: Size at which the chat log rolls over to a new segment
+- --banned-words: File with one banned word per line, reloaded when it changes
+- --rate-limit: Messages per minute allowed per user (three times that per IP)
+- --workers: Number of server processes sharing the port (0 = one per core),
+             linked by a local bus so they behave as a single server
+- --link-port: Port on which other Schrimp nodes can link to this one
+- --peer: Node to link with, repeat for several; links are re-established
+          with backoff when they drop
+- --link-secret: Shared secret every linked node must present, required
+                 with --link-port and --peer
+- --log-level: debug, info (default), warning or error
+- --log-json: Write the server log as JSON lines
+- --no-log-content: Never write chat message content to the server log
+- --metrics-port: Serve Prometheus metrics on 127.0.0.1:PORT/metrics
+                  (worker N of a cluster uses PORT + N)
+- --backlog: Length of the listen queue for connections not yet accepted
+- --max-clients: Connections held at once, 0 for no limit (per worker)
+- --max-per-ip: Connections held at once from one address, 0 for no limit
+- --handshake-timeout: Seconds a client has to answer each login prompt
+- --idle-timeout: Seconds without input before a client is dropped (0 = never)
+- --inbox-size: Private messages and mentions kept per user for /inbox (0 disables)
+- --drain-timeout: Seconds clients get to receive queued output when SIGTERM
+                   stops the server
+- --handoff-path: Unix socket used for hot restarts; SIGHUP starts a new process
+                  that takes over the listener and every connected client
+- --takeover: Take over from the server listening on --handoff-path
+- --stage-workers: Threads running the deferred message stages (server log
+                   and persistence) in batches, 0 runs them in the reader
 """
 
-import sys
+import argparse
 from server import ChatServer
+from async_server import AsyncChatServer
+from connection import DEFAULT_HIGH_WATER, SLOW_CONSUMER_POLICIES, POLICY_DROP_OLDEST
+from history import DEFAULT_HISTORY_BYTES, DEFAULT_REPLAY_COUNT, DEFAULT_INBOX_SIZE
+from chat_log import DEFAULT_SEGMENT_BYTES
+from cluster import ChatCluster, default_worker_count
+from federation import parse_peer
+from server_log import LEVELS
+from handoff import DEFAULT_DRAIN_TIMEOUT
+from pipeline import DEFAULT_STAGE_WORKERS
+from admission import (DEFAULT_BACKLOG, DEFAULT_MAX_CLIENTS, DEFAULT_MAX_PER_IP,
+                       DEFAULT_HANDSHAKE_TIMEOUT, DEFAULT_IDLE_TIMEOUT)
+
+
+# Server implementations selectable with --mode
+SERVER_MODES = {
+    'threaded': ChatServer,
+    'async': AsyncChatServer,
+}
 
 
 # ==============================================================================
 # MAIN FUNCTION
 # ==============================================================================
 
+def positive_int(value):
+    """argparse type of a count that must be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Schrimp chat server")
+    parser.add_argument('port', nargs='?', default='3031', help="Server port (default: 3031)")
+    parser.add_argument('password', nargs='?', default=None, help="Optional password for authentication")
+    parser.add_argument('--mode', choices=sorted(SERVER_MODES), default='threaded',
+                        help="Connection handling model (default: threaded)")
+    parser.add_argument('--high-water', type=int, default=DEFAULT_HIGH_WATER,
+                        help=f"Outbound bytes queued per client (default: {DEFAULT_HIGH_WATER})")
+    parser.add_argument('--slow-policy', choices=SLOW_CONSUMER_POLICIES, default=POLICY_DROP_OLDEST,
+                        help="What to do with clients that fall behind (default: drop-oldest)")
+    parser.add_argument('--history-bytes', type=int, default=DEFAULT_HISTORY_BYTES,
+                        help=f"Memory budget for message history, 0 disables (default: {DEFAULT_HISTORY_BYTES})")
+    parser.add_argument('--history-replay', type=int, default=DEFAULT_REPLAY_COUNT,
+                        help=f"Messages replayed to a client on join (default: {DEFAULT_REPLAY_COUNT})")
+    parser.add_argument('--log-dir', default=None,
+                        help="Directory of the persistent chat log (default: disabled)")
+    parser.add_argument('--log-segment-bytes', type=int, default=DEFAULT_SEGMENT_BYTES,
+                        help=f"Chat log segment size (default: {DEFAULT_SEGMENT_BYTES})")
+    parser.add_argument('--banned-words', default=None,
+                        help="File with one banned word per line, reloaded on change")
+    parser.add_argument('--rate-limit', type=positive_int, default=15,
+                        help="Messages per minute per user, 3x per IP (default: 15)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Server processes sharing the port, 0 for one per core (default: 1)")
+    parser.add_argument('--link-port', type=int, default=None,
+                        help="Accept links from other nodes on this port (default: disabled)")
+    parser.add_argument('--peer', action='append', default=[], type=parse_peer, metavar='HOST:PORT',
+                        help="Link with another node, may be repeated")
+    parser.add_argument('--link-secret', default=None,
+                        help="Shared secret required on node links, mandatory with --link-port and --peer")
+    parser.add_argument('--log-level', choices=sorted(LEVELS), default='info',
+                        help="Lowest level written to the server log (default: info)")
+    parser.add_argument('--log-json', action='store_true',
+                        help="Write the server log as JSON lines")
+    parser.add_argument('--no-log-content', dest='log_content', action='store_false',
+                        help="Do not log the content of chat messages")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Local port of the Prometheus metrics endpoint (default: disabled)")
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG,
+                        help=f"Listen queue length (default: {DEFAULT_BACKLOG})")
+    parser.add_argument('--max-clients', type=int, default=DEFAULT_MAX_CLIENTS,
+                        help=f"Connections per server process, 0 for no limit (default: {DEFAULT_MAX_CLIENTS})")
+    parser.add_argument('--max-per-ip', type=int, default=DEFAULT_MAX_PER_IP,
+                        help=f"Connections per address, 0 for no limit (default: {DEFAULT_MAX_PER_IP})")
+    parser.add_argument('--handshake-timeout', type=float, default=DEFAULT_HANDSHAKE_TIMEOUT,
+                        help=f"Seconds to answer each login prompt, 0 disables (default: {DEFAULT_HANDSHAKE_TIMEOUT:g})")
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="Seconds without input before a client is dropped (default: disabled)")
+    parser.add_argument('--inbox-size', type=int, default=DEFAULT_INBOX_SIZE,
+                        help=f"Private messages kept per user, 0 disables (default: {DEFAULT_INBOX_SIZE})")
+    parser.add_argument('--drain-timeout', type=float, default=DEFAULT_DRAIN_TIMEOUT,
+                        help=f"Seconds to flush client output on SIGTERM (default: {DEFAULT_DRAIN_TIMEOUT:g})")
+    parser.add_argument('--handoff-path', default=None,
+                        help="Unix socket for hot restarts (default: disabled)")
+    parser.add_argument('--takeover', action='store_true',
+                        help="Take over the listener and clients of the server at --handoff-path")
+    parser.add_argument('--stage-workers', type=int, default=DEFAULT_STAGE_WORKERS,
+                        help="Threads running deferred message stages, 0 runs them inline (default: 0)")
+    args = parser.parse_args()
+    if args.link_port and not args.link_secret:
+        parser.error("--link-port needs --link-secret, otherwise any host could link and speak as any user")
+    if args.peer and not args.link_secret:
+        parser.error("--peer needs --link-secret, the peer refuses links that do not present it")
+    return args
+
+
 def main():
     """Main function to parse arguments and start the server"""
     # Handle command line arguments
+    args = parse_arguments()
     port = 3031
-    password = None
-    
-    if len(sys.argv) >= 2:
-        try:
-            port = int(sys.argv[1])
-        except ValueError:
-            print("Invalid port, using default port 3031")
-    
-    if len(sys.argv) >= 3:
-        password = sys.argv[2]
-    
+    password = args.password
+
+    try:
+        port = int(args.port)
+    except ValueError:
+        print("Invalid port, using default port 3031")
+
     # Password is optional
-    
+
     # --------------------------------------------------------------------------
     # SERVER INITIALIZATION
     # --------------------------------------------------------------------------
-    
-    # Create and start server
-    server = ChatServer(port=port, password=password)
-    
+
+    # Create and start server, or a cluster of worker processes
+    server_class = SERVER_MODES[args.mode]
+    options = dict(
+        port=port,
+        password=password,
+        high_water=args.high_water,
+        slow_consumer_policy=args.slow_policy,
+        history_bytes=args.history_bytes,
+        history_replay=args.history_replay,
+        log_dir=args.log_dir,
+        log_segment_bytes=args.log_segment_bytes,
+        banned_words_file=args.banned_words,
+        rate_limit=args.rate_limit,
+        log_level=args.log_level,
+        log_json=args.log_json,
+        log_content=args.log_content,
+        metrics_port=args.metrics_port,
+        backlog=args.backlog,
+        max_clients=args.max_clients,
+        max_per_ip=args.max_per_ip,
+        handshake_timeout=args.handshake_timeout,
+        idle_timeout=args.idle_timeout,
+        inbox_size=args.inbox_size,
+        drain_timeout=args.drain_timeout,
+        stage_workers=args.stage_workers
+    )
+    workers = args.workers if args.workers > 0 else default_worker_count()
+    federated = args.link_port or args.peer
+    if federated and workers > 1:
+        print("Federation runs in a single process, ignoring --workers")
+        workers = 1
+    if args.handoff_path and (workers > 1 or federated):
+        print("Hot restart needs a single unlinked process, ignoring --handoff-path")
+        args.handoff_path = None
+    if workers > 1:
+        server = ChatCluster(server_class, workers, **options)
+    else:
+        server = server_class(handoff_path=args.handoff_path, takeover=args.takeover, **options)
+        if federated:
+            server.attach_federation(args.link_port, args.peer, args.link_secret)
+    server.install_signal_handlers()
+
     try:
         server.start()
     except KeyboardInterrupt:
@@ -55,4 +233,4 @@ def main():
 # ==============================================================================
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -3,8 +3,39 @@
 Client management for Schrimp Chat Server
 """
 
+import bisect
 import socket
+import threading
 from datetime import datetime
+from server_log import log
+from metrics import BROADCAST_RECIPIENTS, BROADCAST_SECONDS, DISCONNECTS, NETWORK_ERRORS, DIRECT_FRAMES
+from binary_protocol import encode_event, roster_event, wrap_text
+from bus import HubUnavailable
+
+
+DEFAULT_ROOM = 'general'  # room every client starts in
+USERS_PAGE_SIZE = 50      # users listed by one /users page or search
+
+
+def encode_frame(message):
+    """Serialize a chat line once into the bytes sent to every recipient"""
+    return (message + "\n").encode('utf-8')
+
+
+# ==============================================================================
+# CLIENT RECORD
+# ==============================================================================
+
+class ClientInfo:
+    """Compact record of a connected client"""
+    
+    __slots__ = ('pseudo', 'ip', 'connected_at', 'room')
+    
+    def __init__(self, pseudo, ip, connected_at=None, room=DEFAULT_ROOM):
+        self.pseudo = pseudo
+        self.ip = ip
+        self.connected_at = connected_at or datetime.now()
+        self.room = room
 
 
 # ==============================================================================
@@ -15,57 +46,444 @@ class ClientManager:
     """Manages connected clients"""
     
     def __init__(self):
-        self.clients = {}  # {socket: {'pseudo': str, 'ip': str, 'connected_at': datetime}}
+        self.lock = threading.RLock()
+        self.clients = {}    # {socket: ClientInfo}
+        self.usernames = {}  # {username: socket}, includes names reserved during login
+        self.pending = {}    # {socket: username} reserved but not registered yet
+        self.rooms = {}      # {room: set of sockets}
+        self._recipients = None      # cached tuple of sockets, rebuilt after a change
+        self._room_recipients = {}   # {room: cached tuple of member sockets}
+        
+        # Sorted names of every local and remote user, updated on join and leave,
+        # with the rendered /users pages cached until the next change
+        self.roster = []
+        self._roster_pages = {}      # {page: encoded listing}
+        
+        # Users of the other workers or federated nodes, kept in sync by the bus
+        # or the federation links
+        self.bus = None              # BusClient, set when running as a worker
+        self.federation = None       # Federation, set when linked with other nodes
+        self.remote_users = {}       # {username: ClientInfo}
+        self.remote_rooms = {}       # {room: number of remote members}
+        
+        # Recent private messages of every user, set by the server when enabled
+        self.inbox = None            # DirectInbox
+        
+        # Clients speaking the binary protocol get typed events instead of text
+        # lines, roster changes are sent to them through dispatch, which runs a
+        # callback where connections may be used
+        self.binary_clients = set()
+        self.dispatch = None
+    
+    def reserve_username(self, username, client_socket):
+        """Atomically claim a username for a client, False if it is taken,
+        HubUnavailable when the bus hub cannot decide"""
+        with self.lock:
+            if username in self.usernames or username in self.remote_users:
+                return False
+            self.usernames[username] = client_socket
+            self.pending[client_socket] = username
+        
+        # Another worker may be claiming the same name, the bus hub decides
+        if self.bus:
+            try:
+                reserved = self.bus.reserve(username)
+            except HubUnavailable:
+                with self.lock:
+                    self._unreserve(client_socket)
+                # The hub answers in order, a grant arriving late is withdrawn by this
+                self.bus.release(username)
+                raise
+            if not reserved:
+                with self.lock:
+                    self._unreserve(client_socket)
+                return False
+        return True
+    
+    def release_username(self, client_socket):
+        """Drop a reservation that never turned into a registration"""
+        with self.lock:
+            username = self._unreserve(client_socket)
+        if username is not None and self.bus:
+            self.bus.release(username)
     
-    def add_client(self, client_socket, pseudo, ip):
+    def _unreserve(self, client_socket):
+        """Forget a pending reservation (lock held), returns the username"""
+        username = self.pending.pop(client_socket, None)
+        if username is not None and self.usernames.get(username) is client_socket:
+            del self.usernames[username]
+        return username
+    
+    def add_client(self, client_socket, pseudo, ip, room=DEFAULT_ROOM):
         """Add a new client to the manager"""
-        self.clients[client_socket] = {
-            'pseudo': pseudo,
-            'ip': ip,
-            'connected_at': datetime.now()
-        }
-        print(f"{pseudo} ({ip}) connected")
+        with self.lock:
+            self.pending.pop(client_socket, None)
+            self.usernames[pseudo] = client_socket
+            self.clients[client_socket] = ClientInfo(pseudo, ip, room=room)
+            self._enter_room(client_socket, room)
+            self._recipients = None
+            added = self._roster_add(pseudo)
+            if client_socket.binary:
+                self.binary_clients.add(client_socket)
+                snapshot = encode_event(roster_event(self.roster, full=True))
+        if client_socket.binary:
+            self._send_encoded(client_socket, snapshot)
+        if added:
+            self._roster_changed(added=(pseudo,), exclude_client=client_socket)
+        if self.bus:
+            self.bus.announce_join(pseudo, ip, room)
+        if self.federation:
+            self.federation.announce_join(pseudo, ip, room)
+        log.info('client.connect', "{user} ({ip}) connected", user=pseudo, ip=ip, room=room)
     
     def remove_client(self, client_socket):
         """Remove a client from the manager"""
-        if client_socket in self.clients:
-            pseudo = self.clients[client_socket]['pseudo']
-            del self.clients[client_socket]
-            print(f"{pseudo} disconnected")
-            return pseudo
-        return None
+        pseudo = self._discard(client_socket)
+        if pseudo is not None:
+            DISCONNECTS.inc()
+            log.info('client.disconnect', "{user} disconnected", user=pseudo)
+        return pseudo
+    
+    def _discard(self, client_socket):
+        """Unregister a client and free its username, returns the pseudo"""
+        with self.lock:
+            client_info = self.clients.pop(client_socket, None)
+            if client_info is None:
+                self.release_username(client_socket)
+                return None
+            if self.usernames.get(client_info.pseudo) is client_socket:
+                del self.usernames[client_info.pseudo]
+            self._leave_room(client_socket, client_info.room)
+            self._recipients = None
+            self.binary_clients.discard(client_socket)
+            removed = self._roster_remove(client_info.pseudo)
+        if removed:
+            self._roster_changed(removed=(client_info.pseudo,))
+        if self.bus:
+            self.bus.announce_leave(client_info.pseudo)
+        if self.federation:
+            self.federation.announce_leave(client_info.pseudo)
+        return client_info.pseudo
+    
+    # --------------------------------------------------------------------------
+    # REMOTE USERS
+    # --------------------------------------------------------------------------
+    
+    def add_remote(self, username, ip, room):
+        """Record a user connected to another worker"""
+        with self.lock:
+            previous = self.remote_users.pop(username, None)
+            if previous is not None:
+                self._count_remote_leave(previous.room)
+            self.remote_users[username] = ClientInfo(username, ip, room=room)
+            self.remote_rooms[room] = self.remote_rooms.get(room, 0) + 1
+            added = self._roster_add(username)
+        if added:
+            self._roster_changed(added=(username,))
+    
+    def remove_remote(self, username):
+        """Forget a user of another worker"""
+        removed = False
+        with self.lock:
+            client_info = self.remote_users.pop(username, None)
+            if client_info is not None:
+                self._count_remote_leave(client_info.room)
+                removed = self._roster_remove(username)
+        if removed:
+            self._roster_changed(removed=(username,))
+    
+    def move_remote(self, username, room):
+        """Track a room change of a user of another worker"""
+        with self.lock:
+            client_info = self.remote_users.get(username)
+            if client_info is not None:
+                self._count_remote_leave(client_info.room)
+                client_info.room = room
+                self.remote_rooms[room] = self.remote_rooms.get(room, 0) + 1
+    
+    def _count_remote_leave(self, room):
+        count = self.remote_rooms.get(room, 0) - 1
+        if count > 0:
+            self.remote_rooms[room] = count
+        else:
+            self.remote_rooms.pop(room, None)
+    
+    # --------------------------------------------------------------------------
+    # ROOMS
+    # --------------------------------------------------------------------------
+    
+    def join_room(self, client_socket, room):
+        """Move a client to another room, returns the room it left"""
+        with self.lock:
+            client_info = self.clients.get(client_socket)
+            if client_info is None:
+                return None
+            previous_room = client_info.room
+            if previous_room == room:
+                return previous_room
+            self._leave_room(client_socket, previous_room)
+            self._enter_room(client_socket, room)
+            client_info.room = room
+        if self.bus:
+            self.bus.announce_move(client_info.pseudo, room)
+        if self.federation:
+            self.federation.announce_move(client_info.pseudo, room)
+        return previous_room
+    
+    def get_room(self, client_socket):
+        """Room a client is currently in, None if it is not registered"""
+        client_info = self.clients.get(client_socket)
+        return client_info.room if client_info else None
+    
+    def get_ip(self, client_socket):
+        """IP address of a registered client, None if it is not registered"""
+        client_info = self.clients.get(client_socket)
+        return client_info.ip if client_info else None
+    
+    def get_room_count(self, room):
+        """Number of clients in a room"""
+        return len(self.rooms.get(room, ())) + self.remote_rooms.get(room, 0)
+    
+    def get_rooms_list(self, current_room=None):
+        """Get a formatted list of rooms and their member counts"""
+        with self.lock:
+            counts = dict(self.remote_rooms)
+            for room, members in self.rooms.items():
+                counts[room] = counts.get(room, 0) + len(members)
+            rooms = sorted(counts.items())
+        rooms_list = "Rooms:\n"
+        for room, count in rooms:
+            marker = " (you are here)" if room == current_room else ""
+            rooms_list += f"  • #{room}: {count} user{'s' if count != 1 else ''}{marker}\n"
+        return rooms_list
+    
+    def _enter_room(self, client_socket, room):
+        """Add a member to the room index (lock held)"""
+        self.rooms.setdefault(room, set()).add(client_socket)
+        self._room_recipients.pop(room, None)
+    
+    def _leave_room(self, client_socket, room):
+        """Remove a member from the room index, dropping emptied rooms (lock held)"""
+        members = self.rooms.get(room)
+        if members is None:
+            return
+        members.discard(client_socket)
+        if not members:
+            del self.rooms[room]
+        self._room_recipients.pop(room, None)
     
     def is_username_taken(self, username):
         """Check if a username is already taken"""
-        return any(client_info['pseudo'] == username for client_info in self.clients.values())
+        return username in self.usernames or username in self.remote_users
+    
+    def locate_user(self, username):
+        """Room of a user and their socket if connected to this process, (None, None) if offline"""
+        client_socket = self.usernames.get(username)
+        client_info = self.clients.get(client_socket) if client_socket is not None else None
+        if client_info is not None:
+            return client_info.room, client_socket
+        client_info = self.remote_users.get(username)
+        return (client_info.room, None) if client_info else (None, None)
     
     def get_client_count(self):
         """Get the number of connected clients"""
-        return len(self.clients)
+        return len(self.clients) + len(self.remote_users)
+    
+    # --------------------------------------------------------------------------
+    # ROSTER
+    # --------------------------------------------------------------------------
+    
+    def _roster_add(self, username):
+        """Insert a name in the sorted roster (lock held), True if it was not there"""
+        self._roster_pages.clear()
+        index = bisect.bisect_left(self.roster, username)
+        if index == len(self.roster) or self.roster[index] != username:
+            self.roster.insert(index, username)
+            return True
+        return False
+    
+    def _roster_remove(self, username):
+        """Drop a name from the roster unless it is still connected somewhere (lock held), True if dropped"""
+        if username in self.remote_users or self.usernames.get(username) in self.clients:
+            return False
+        self._roster_pages.clear()
+        index = bisect.bisect_left(self.roster, username)
+        if index < len(self.roster) and self.roster[index] == username:
+            del self.roster[index]
+            return True
+        return False
+    
+    def _roster_changed(self, added=(), removed=(), exclude_client=None):
+        """Send a roster delta to the binary clients of this process"""
+        if not self.binary_clients:
+            return
+        frame = encode_event(roster_event(added, removed))
+        if self.dispatch:
+            self.dispatch(self._send_to_binary, frame, exclude_client)
+        else:
+            self._send_to_binary(frame, exclude_client)
+    
+    def _send_to_binary(self, frame, exclude_client=None):
+        for client_socket in tuple(self.binary_clients):
+            if client_socket is not exclude_client:
+                self._send_encoded(client_socket, frame)
+    
+    def _send_encoded(self, client_socket, frame):
+        try:
+            client_socket.send(frame, encoded=True)
+        except socket.error:
+            # Its reader notices the closed connection and unregisters it
+            pass
+    
+    def _user_ip(self, username):
+        """IP address of a local or remote user (lock held)"""
+        client_info = self.clients.get(self.usernames.get(username)) or self.remote_users.get(username)
+        return client_info.ip if client_info else '?'
     
-    def get_clients_list(self):
-        """Get a formatted list of connected clients"""
-        users_list = "Connected users:\n"
-        for client_info in self.clients.values():
-            users_list += f"  • {client_info['pseudo']} ({client_info['ip']})\n"
-        return users_list
+    def get_users_page(self, page=1):
+        """Encoded /users listing of one page, rendered once per roster change"""
+        cached = self._roster_pages.get(page)
+        if cached is not None:
+            return cached
+        with self.lock:
+            total = len(self.roster)
+            pages = max(1, -(-total // USERS_PAGE_SIZE))
+            page = min(max(page, 1), pages)
+            start = (page - 1) * USERS_PAGE_SIZE
+            lines = [f"Connected users ({total}, page {page}/{pages}):\n"]
+            for username in self.roster[start:start + USERS_PAGE_SIZE]:
+                lines.append(f"  • {username} ({self._user_ip(username)})\n")
+            if page < pages:
+                lines.append(f"Type '/users {page + 1}' for the next page or '/users <prefix>' to search\n")
+            listing = "".join(lines).encode('utf-8')
+            self._roster_pages[page] = listing
+        return listing
     
-    def broadcast_message(self, message, exclude_client=None):
-        """Broadcast a message to all connected clients"""
+    def find_users(self, prefix):
+        """Encoded listing of the users whose name starts with a prefix, from the sorted roster"""
+        with self.lock:
+            index = bisect.bisect_left(self.roster, prefix)
+            matches = []
+            while index < len(self.roster) and self.roster[index].startswith(prefix):
+                if len(matches) == USERS_PAGE_SIZE:
+                    break
+                username = self.roster[index]
+                matches.append(f"  • {username} ({self._user_ip(username)})\n")
+                index += 1
+            more = index < len(self.roster) and self.roster[index].startswith(prefix)
+        if not matches:
+            return f"No user matches '{prefix}'\n".encode('utf-8')
+        header = f"Users matching '{prefix}'{f' (first {USERS_PAGE_SIZE})' if more else ''}:\n"
+        return (header + "".join(matches)).encode('utf-8')
+    
+    def _get_recipients(self, room=None):
+        """Snapshot of connected sockets (of one room), safe to iterate without the lock"""
+        if room is not None:
+            recipients = self._room_recipients.get(room)
+            if recipients is None:
+                with self.lock:
+                    members = self.rooms.get(room)
+                    if members is None:
+                        return ()
+                    recipients = self._room_recipients[room] = tuple(members)
+            return recipients
+        
+        recipients = self._recipients
+        if recipients is None:
+            with self.lock:
+                recipients = self._recipients = tuple(self.clients)
+        return recipients
+    
+    def encode_event(self, event):
+        """Binary frame of an event, None when no binary client here or elsewhere can need it"""
+        if self.binary_clients or self.bus or self.federation:
+            return encode_event(event)
+        return None
+    
+    def broadcast_message(self, message, exclude_client=None, room=None, event=None):
+        """Broadcast a message to all connected clients, or to one room, with its typed event if any"""
+        encoded_event = self.encode_event(event) if event is not None else None
+        self.broadcast_frame(encode_frame(message), exclude_client=exclude_client, room=room, event=encoded_event)
+    
+    def broadcast_frame(self, frame, exclude_client=None, room=None, chat=False, event=None, skip=()):
+        """Broadcast an already encoded frame, shared by every recipient, event goes to binary clients"""
+        self.deliver_frame(frame, exclude_client=exclude_client, room=room, event=event, skip=skip)
+        if self.bus:
+            self.bus.publish(room, frame, chat, event)
+        if self.federation:
+            self.federation.publish(room, frame, chat, event)
+    
+    def deliver_frame(self, frame, exclude_client=None, room=None, event=None, skip=()):
+        """Send a frame to the clients connected to this process, or its event to binary clients
+
+        Clients in `skip` already got their own copy of the message
+        """
         disconnected_clients = []
+        started = BROADCAST_SECONDS.start()
+        recipients = self._get_recipients(room)
+        binary_clients = self.binary_clients
         
-        for client_socket in list(self.clients.keys()):
-            if client_socket != exclude_client:
+        for client_socket in recipients:
+            if client_socket is not exclude_client and client_socket not in skip:
                 try:
-                    client_socket.send((message + "\n").encode('utf-8'))
+                    if binary_clients and client_socket in binary_clients:
+                        # Text without a typed event is framed once, like the text frame
+                        if event is None:
+                            event = wrap_text(frame)
+                        client_socket.send(event, encoded=True)
+                    else:
+                        client_socket.send(frame)
                 except socket.error:
                     disconnected_clients.append(client_socket)
         
+        BROADCAST_SECONDS.stop(started)
+        BROADCAST_RECIPIENTS.inc(len(recipients))
+        
         # Clean up disconnected clients
         for client_socket in disconnected_clients:
-            if client_socket in self.clients:
-                pseudo = self.clients[client_socket]['pseudo']
-                del self.clients[client_socket]
-                print(f"{pseudo} disconnected (network error)")
+            self._drop_unreachable(client_socket)
+    
+    def _drop_unreachable(self, client_socket):
+        """Unregister a client whose connection failed on send"""
+        pseudo = self._discard(client_socket)
+        if pseudo is not None:
+            DISCONNECTS.inc()
+            NETWORK_ERRORS.inc()
+            log.warning('client.disconnect', "{user} disconnected (network error)", user=pseudo)
+    
+    # --------------------------------------------------------------------------
+    # DIRECT DELIVERY
+    # --------------------------------------------------------------------------
+    
+    def send_to_user(self, username, frame, event=None):
+        """Deliver a frame to one user wherever they are connected, False if they are offline"""
+        if self.deliver_direct(username, frame, event):
+            return True
+        if username not in self.remote_users:
+            return False
+        # The bus hub or the links route it to the process holding the user
+        if self.bus:
+            self.bus.send_direct(username, frame, event)
+        if self.federation:
+            self.federation.send_direct(username, frame, event)
+        return True
+    
+    def deliver_direct(self, username, frame, event=None):
+        """Send a frame to a user of this process and keep it in their inbox, False if they are not here"""
+        client_socket = self.usernames.get(username)
+        client_info = self.clients.get(client_socket) if client_socket is not None else None
+        if client_info is None:
+            return False
+        if self.inbox:
+            self.inbox.append(username, client_info.ip, frame)
+        DIRECT_FRAMES.inc()
+        try:
+            if event is not None and client_socket.binary:
+                client_socket.send(event, encoded=True)
+            else:
+                client_socket.send(frame)
+        except socket.error:
+            self._drop_unreachable(client_socket)
+        return True
     
 # No encrypted broadcast needed - encryption removed
\ No newline at end of file
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Multi-process launcher for Schrimp Chat Server
+Starts one worker per core, each accepting on the same port through
+SO_REUSEPORT, and links them with the local bus so rooms, usernames and
+broadcasts span every worker
+"""
+
+import ctypes
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from bus import BusHub
+from chat_log import ChatLog, DEFAULT_SEGMENT_BYTES
+from history import DEFAULT_HISTORY_BYTES
+from handoff import sd_notify
+from server_log import log
+
+
+RESPAWN_DELAY = 1.0    # seconds before a crashed worker is restarted
+SUPERVISE_INTERVAL = 0.5
+PR_SET_PDEATHSIG = 1   # prctl option, signal sent to a process when its parent dies
+
+
+def default_worker_count():
+    """One worker per available core"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# ==============================================================================
+# WORKER
+# ==============================================================================
+
+def die_with_parent():
+    """Have the kernel send SIGTERM to this process when the supervisor dies (Linux only)"""
+    try:
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    except (OSError, AttributeError):
+        pass
+
+
+def exit_orphaned():
+    """Exit a worker whose hub is gone: without it no login can reserve a username"""
+    log.error('cluster.orphaned', "Worker {pid} lost the bus hub, exiting", pid=os.getpid())
+    log.flush()
+    os._exit(1)
+
+
+def run_worker(server_class, options, bus_path, seed_frames, index=0):
+    """Entry point of a worker process"""
+    # Ctrl+C goes to the whole process group, let the supervisor stop us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(0))
+    die_with_parent()
+    # Only the supervisor talks to systemd
+    os.environ.pop('NOTIFY_SOCKET', None)
+
+    # Each worker serves its own metrics endpoint on the next port
+    if options.get('metrics_port'):
+        options = dict(options, metrics_port=options['metrics_port'] + index)
+    server = server_class(reuse_port=True, **options)
+    if server.history:
+        for room, frame in seed_frames:
+            server.history.append(room, frame)
+    server.attach_bus(bus_path, on_lost=exit_orphaned)
+    server.start()
+
+
+# ==============================================================================
+# CLUSTER
+# ==============================================================================
+
+class ChatCluster:
+    """Supervises the bus hub and the worker processes"""
+
+    def __init__(self, server_class, workers, log_dir=None,
+                 log_segment_bytes=DEFAULT_SEGMENT_BYTES, **options):
+        self.server_class = server_class
+        self.workers = workers
+        # Workers never touch the chat log, the hub writes it once for everyone
+        self.options = dict(options, log_dir=None)
+        log.configure(level=options.get('log_level'), json_output=options.get('log_json'),
+                      log_content=options.get('log_content'))
+        self.chat_log = ChatLog(log_dir, log_segment_bytes) if log_dir else None
+        self.bus_path = os.path.join(tempfile.gettempdir(), f"schrimp-bus-{os.getpid()}.sock")
+        self.hub = BusHub(self.bus_path, self.chat_log)
+        self.processes = []
+        self.running = False
+
+    def seed_frames(self):
+        """Replay history for a starting worker, from the current tail of the chat log"""
+        history_bytes = self.options.get('history_bytes', DEFAULT_HISTORY_BYTES)
+        if not self.chat_log or history_bytes <= 0:
+            return []
+        return [(room, frame) for _, room, frame in self.chat_log.read_tail(history_bytes)]
+
+    def start(self):
+        """Start the hub and the workers, then restart any worker that dies"""
+        self.running = True
+        threading.Thread(target=self.hub.serve_forever, daemon=True).start()
+
+        # Spawned rather than forked: the hub thread and its sockets stay in this process
+        context = multiprocessing.get_context('spawn')
+        seed_frames = self.seed_frames()
+        self.processes = [self._spawn(context, index, seed_frames) for index in range(self.workers)]
+        print(f"Cluster: {self.workers} workers on port {self.options.get('port')}, bus {self.bus_path}")
+        if self.chat_log:
+            print(f"Chat log: {self.chat_log.directory} (recovered in {self.chat_log.recovery_seconds * 1000:.1f} ms)")
+        sd_notify("READY=1")
+
+        try:
+            while self.running:
+                time.sleep(SUPERVISE_INTERVAL)
+                for index, process in enumerate(self.processes):
+                    if not process.is_alive() and self.running:
+                        log.error('cluster.respawn', "Worker {pid} exited with code {code}, restarting",
+                                  pid=process.pid, code=process.exitcode)
+                        time.sleep(RESPAWN_DELAY)
+                        # Seeded with what was said since startup, the hub has logged it
+                        if self.running:
+                            self.processes[index] = self._spawn(context, index, self.seed_frames())
+        finally:
+            self.stop()
+
+    def install_signal_handlers(self):
+        """SIGTERM stops the workers with the supervisor instead of leaving them without a hub"""
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+    def _spawn(self, context, index, seed_frames):
+        process = context.Process(
+            target=run_worker,
+            args=(self.server_class, self.options, self.bus_path, seed_frames, index),
+            daemon=True
+        )
+        process.start()
+        return process
+
+    def stop(self):
+        """Terminate the workers, stop the hub and flush the chat log"""
+        if not self.running:
+            return
+        self.running = False
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join(timeout=2.0)
+        self.hub.stop()
+        if self.chat_log:
+            self.chat_log.close()
+        print("Cluster stopped")
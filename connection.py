@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Connection adapters for Schrimp Chat Server
+Every client gets a bounded outbound queue drained by its own writer, so a
+slow reader never blocks the thread or coroutine that sends to it
+"""
+
+import asyncio
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+from line_reader import LineBuffer, MAX_LINE_LENGTH, RECV_SIZE
+from binary_protocol import FrameBuffer, wrap_text
+
+
+# Slow-consumer policies applied when a client's queue passes the high-water mark
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_DISCONNECT = 'disconnect'
+SLOW_CONSUMER_POLICIES = (POLICY_DROP_OLDEST, POLICY_DISCONNECT)
+
+DEFAULT_HIGH_WATER = 64 * 1024   # bytes queued per client before the policy applies
+CLOSE_FLUSH_TIMEOUT = 2.0        # seconds allowed to flush pending data on close
+
+# Largest number of buffers a single sendmsg call accepts
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+
+
+# ==============================================================================
+# OUTBOUND QUEUE
+# ==============================================================================
+
+class OutboundStats:
+    """Counters of messages dropped by each slow-consumer policy"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dropped_oldest = 0       # frames discarded by drop-oldest
+        self.dropped_disconnect = 0   # frames discarded when a client was evicted
+        self.evicted_clients = 0      # clients disconnected by the disconnect policy
+
+    def record_drop_oldest(self, frames):
+        with self.lock:
+            self.dropped_oldest += frames
+
+    def record_eviction(self, frames):
+        with self.lock:
+            self.dropped_disconnect += frames
+            self.evicted_clients += 1
+
+    def summary(self):
+        """Human readable counter summary"""
+        return (f"Slow consumers: {self.dropped_oldest} dropped (drop-oldest), "
+                f"{self.dropped_disconnect} dropped / {self.evicted_clients} evicted (disconnect)")
+
+
+class OutboundQueue:
+    """Bounded FIFO of frames waiting to be written to one client"""
+
+    def __init__(self, high_water=DEFAULT_HIGH_WATER, policy=POLICY_DROP_OLDEST, stats=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow-consumer policy: {policy}")
+        self.high_water = high_water
+        self.policy = policy
+        self.stats = stats
+        self.frames = deque()
+        self.pending_bytes = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def push(self, data):
+        """Queue a frame, returns False if the client must be evicted"""
+        if self.frames and self.pending_bytes + len(data) > self.high_water:
+            if self.policy == POLICY_DISCONNECT:
+                if self.stats:
+                    self.stats.record_eviction(len(self.frames) + 1)
+                self.clear()
+                return False
+
+            dropped = 0
+            while self.frames and self.pending_bytes + len(data) > self.high_water:
+                self.pending_bytes -= len(self.frames.popleft())
+                dropped += 1
+            if self.stats:
+                self.stats.record_drop_oldest(dropped)
+
+        self.frames.append(data)
+        self.pending_bytes += len(data)
+        return True
+
+    def pop_all(self):
+        """Take every queued frame, oldest first"""
+        frames = list(self.frames)
+        self.clear()
+        return frames
+
+    def clear(self):
+        self.frames.clear()
+        self.pending_bytes = 0
+
+
+# ==============================================================================
+# THREADED CONNECTION
+# ==============================================================================
+
+class SocketConnection:
+    """Blocking socket with a writer thread draining its outbound queue"""
+
+    def __init__(self, sock, address, high_water=DEFAULT_HIGH_WATER, policy=POLICY_DROP_OLDEST, stats=None,
+                 max_line_length=MAX_LINE_LENGTH, interrupt=None):
+        self.sock = sock
+        self.address = address
+        self.queue = OutboundQueue(high_water, policy, stats)
+        self.line_buffer = LineBuffer(max_line_length)
+        self.closed = False
+        self.last_activity = time.monotonic()   # last time data arrived, read by the idle reaper
+        self.handed_off = False                 # the socket now belongs to a successor process
+        self.binary = False                     # speaks the framed protocol of binary_protocol
+        self.parked = threading.Event()         # set once the reader stopped for a handoff
+        self._kicked = False
+        self._in_flight = 0                     # bytes taken by the writer and not sent yet
+        
+        # A blocked recv cannot be woken without shutting the socket down for
+        # every process, so with hot restart enabled reads first wait on the
+        # socket and a pipe that becomes readable when a handoff starts
+        self._poller = None
+        if interrupt is not None:
+            self._poller = select.poll()
+            self._poller.register(sock, select.POLLIN)
+            self._poller.register(interrupt, select.POLLIN)
+            self._interrupt = interrupt
+        self._condition = threading.Condition()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def send(self, data, encoded=False):
+        """Queue data for the writer thread without blocking, text is framed for a binary client"""
+        if self.binary and not encoded:
+            data = wrap_text(data)
+        with self._condition:
+            if self.closed:
+                raise ConnectionResetError("connection is closed")
+            if not self.queue.push(data):
+                self.closed = True
+                self._condition.notify()
+                self._shutdown()
+                raise ConnectionResetError("slow consumer evicted")
+            self._condition.notify()
+        return len(data)
+
+    def readline(self):
+        """Block until the next line arrives, None at end of stream"""
+        if self._fill_lines():
+            return self.line_buffer.pop_line()
+        return None
+
+    def use_binary(self):
+        """Switch to the binary protocol, keeping the input that followed the request"""
+        self.line_buffer = FrameBuffer.after(self.line_buffer)
+        self.binary = True
+
+    def read_lines(self):
+        """Block until complete lines arrive and return all of them, [] at end of stream"""
+        if self._fill_lines():
+            return self.line_buffer.pop_all()
+        return []
+
+    def _fill_lines(self):
+        """Read from the socket until a line is buffered, False at end of stream"""
+        while not self.line_buffer:
+            if self._poller is not None and self._interrupted():
+                if not self.handed_off:
+                    raise ConnectionResetError("server is restarting")
+                self.parked.set()
+                return False
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                self.line_buffer.finish()
+                return bool(self.line_buffer)
+            self.last_activity = time.monotonic()
+            self.line_buffer.feed(data)
+        return True
+
+    def _interrupted(self):
+        """Wait for data or a handoff, True for a handoff"""
+        for fd, _ in self._poller.poll():
+            if fd == self._interrupt:
+                return True
+        return False
+
+    def pending_output(self):
+        """Bytes queued or being written"""
+        return self.queue.pending_bytes + self._in_flight
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def disconnect(self, notice):
+        """Send a last notice, then end the connection from any thread"""
+        with self._condition:
+            if self.closed:
+                return
+            data = notice.encode('utf-8')
+            self.queue.push(wrap_text(data) if self.binary else data)
+            self.closed = True
+            self._kicked = True
+            self._condition.notify()
+
+    def close(self):
+        """Flush pending data within a deadline, then close the socket"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+        if threading.current_thread() is not self._writer:
+            self._writer.join(CLOSE_FLUSH_TIMEOUT)
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+    def abort(self):
+        """Close at once, dropping output not written yet"""
+        with self._condition:
+            self.closed = True
+            self.queue.clear()
+            self._condition.notify()
+        # Also wakes a writer blocked on a client that stopped reading
+        self._shutdown()
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+    def _shutdown(self):
+        """Wake up the reader thread of an evicted client"""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def _send_frames(self, frames):
+        """Write queued frames with scatter-gather sendmsg, without joining them"""
+        if not hasattr(self.sock, 'sendmsg'):
+            self.sock.sendall(b"".join(frames))
+            return
+
+        index = 0
+        while index < len(frames):
+            sent = self.sock.sendmsg(frames[index:index + IOV_MAX])
+            # Skip fully written frames and keep a zero-copy view of a partial one
+            while sent:
+                frame_length = len(frames[index])
+                if sent >= frame_length:
+                    sent -= frame_length
+                    index += 1
+                else:
+                    frames[index] = memoryview(frames[index])[sent:]
+                    sent = 0
+
+    def _write_loop(self):
+        """Drain the outbound queue until the connection is closed"""
+        while True:
+            with self._condition:
+                while not self.queue and not self.closed:
+                    self._condition.wait()
+                if not self.queue:
+                    break
+                self._in_flight = self.queue.pending_bytes
+                frames = self.queue.pop_all()
+
+            try:
+                self._send_frames(frames)
+            except socket.error:
+                with self._condition:
+                    self.closed = True
+                    self.queue.clear()
+                self._shutdown()
+                return
+            finally:
+                self._in_flight = 0
+
+        # A disconnected client's reader is still blocked in recv
+        if self._kicked:
+            self._shutdown()
+
+
+# ==============================================================================
+# EVENT-LOOP CONNECTION
+# ==============================================================================
+
+class StreamConnection:
+    """Socket-like wrapper around an asyncio reader/writer pair"""
+
+    def __init__(self, reader, writer, high_water=DEFAULT_HIGH_WATER, policy=POLICY_DROP_OLDEST, stats=None,
+                 max_line_length=MAX_LINE_LENGTH):
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername')
+        self.queue = OutboundQueue(high_water, policy, stats)
+        self.line_buffer = LineBuffer(max_line_length)
+        self.closed = False
+        self.last_activity = time.monotonic()   # last time data arrived, read by the idle reaper
+        self.handed_off = False                 # the socket now belongs to a successor process
+        self.binary = False                     # speaks the framed protocol of binary_protocol
+        self._wakeup = asyncio.Event()
+        writer.transport.set_write_buffer_limits(high=high_water)
+        self._writer_task = asyncio.get_running_loop().create_task(self._write_loop())
+
+    def send(self, data, encoded=False):
+        """Queue data for the writer task without blocking the loop, text is framed for a binary client"""
+        if self.binary and not encoded:
+            data = wrap_text(data)
+        if self.closed or self.writer.is_closing():
+            raise ConnectionResetError("connection is closed")
+        # Hand data straight to the transport while it keeps up, the loop may
+        # not yield to the writer task between two messages of a burst
+        if not self.queue and self.writer.transport.get_write_buffer_size() < self.queue.high_water:
+            self.writer.write(data)
+            return len(data)
+        if not self.queue.push(data):
+            self.closed = True
+            self._wakeup.set()
+            self.writer.transport.abort()
+            raise ConnectionResetError("slow consumer evicted")
+        self._wakeup.set()
+        return len(data)
+
+    async def readline(self):
+        """Wait for the next line, None at end of stream"""
+        if await self._fill_lines():
+            return self.line_buffer.pop_line()
+        return None
+
+    def use_binary(self):
+        """Switch to the binary protocol, keeping the input that followed the request"""
+        self.line_buffer = FrameBuffer.after(self.line_buffer)
+        self.binary = True
+
+    async def read_lines(self):
+        """Wait for complete lines and return all of them, [] at end of stream"""
+        if await self._fill_lines():
+            return self.line_buffer.pop_all()
+        return []
+
+    async def _fill_lines(self):
+        """Read from the stream until a line is buffered, False at end of stream"""
+        while not self.line_buffer:
+            data = await self.reader.read(RECV_SIZE)
+            if self.handed_off:
+                # Whatever was buffered went to the successor with the socket
+                return False
+            if not data:
+                self.line_buffer.finish()
+                return bool(self.line_buffer)
+            self.last_activity = time.monotonic()
+            self.line_buffer.feed(data)
+        return True
+
+    async def freeze(self):
+        """Stop reading for a handoff and take the input not consumed yet"""
+        self.handed_off = True
+        self.writer.transport.pause_reading()
+        pending = bytearray(self.line_buffer.pending_bytes())
+        # Ending the stream makes read() hand over the read-ahead the StreamReader
+        # still holds without waiting, the reading task then gets end of stream
+        self.reader.feed_eof()
+        while True:
+            data = await self.reader.read(RECV_SIZE)
+            if not data:
+                break
+            pending += data
+        return bytes(pending)
+
+    def pending_output(self):
+        """Bytes queued or held by the transport"""
+        return self.queue.pending_bytes + self.writer.transport.get_write_buffer_size()
+
+    def fileno(self):
+        return self.writer.get_extra_info('socket').fileno()
+
+    def disconnect(self, notice):
+        """Send a last notice, then end the connection (on the loop thread)"""
+        if self.closed:
+            return
+        try:
+            self.send(notice.encode('utf-8'))
+        except ConnectionResetError:
+            return
+        self.close()
+
+    def close(self):
+        """Let the writer task flush within a deadline, then close the transport"""
+        self.closed = True
+        self._wakeup.set()
+        asyncio.get_running_loop().call_later(CLOSE_FLUSH_TIMEOUT, self.writer.transport.abort)
+
+    def abort(self):
+        """Close at once, dropping output not written yet (on the loop thread)"""
+        self.closed = True
+        self.queue.clear()
+        self._wakeup.set()
+        self.writer.transport.abort()
+
+    async def _write_loop(self):
+        """Drain the outbound queue until the connection is closed"""
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.queue:
+                    await self.writer.drain()
+                    self.writer.writelines(self.queue.pop_all())
+                if self.closed and not self.queue:
+                    break
+        except (socket.error, RuntimeError):
+            self.closed = True
+            self.queue.clear()
+        finally:
+            self.writer.close()
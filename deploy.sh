@@ -60,7 +60,22 @@ cp server.py $INSTALL_DIR/
 cp client_manager.py $INSTALL_DIR/
 cp auth_handler.py $INSTALL_DIR/
 cp message_handler.py $INSTALL_DIR/
+cp async_server.py $INSTALL_DIR/
+cp connection.py $INSTALL_DIR/
+cp line_reader.py $INSTALL_DIR/
+cp binary_protocol.py $INSTALL_DIR/
+cp history.py $INSTALL_DIR/
+cp chat_log.py $INSTALL_DIR/
+cp bus.py $INSTALL_DIR/
+cp cluster.py $INSTALL_DIR/
+cp federation.py $INSTALL_DIR/
+cp server_log.py $INSTALL_DIR/
+cp metrics.py $INSTALL_DIR/
+cp admission.py $INSTALL_DIR/
+cp handoff.py $INSTALL_DIR/
+cp pipeline.py $INSTALL_DIR/
 cp secure.py $INSTALL_DIR/
+mkdir -p $INSTALL_DIR/chatlog
 chown -R $USERNAME:$USERNAME $INSTALL_DIR/
 chmod +x $INSTALL_DIR/chat_server.py
 
@@ -72,10 +87,17 @@ Description=Schrimp Chat Server
 After=network.target
 
 [Service]
-Type=simple
+# The server reports readiness itself; after a hot restart the successor
+# process announces its own PID as the main one
+Type=notify
+NotifyAccess=all
 User=$USERNAME
 WorkingDirectory=$INSTALL_DIR
-ExecStart=/usr/bin/python3 $INSTALL_DIR/chat_server.py $PORT "$PASSWORD"
+ExecStart=/usr/bin/python3 $INSTALL_DIR/chat_server.py $PORT "$PASSWORD" --log-dir $INSTALL_DIR/chatlog --handoff-path $INSTALL_DIR/handoff.sock
+# Reload hands every connected client over to a new process
+ExecReload=/bin/kill -HUP \$MAINPID
+# Stop drains the clients before exiting
+TimeoutStopSec=20
 Restart=always
 RestartSec=3
 
@@ -125,8 +147,10 @@ echo "Useful commands:"
 echo "  Status:    systemctl status schrimp-chat"
 echo "  Stop:      systemctl stop schrimp-chat"
 echo "  Start:     systemctl start schrimp-chat"
+echo "  Upgrade:   systemctl reload schrimp-chat (clients stay connected)"
 echo "  Logs:      journalctl -u schrimp-chat -f"
 echo ""
 echo "Files:"
 echo "  Service:   /etc/systemd/system/schrimp-chat.service"
-echo "  Code:      $INSTALL_DIR/"
\ No newline at end of file
+echo "  Code:      $INSTALL_DIR/"
+echo "  Chat log:  $INSTALL_DIR/chatlog/"
\ No newline at end of file
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Server federation for Schrimp Chat Server
+Links several chat nodes over TCP so they behave as one chat: broadcasts are
+batched and forwarded along every link, deduplicated by message ID so a
+mesh never loops, and the user directory is kept in sync between nodes
+"""
+
+import hmac
+import itertools
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from bus import encode_message, decode_messages
+from server_log import log
+
+
+# Link message kinds
+HELLO = 1      # node id, secret
+FRAME = 2      # message id, room, frame, chat flag, binary event (may be empty)
+JOIN = 3       # message id, origin node, username, ip, room
+LEAVE = 4      # message id, username
+MOVE = 5       # message id, username, room
+DIRECT = 6     # message id, username, frame, binary event (may be empty)
+WITHDRAW = 7   # message id, username: no longer reachable through the sender
+
+DEFAULT_LINK_PORT = 3032
+SEEN_IDS_CAPACITY = 100000          # message IDs remembered for deduplication
+LINK_BATCH_DELAY = 0.002            # seconds a link waits to gather a batch
+MAX_LINK_BACKLOG = 16 * 1024 * 1024 # bytes queued for a peer before the link is dropped
+MAX_LINK_MESSAGE = 64 * 1024        # largest message accepted from a peer
+CONNECT_TIMEOUT = 5.0
+INITIAL_BACKOFF = 0.5               # first reconnect delay, doubled up to MAX_BACKOFF
+MAX_BACKOFF = 30.0
+STABLE_LINK_SECONDS = 10.0          # a link up this long resets the backoff
+
+
+def parse_peer(value):
+    """Turn 'host:port' into (host, port), the port defaulting to DEFAULT_LINK_PORT"""
+    host, _, port = value.rpartition(':')
+    if not host:
+        return value, DEFAULT_LINK_PORT
+    return host, int(port)
+
+
+# ==============================================================================
+# LINK
+# ==============================================================================
+
+class _Link:
+    """One TCP connection to a peer node, with a batching writer thread"""
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.node_id = None
+        self.users = set()          # usernames learned through this link
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.batches_sent = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def send(self, raw):
+        """Queue a message, never blocks on the network"""
+        with self.condition:
+            if self.closed:
+                return
+            self.queue.append(raw)
+            self.queued_bytes += len(raw)
+            if self.queued_bytes > MAX_LINK_BACKLOG:
+                log.warning('federation.slow', "Federation: peer {host}:{port} fell behind, dropping the link",
+                            host=self.address[0], port=self.address[1])
+                self._close_locked()
+                return
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self._close_locked()
+
+    def _close_locked(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.condition.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _write_loop(self):
+        """Send everything queued since the last write as one batch"""
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+            # Let a burst of broadcasts accumulate into a single write
+            time.sleep(LINK_BATCH_DELAY)
+            with self.condition:
+                batch = b"".join(self.queue)
+                self.queue.clear()
+                self.queued_bytes = 0
+            try:
+                self.sock.sendall(batch)
+                self.batches_sent += 1
+            except OSError:
+                self.close()
+                return
+
+
+# ==============================================================================
+# FEDERATION
+# ==============================================================================
+
+class Federation:
+    """Peers this node with other Schrimp nodes"""
+
+    def __init__(self, client_manager, deliver, listen_host='0.0.0.0', listen_port=None,
+                 peers=(), secret=None, node_id=None, deliver_direct=None):
+        # Anyone reaching the port could otherwise speak for any user
+        if listen_port and not secret:
+            raise ValueError("accepting links requires a link secret")
+        if peers and not secret:
+            raise ValueError("dialing peers requires a link secret")
+        self.client_manager = client_manager
+        self.deliver = deliver          # callable(room, frame, chat, event) for frames of other nodes
+        self.deliver_direct = deliver_direct   # callable(username, frame, event) for private frames
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.peers = list(peers)        # [(host, port)] this node dials
+        self.secret = secret or ''
+        self.node_id = node_id or uuid.uuid4().hex[:12]
+
+        self.lock = threading.Lock()
+        self.links = {}                 # {node id: _Link} of established links
+        self.directory = {}             # {username: [origin node, ip, room]} of remote users
+        self.seen = OrderedDict()       # recent message IDs, oldest first
+        self.message_ids = itertools.count(1)
+        self.server_socket = None
+        self.running = False
+
+        # Counters
+        self.frames_forwarded = 0
+        self.duplicates_dropped = 0
+
+    # --------------------------------------------------------------------------
+    # LIFECYCLE
+    # --------------------------------------------------------------------------
+
+    def start(self):
+        """Listen for peers and start dialing the configured ones"""
+        self.running = True
+        if self.listen_port:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind((self.listen_host, self.listen_port))
+            self.server_socket.listen(16)
+            threading.Thread(target=self._accept_loop, daemon=True).start()
+        for address in self.peers:
+            threading.Thread(target=self._dial_loop, args=(address,), daemon=True).start()
+
+    def stop(self):
+        """Close the listener and every link"""
+        self.running = False
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except OSError:
+                pass
+        with self.lock:
+            links = list(self.links.values())
+        for link in links:
+            link.close()
+
+    def summary(self):
+        """One line of link statistics"""
+        batches = sum(link.batches_sent for link in list(self.links.values()))
+        return (f"Federation: {len(self.links)} links, {self.frames_forwarded} frames received, "
+                f"{self.duplicates_dropped} duplicates dropped, {batches} batches sent on open links")
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, address = self.server_socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._run_link, args=(sock, address), daemon=True).start()
+
+    def _dial_loop(self, address):
+        """Keep a link to one peer up, reconnecting with exponential backoff"""
+        backoff = INITIAL_BACKOFF
+        while self.running:
+            started = time.monotonic()
+            try:
+                sock = socket.create_connection(address, timeout=CONNECT_TIMEOUT)
+                sock.settimeout(None)
+            except OSError:
+                sock = None
+            if sock is not None:
+                self._run_link(sock, address)
+                if time.monotonic() - started >= STABLE_LINK_SECONDS:
+                    backoff = INITIAL_BACKOFF
+            if not self.running:
+                return
+            # Jitter keeps nodes that lost each other from redialing in lockstep
+            time.sleep(backoff * random.uniform(0.5, 1.0))
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    # --------------------------------------------------------------------------
+    # LINKS
+    # --------------------------------------------------------------------------
+
+    def _run_link(self, sock, address):
+        """Handshake with a peer and relay its messages until the link drops"""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        link = _Link(sock, address)
+        link.send(encode_message(HELLO, self.node_id, self.secret))
+        buffer = bytearray()
+        try:
+            while self.running:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                buffer += data
+                for kind, fields, raw in decode_messages(buffer, MAX_LINK_MESSAGE):
+                    if link.node_id is None:
+                        if kind != HELLO or not self._register(link, fields):
+                            return
+                    else:
+                        self._handle(link, kind, fields, raw)
+        except OSError:
+            pass
+        except (ValueError, IndexError) as e:
+            log.warning('federation.malformed', "Federation: malformed message from {host}:{port}, dropping the link: {error}",
+                        host=address[0], port=address[1], error=e)
+        finally:
+            self._unregister(link)
+            link.close()
+            sock.close()
+
+    def _register(self, link, fields):
+        """Validate a peer's HELLO and bring it up to date with our directory"""
+        node_id, secret = fields
+        node_id = node_id.decode('utf-8')
+        if not hmac.compare_digest(secret, self.secret.encode('utf-8')):
+            log.warning('federation.reject', "Federation: rejected {host}:{port}, wrong link secret",
+                        host=link.address[0], port=link.address[1])
+            return False
+        with self.lock:
+            if node_id == self.node_id or node_id in self.links:
+                return False
+            link.node_id = node_id
+            self.links[node_id] = link
+            remote = [(username, entry) for username, entry in self.directory.items()]
+
+        with self.client_manager.lock:
+            local = [(info.pseudo, info.ip, info.room) for info in self.client_manager.clients.values()]
+        for username, ip, room in local:
+            link.send(self._event(JOIN, self.node_id, username, ip, room))
+        for username, (origin, ip, room) in remote:
+            link.send(self._event(JOIN, origin, username, ip, room))
+        log.info('federation.link', "Federation: linked with node {node} ({host}:{port})",
+                 node=node_id, host=link.address[0], port=link.address[1])
+        return True
+
+    def _unregister(self, link):
+        """Forget the users reached through a dropped link and withdraw them from the other peers"""
+        with self.lock:
+            if link.node_id is None or self.links.get(link.node_id) is not link:
+                return
+            del self.links[link.node_id]
+            departed = [username for username in link.users if username in self.directory]
+            for username in departed:
+                del self.directory[username]
+        # Not a LEAVE: a peer still reaching the user through another link answers
+        # with a JOIN, and only the peers that cannot forget it
+        for username in departed:
+            self.client_manager.remove_remote(username)
+            self._broadcast(self._event(WITHDRAW, username))
+        log.warning('federation.unlink', "Federation: lost link with node {node}", node=link.node_id)
+
+    # --------------------------------------------------------------------------
+    # LOCAL EVENTS
+    # --------------------------------------------------------------------------
+
+    def publish(self, room, frame, chat=False, event=None):
+        """Send a broadcast frame of this node and its binary event to every peer"""
+        if self.links:
+            self._broadcast(self._event(FRAME, room or '', frame, b'1' if chat else b'0', event or b''))
+
+    def announce_join(self, username, ip, room):
+        if self.links:
+            self._broadcast(self._event(JOIN, self.node_id, username, ip, room))
+
+    def announce_leave(self, username):
+        if self.links:
+            self._broadcast(self._event(LEAVE, username))
+
+    def announce_move(self, username, room):
+        if self.links:
+            self._broadcast(self._event(MOVE, username, room))
+
+    def send_direct(self, username, frame, event=None):
+        """Send a private frame and its binary event toward the node of a remote user only"""
+        link = self._route(username)
+        if link is not None:
+            link.send(self._event(DIRECT, username, frame, event or b''))
+
+    def _route(self, username):
+        """Link through which a remote user was announced, None if unknown"""
+        with self.lock:
+            for link in self.links.values():
+                if username in link.users:
+                    return link
+        return None
+
+    def _event(self, kind, *fields):
+        """Encode a new message under a fresh ID we will not accept back"""
+        message_id = f"{self.node_id}:{next(self.message_ids)}"
+        with self.lock:
+            self._remember(message_id)
+        return encode_message(kind, message_id, *fields)
+
+    def _broadcast(self, raw, origin=None):
+        with self.lock:
+            links = [link for link in self.links.values() if link is not origin]
+        for link in links:
+            link.send(raw)
+
+    # --------------------------------------------------------------------------
+    # REMOTE EVENTS
+    # --------------------------------------------------------------------------
+
+    def _handle(self, link, kind, fields, raw):
+        """Apply a message from a peer once, then pass it on to the other peers"""
+        message_id = fields[0].decode('utf-8')
+        with self.lock:
+            if message_id in self.seen:
+                self.duplicates_dropped += 1
+                return
+            self._remember(message_id)
+
+        if kind == FRAME:
+            room, frame, chat, event = fields[1:]
+            self.frames_forwarded += 1
+            self.deliver(room.decode('utf-8') or None, frame, chat == b'1', event or None)
+        elif kind == JOIN:
+            origin, username, ip, room = (field.decode('utf-8') for field in fields[1:])
+            if username in self.client_manager.usernames:
+                log.warning('federation.clash', "Federation: '{user}' of node {node} clashes with a local user, ignored",
+                            user=username, node=origin)
+                return
+            with self.lock:
+                previous = self.directory.get(username)
+                self.directory[username] = [origin, ip, room]
+                for other in self.links.values():
+                    other.users.discard(username)
+                link.users.add(username)
+            if previous is None or previous[2] != room:
+                self.client_manager.add_remote(username, ip, room)
+        elif kind == LEAVE:
+            username = fields[1].decode('utf-8')
+            with self.lock:
+                if self.directory.pop(username, None) is None:
+                    return
+                link.users.discard(username)
+            self.client_manager.remove_remote(username)
+        elif kind == MOVE:
+            username, room = (field.decode('utf-8') for field in fields[1:])
+            with self.lock:
+                entry = self.directory.get(username)
+                if entry is None:
+                    return
+                entry[2] = room
+            self.client_manager.move_remote(username, room)
+        elif kind == WITHDRAW:
+            username = fields[1].decode('utf-8')
+            route = self._other_route(username, link)
+            if route is not None:
+                link.send(self._event(JOIN, *route))
+                return
+            with self.lock:
+                if username not in link.users or self.directory.pop(username, None) is None:
+                    return
+                link.users.discard(username)
+            self.client_manager.remove_remote(username)
+        elif kind == DIRECT:
+            # Delivered here, or passed one hop closer to the user, never flooded
+            username, frame, event = fields[1].decode('utf-8'), fields[2], fields[3]
+            if username in self.client_manager.usernames:
+                if self.deliver_direct:
+                    self.deliver_direct(username, frame, event or None)
+            else:
+                route = self._route(username)
+                if route is not None and route is not link:
+                    route.send(raw)
+            return
+
+        self._broadcast(raw, origin=link)
+
+    def _other_route(self, username, link):
+        """JOIN fields of a user this node reaches without going through a link, None if it does not"""
+        with self.client_manager.lock:
+            info = self.client_manager.clients.get(self.client_manager.usernames.get(username))
+        if info is not None:
+            return self.node_id, username, info.ip, info.room
+        with self.lock:
+            entry = self.directory.get(username)
+            if entry is None or username in link.users:
+                return None
+            origin, ip, room = entry
+        return origin, username, ip, room
+
+    def _remember(self, message_id):
+        """Record a message ID (lock held), forgetting the oldest past capacity"""
+        self.seen[message_id] = None
+        if len(self.seen) > SEEN_IDS_CAPACITY:
+            self.seen.popitem(last=False)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Hot restart for Schrimp Chat Server
+A running server waits on a Unix socket for its successor and passes it the
+listening socket and every client socket (SCM_RIGHTS) together with the
+session state, so an upgrade does not drop a single client
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+from bus import encode_message, decode_messages
+from server_log import log
+
+
+# Handoff message kinds
+TAKEOVER = 1   # successor pid
+LISTENER = 2   # host, port + listening socket
+CLIENT = 3     # username, ip, port, room, unprocessed input, binary flag + client socket
+HISTORY = 4    # room, frame
+DONE = 5       # number of clients
+
+DEFAULT_DRAIN_TIMEOUT = 5.0      # seconds a stopping server gives clients to receive queued output
+HANDOFF_PARK_TIMEOUT = 1.0       # seconds client readers get to stop reading before a handoff
+HANDOFF_FLUSH_TIMEOUT = 2.0      # seconds client output gets to flush before a handoff
+MAX_HANDOFF_MESSAGE = 256 * 1024 # largest message of the handoff socket
+
+RESTART_NOTICE = "Server is restarting, please reconnect in a moment.\n"
+
+
+class AdoptedClient:
+    """Registered client received from the previous process"""
+
+    __slots__ = ('sock', 'address', 'username', 'room', 'pending_input', 'binary')
+
+    def __init__(self, sock, address, username, room, pending_input, binary=False):
+        self.sock = sock
+        self.address = address
+        self.username = username
+        self.room = room
+        self.pending_input = pending_input
+        self.binary = binary   # speaks the binary protocol
+
+
+def sd_notify(state):
+    """Send a state line to systemd when running as a notify service"""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notify_socket:
+            notify_socket.sendto(state.encode('utf-8'), address)
+    except OSError:
+        pass
+
+
+def spawn_successor():
+    """Start a new server process with the same arguments that takes over from this one"""
+    arguments = sys.argv if '--takeover' in sys.argv else sys.argv + ['--takeover']
+    log.info('handoff.spawn', "Starting a successor process for a hot restart")
+    return subprocess.Popen([sys.executable] + arguments)
+
+
+# ==============================================================================
+# OUTGOING SIDE
+# ==============================================================================
+
+class HandoffListener:
+    """Waits for a successor on a Unix socket and hands the server over to it"""
+
+    def __init__(self, path, server):
+        self.path = path
+        self.server = server
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.sock.bind(path)
+        os.chmod(path, 0o600)
+        self.sock.listen(1)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                if self._hand_over(conn):
+                    return
+
+    def _hand_over(self, conn):
+        """Pass the listener, the clients and the history to a successor, True once done"""
+        messages = decode_messages(bytearray(conn.recv(MAX_HANDOFF_MESSAGE)))
+        if not messages or messages[0][0] != TAKEOVER:
+            return False
+        successor = messages[0][1][0].decode('utf-8')
+        log.info('handoff.start', "Handing over to process {pid}", pid=successor)
+
+        # The successor binds the path again once it has everything
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.close()
+
+        listener, clients, history = self.server.prepare_handoff()
+        try:
+            host, port = listener.getsockname()[:2]
+            socket.send_fds(conn, [encode_message(LISTENER, host, str(port))], [listener.fileno()])
+            for room, frame in history:
+                conn.sendall(encode_message(HISTORY, room, frame))
+            for fileno, username, address, room, pending_input, binary in clients:
+                fields = (username, address[0], str(address[1]), room, pending_input, b'1' if binary else b'0')
+                socket.send_fds(conn, [encode_message(CLIENT, *fields)], [fileno])
+            conn.sendall(encode_message(DONE, str(len(clients))))
+            # The successor closes its end once it holds every socket
+            conn.recv(1)
+        except OSError as e:
+            log.error('handoff.error', "Handoff failed: {error}", error=e)
+        self.server.complete_handoff(len(clients))
+        return True
+
+
+# ==============================================================================
+# INCOMING SIDE
+# ==============================================================================
+
+def take_over(path):
+    """Receive the listener, clients and history of a running server, None if there is none"""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        return None
+
+    listener = None
+    clients = []
+    history = []
+    with conn:
+        conn.sendall(encode_message(TAKEOVER, str(os.getpid())))
+        while True:
+            data, fds, _, _ = socket.recv_fds(conn, MAX_HANDOFF_MESSAGE, 1)
+            if not data:
+                break
+            kind, fields, _ = decode_messages(bytearray(data))[0]
+            if kind == LISTENER:
+                listener = socket.socket(fileno=fds[0])
+            elif kind == CLIENT:
+                username, ip, port, room = (field.decode('utf-8') for field in fields[:4])
+                clients.append(AdoptedClient(socket.socket(fileno=fds[0]), (ip, int(port)), username, room,
+                                             fields[4], fields[5] == b'1'))
+            elif kind == HISTORY:
+                history.append((fields[0].decode('utf-8'), fields[1]))
+            elif kind == DONE:
+                # systemd must know the new main process before the old one exits
+                sd_notify(f"MAINPID={os.getpid()}")
+                break
+    if listener is None:
+        return None
+    return listener, clients, history
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Message history for Schrimp Chat Server
+Keeps the most recent broadcast frames of every room in memory so they can
+be replayed to clients that join later
+"""
+
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+
+
+DEFAULT_HISTORY_BYTES = 1024 * 1024   # memory budget shared by every room
+DEFAULT_REPLAY_COUNT = 20             # frames replayed to a client on join
+ENTRY_OVERHEAD = 64                   # bookkeeping bytes charged per stored frame
+DEFAULT_INBOX_SIZE = 20               # private frames kept per user
+MAX_INBOXES = 10000                   # inboxes kept, the least recently used go first
+
+
+# ==============================================================================
+# MESSAGE HISTORY
+# ==============================================================================
+
+class MessageHistory:
+    """Ring buffer of encoded frames per room, bounded by one global byte budget"""
+
+    def __init__(self, max_bytes=DEFAULT_HISTORY_BYTES, replay_count=DEFAULT_REPLAY_COUNT):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.replay_count = replay_count
+        self.order = deque()   # (room, frame) oldest first across every room
+        self.rooms = {}        # {room: deque of frames}
+        self.used_bytes = 0
+
+    def append(self, room, frame):
+        """Store a frame, evicting the oldest frames of any room past the budget"""
+        cost = len(frame) + ENTRY_OVERHEAD
+        if cost > self.max_bytes:
+            return
+
+        with self.lock:
+            self.order.append((room, frame))
+            room_frames = self.rooms.get(room)
+            if room_frames is None:
+                room_frames = self.rooms[room] = deque()
+            room_frames.append(frame)
+            self.used_bytes += cost
+
+            # The globally oldest frame is always the oldest of its own room
+            while self.used_bytes > self.max_bytes:
+                old_room, old_frame = self.order.popleft()
+                old_room_frames = self.rooms[old_room]
+                old_room_frames.popleft()
+                if not old_room_frames:
+                    del self.rooms[old_room]
+                self.used_bytes -= len(old_frame) + ENTRY_OVERHEAD
+
+    def frames(self):
+        """Every stored (room, frame), oldest first"""
+        with self.lock:
+            return list(self.order)
+
+    def recent(self, room, count=None):
+        """Up to `count` most recent frames of a room, oldest first"""
+        if count is None:
+            count = self.replay_count
+        with self.lock:
+            room_frames = self.rooms.get(room)
+            if not room_frames or count <= 0:
+                return []
+            frames = list(islice(reversed(room_frames), count))
+        frames.reverse()
+        return frames
+
+
+# ==============================================================================
+# DIRECT INBOX
+# ==============================================================================
+
+class DirectInbox:
+    """Fixed-capacity ring of the last private frames of every user"""
+
+    def __init__(self, capacity=DEFAULT_INBOX_SIZE, max_inboxes=MAX_INBOXES):
+        self.lock = threading.Lock()
+        self.capacity = capacity
+        self.max_inboxes = max_inboxes
+        # Keyed by name and address: names are not accounts, so someone else
+        # taking a name later does not get the previous holder's messages
+        self.inboxes = OrderedDict()   # {(username, ip): deque of frames}, least recently used first
+
+    def append(self, username, ip, frame):
+        """Store a frame, the oldest frame of a full inbox is dropped"""
+        key = (username, ip)
+        with self.lock:
+            frames = self.inboxes.get(key)
+            if frames is None:
+                frames = self.inboxes[key] = deque(maxlen=self.capacity)
+                if len(self.inboxes) > self.max_inboxes:
+                    self.inboxes.popitem(last=False)
+            else:
+                self.inboxes.move_to_end(key)
+            frames.append(frame)
+
+    def recent(self, username, ip):
+        """Frames of one inbox, oldest first"""
+        with self.lock:
+            frames = self.inboxes.get((username, ip))
+            return list(frames) if frames else []
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Line framing for Schrimp Chat Server
+Turns the byte stream of a connection into complete text lines, whatever
+way TCP happened to cut it into segments
+"""
+
+from collections import deque
+
+
+MAX_LINE_LENGTH = 4096   # bytes kept from a single line, the rest is discarded
+RECV_SIZE = 4096         # bytes requested from the socket per read
+
+
+# ==============================================================================
+# LINE BUFFER
+# ==============================================================================
+
+class LineBuffer:
+    """Incremental, reusable buffer splitting received bytes on newlines"""
+
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        self.max_line_length = max_line_length
+        self.buffer = bytearray()
+        self.lines = deque()
+        self.discarding = False   # dropping the tail of an overlong line
+        # Input as received from the end of the last popped line, kept while
+        # lines are popped one at a time (the login, where a client may send
+        # binary frames right behind its request); pop_all() stops it
+        self.raw = bytearray()
+        self.raw_offset = 0       # stream offset of raw[0]
+        self.raw_ends = deque()   # stream offset just past each queued line
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def feed(self, data):
+        """Append received bytes and queue every line they complete"""
+        buffer = self.buffer
+        start = len(buffer)
+        buffer += data
+        consumed = 0
+        raw = self.raw
+        if raw is not None:
+            raw += data
+            base = self.raw_offset + len(raw) - len(buffer)
+
+        while True:
+            newline = buffer.find(b"\n", start)
+            if newline < 0:
+                break
+            if self.discarding:
+                self.discarding = False
+            else:
+                self._push(buffer, consumed, newline)
+                if raw is not None:
+                    self.raw_ends.append(base + newline + 1)
+            consumed = start = newline + 1
+
+        if consumed:
+            del buffer[:consumed]
+
+        # Cap an unterminated line and skip everything up to its newline
+        if len(buffer) > self.max_line_length:
+            # The cut line has no exact end in the input any more
+            self._drop_raw()
+            if not self.discarding:
+                self._push(buffer, 0, self.max_line_length)
+                self.discarding = True
+            buffer.clear()
+
+    def finish(self):
+        """Queue the unterminated remainder at end of stream"""
+        if self.buffer and not self.discarding:
+            self._push(self.buffer, 0, len(self.buffer))
+            if self.raw is not None:
+                self.raw_ends.append(self.raw_offset + len(self.raw))
+        self.buffer.clear()
+        self.discarding = False
+
+    def pending_bytes(self):
+        """Lines and partial line not consumed yet, as received while lines are popped one at a time"""
+        if self.raw is not None:
+            return bytes(self.raw)
+        lines = b"".join(line.encode('utf-8') + b"\n" for line in self.lines)
+        return lines + bytes(self.buffer)
+
+    def pop_line(self):
+        """Oldest complete line, or None"""
+        if not self.lines:
+            return None
+        if self.raw is not None:
+            end = self.raw_ends.popleft()
+            del self.raw[:end - self.raw_offset]
+            self.raw_offset = end
+        return self.lines.popleft()
+
+    def pop_all(self):
+        """Every complete line, oldest first"""
+        if self.raw is not None:
+            self._drop_raw()
+        lines = list(self.lines)
+        self.lines.clear()
+        return lines
+
+    def _drop_raw(self):
+        self.raw = None
+        self.raw_ends.clear()
+
+    def _push(self, buffer, start, end):
+        end = min(end, start + self.max_line_length)
+        # Newlines never occur inside a UTF-8 sequence, so only a capped line
+        # can end on a cut character, which decodes as a replacement char
+        self.lines.append(buffer[start:end].decode('utf-8', 'replace'))
@@ -3,8 +3,38 @@
 Message handler for Schrimp Chat Server
 """
 
+import re
 import socket
-from datetime import datetime
+from client_manager import DEFAULT_ROOM, encode_frame
+from server_log import log
+from metrics import metrics, MESSAGE_SECONDS
+from binary_protocol import chat_event, private_event, mention_event, join_event, leave_event
+from pipeline import Pipeline, MessageContext, TimestampCache, DEFAULT_STAGE_WORKERS
+
+
+# Room names are lowercased and limited to a short, nc-friendly alphabet
+ROOM_NAME_PATTERN = re.compile(r'^[a-z0-9_-]{1,32}$')
+
+MAX_HISTORY_REQUEST = 200  # most frames a single /history command returns
+
+# @mentions notify the named users directly, a few per message at most
+MENTION_PATTERN = re.compile(r'@([^\s@]+)')
+MENTION_TRAILING = '.,:;!?)'
+MAX_MENTIONS = 5
+
+# /stats is an admin command, only answered to clients on the server machine
+ADMIN_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def parse_number(text):
+    """Positive integer written with ASCII digits, None for anything else"""
+    if not (text.isascii() and text.isdigit()):
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        # More digits than int() accepts
+        return None
 
 
 # ==============================================================================
@@ -14,69 +44,358 @@ from datetime import datetime
 class MessageHandler:
     """Handles message processing and commands"""
     
-    def __init__(self):
-        pass
+    def __init__(self, history=None, chat_log=None, stage_workers=DEFAULT_STAGE_WORKERS):
+        self.history = history    # MessageHistory filled with every chat line, optional
+        self.chat_log = chat_log  # ChatLog persisting every chat line, optional
+        self.timestamps = TimestampCache()
+        
+        # Commands by name: (handler(context, argument) returning an action, takes an argument).
+        # A command that takes no argument is sent as chat when it is given one
+        self.commands = {}
+        self.register_command('/quit', self._command_quit, takes_argument=False)
+        self.register_command('/users', self._command_users)
+        self.register_command('/join', self._command_join)
+        self.register_command('/leave', self._command_leave, takes_argument=False)
+        self.register_command('/rooms', self._command_rooms, takes_argument=False)
+        self.register_command('/stats', self._command_stats, takes_argument=False)
+        self.register_command('/msg', self._command_msg)
+        self.register_command('/inbox', self._command_inbox, takes_argument=False)
+        self.register_command('/history', self._command_history)
+        
+        # Chat lines go through every stage, commands stop at the command stage
+        self.pipeline = Pipeline(stage_workers)
+        self.pipeline.add_stage('rate_limit', self._stage_rate_limit)
+        self.pipeline.add_stage('filter', self._stage_filter)
+        self.pipeline.add_stage('command', self._stage_command)
+        self.pipeline.add_stage('format', self._stage_format)
+        self.pipeline.add_stage('mentions', self._stage_mentions)
+        self.pipeline.add_stage('broadcast', self._stage_broadcast)
+        self.pipeline.add_stage('history', self._stage_history)
+        self.pipeline.add_stage('log', self._stage_log, deferred=True)
+        self.pipeline.add_stage('persist', self._stage_persist, deferred=True)
+    
+    def register_command(self, name, handler, takes_argument=True):
+        """Add or replace a /command"""
+        self.commands[name.lower()] = (handler, takes_argument)
     
     def process_message(self, message, pseudo, client_socket, client_manager, security_manager=None):
         """Process incoming message and return action"""
         message = message.strip()
         
+        # A blank line, in a paste for instance; end of stream is seen by the reader
         if not message:
-            return 'disconnect'
-            
-        # Security checks
-        if security_manager:
-            # Check rate limiting
-            if not security_manager.check_rate_limit(pseudo):
-                warning = "Rate limit exceeded. Please slow down."
-                self._send_to_client(client_socket, warning, security_manager)
-                return 'continue'
-            
-            # Filter content
-            filtered_message = security_manager.filter_content(message)
-            if filtered_message != message:
-                message = filtered_message  # Use filtered version
-            
-        # Special commands
-        if message.lower() == '/quit':
-            return 'disconnect'
-        elif message.lower() == '/users':
-            users_list = client_manager.get_clients_list()
-            self._send_to_client(client_socket, users_list, security_manager)
             return 'continue'
         
-        # Regular message - broadcast it
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        formatted_message = f"[{timestamp}] {pseudo}: {message}"
-        print(formatted_message)
-        self._broadcast_message(formatted_message, client_manager, exclude_client=client_socket, security_manager=security_manager)
+        context = MessageContext(message, pseudo, client_socket, client_manager, security_manager)
+        return self.pipeline.run(context)
+    
+    def close(self):
+        """Finish the deferred stages of messages already processed"""
+        self.pipeline.close()
+    
+    # --------------------------------------------------------------------------
+    # STAGES
+    # --------------------------------------------------------------------------
+    
+    def _stage_rate_limit(self, context):
+        security_manager = context.security_manager
+        if security_manager and not security_manager.check_rate_limit(
+                context.pseudo, context.client_manager.get_ip(context.client_socket)):
+            self._send_to_client(context.client_socket, "Rate limit exceeded. Please slow down.", security_manager)
+            return 'continue'
+        return None
+    
+    def _stage_filter(self, context):
+        if context.security_manager:
+            context.message = context.security_manager.filter_content(context.message)
+        return None
+    
+    def _stage_command(self, context):
+        """Run a registered /command, anything else goes on as chat"""
+        if not context.message.startswith('/'):
+            return None
+        command, _, argument = context.message.partition(' ')
+        entry = self.commands.get(command.lower())
+        if entry is None:
+            return None
+        handler, takes_argument = entry
+        if argument and not takes_argument:
+            return None
+        return handler(context, argument)
+    
+    def _stage_format(self, context):
+        context.room = context.client_manager.get_room(context.client_socket)
+        context.timestamp = self.timestamps.now()
+        context.frame = encode_frame(f"[{context.timestamp}] {context.pseudo}: {context.message}")
+        return None
+    
+    def _stage_broadcast(self, context):
+        client_manager = context.client_manager
+        event = client_manager.encode_event(chat_event(context.pseudo, context.room, context.message))
+        self._broadcast_frame(context.frame, client_manager, exclude_client=context.client_socket,
+                              security_manager=context.security_manager, room=context.room, event=event,
+                              skip=context.marked)
+        return None
+    
+    def _stage_mentions(self, context):
+        # Before the broadcast, which skips the clients given a highlighted copy
+        if '@' in context.message:
+            context.marked = self._notify_mentions(context.message, context.pseudo, context.room,
+                                                   context.timestamp, context.client_manager)
+        return None
+    
+    def _stage_history(self, context):
+        # Recorded by the reader: a /history or a handoff right after must include it
+        if self.history:
+            self.history.append(context.room, context.frame)
+    
+    def _stage_log(self, context):
+        log.chat(context.room, context.pseudo, context.message)
+    
+    def _stage_persist(self, context):
+        if self.chat_log:
+            self.chat_log.append(context.room, context.frame)
+    
+    # --------------------------------------------------------------------------
+    # COMMANDS
+    # --------------------------------------------------------------------------
+    
+    def _command_quit(self, context, argument):
+        return 'disconnect'
+    
+    def _command_users(self, context, argument):
+        argument = argument.strip()
+        client_manager = context.client_manager
+        page = parse_number(argument) if argument else 1
+        if page is not None:
+            listing = client_manager.get_users_page(page)
+        else:
+            listing = client_manager.find_users(argument)
+        self._send_frame(context.client_socket, listing)
+        return 'continue'
+    
+    def _command_join(self, context, argument):
+        room = self._normalize_room(argument)
+        if room is None:
+            self._send_to_client(context.client_socket, "Usage: /join <room> (letters, digits, '-' and '_', 32 max)\n",
+                                 context.security_manager)
+        else:
+            self._change_room(room, context.pseudo, context.client_socket, context.client_manager,
+                              context.security_manager)
+        return 'continue'
+    
+    def _command_leave(self, context, argument):
+        self._change_room(DEFAULT_ROOM, context.pseudo, context.client_socket, context.client_manager,
+                          context.security_manager)
+        return 'continue'
+    
+    def _command_rooms(self, context, argument):
+        client_manager = context.client_manager
+        rooms_list = client_manager.get_rooms_list(client_manager.get_room(context.client_socket))
+        self._send_to_client(context.client_socket, rooms_list, context.security_manager)
+        return 'continue'
+    
+    def _command_stats(self, context, argument):
+        if context.client_manager.get_ip(context.client_socket) in ADMIN_ADDRESSES:
+            self._send_to_client(context.client_socket, metrics.format_stats(), context.security_manager)
+        else:
+            self._send_to_client(context.client_socket, "/stats is only available from the server machine\n",
+                                 context.security_manager)
+        return 'continue'
+    
+    def _command_msg(self, context, argument):
+        self._send_private(argument, context.pseudo, context.client_socket, context.client_manager,
+                           context.security_manager)
         return 'continue'
     
+    def _command_inbox(self, context, argument):
+        if not self.send_inbox(context.client_socket, context.pseudo, context.client_manager):
+            self._send_to_client(context.client_socket, "No private messages\n", context.security_manager)
+        return 'continue'
+    
+    def _command_history(self, context, argument):
+        argument = argument.strip()
+        count = parse_number(argument) if argument else None
+        if argument and count is None:
+            self._send_to_client(context.client_socket, f"Usage: /history [count] (at most {MAX_HISTORY_REQUEST})\n",
+                                 context.security_manager)
+            return 'continue'
+        if count is not None:
+            count = min(count, MAX_HISTORY_REQUEST)
+        client_socket = context.client_socket
+        if not self.send_history(client_socket, context.client_manager.get_room(client_socket), count):
+            self._send_to_client(client_socket, "No history for this room\n", context.security_manager)
+        return 'continue'
+    
+    # --------------------------------------------------------------------------
+    # REPLIES
+    # --------------------------------------------------------------------------
+    
+    def send_history(self, client_socket, room, count=None):
+        """Replay recent frames of a room in a single write, False if there are none"""
+        if not self.history:
+            return False
+        frames = self.history.recent(room, count)
+        if not frames:
+            return False
+        
+        header = f"--- Last {len(frames)} message{'s' if len(frames) != 1 else ''} in #{room} ---\n"
+        try:
+            client_socket.send(header.encode('utf-8') + b"".join(frames))
+        except Exception as e:
+            log.error('send.error', "Error sending history to client: {error}", error=e)
+        return True
+    
+    def send_inbox(self, client_socket, pseudo, client_manager):
+        """Replay the private messages kept for a user, False if there are none"""
+        frames = self._inbox_frames(client_socket, pseudo, client_manager)
+        if not frames:
+            return False
+        header = f"--- Last {len(frames)} private message{'s' if len(frames) != 1 else ''} ---\n"
+        try:
+            client_socket.send(header.encode('utf-8') + b"".join(frames))
+        except Exception as e:
+            log.error('send.error', "Error sending inbox to client: {error}", error=e)
+        return True
+    
+    def send_inbox_notice(self, client_socket, pseudo, client_manager):
+        """Tell a returning user that private messages are waiting"""
+        count = len(self._inbox_frames(client_socket, pseudo, client_manager))
+        if count:
+            self._send_to_client(client_socket, f"You have {count} recent private message{'s' if count != 1 else ''}, type /inbox to read\n")
+    
+    def _inbox_frames(self, client_socket, pseudo, client_manager):
+        if not client_manager.inbox:
+            return []
+        return client_manager.inbox.recent(pseudo, client_manager.get_ip(client_socket))
+    
+    def _send_private(self, argument, pseudo, client_socket, client_manager, security_manager=None):
+        """Deliver /msg <user> <text> straight to the user's connection"""
+        target, _, text = argument.strip().partition(' ')
+        text = text.strip()
+        if not target or not text:
+            self._send_to_client(client_socket, "Usage: /msg <user> <text>\n", security_manager)
+            return
+        if target == pseudo:
+            self._send_to_client(client_socket, "You cannot send a private message to yourself\n", security_manager)
+            return
+        
+        timestamp = self.timestamps.now()
+        # Both copies share one typed event, it names sender and recipient
+        event = client_manager.encode_event(private_event(pseudo, target, text))
+        if not client_manager.send_to_user(target, encode_frame(f"[{timestamp}] [PM from {pseudo}] {text}"), event):
+            self._send_to_client(client_socket, f"{target} is not online\n", security_manager)
+            return
+        # The sender's copy goes through their own inbox as well
+        client_manager.deliver_direct(pseudo, encode_frame(f"[{timestamp}] [PM to {target}] {text}"), event)
+    
+    def _notify_mentions(self, message, pseudo, room, timestamp, client_manager):
+        """Send a highlighted copy of a room message to every @mentioned user
+
+        Returns the local clients of the room that got the highlighted copy in
+        place of the plain room frame
+        """
+        frame = event = None
+        notified = set()
+        marked = []
+        for match in MENTION_PATTERN.finditer(message):
+            username = match.group(1).rstrip(MENTION_TRAILING)
+            if not username or username == pseudo or username in notified:
+                continue
+            notified.add(username)
+            user_room, client_socket = client_manager.locate_user(username)
+            if user_room == room and client_socket is None:
+                # Another process delivers the room frame to them, a copy would show twice
+                continue
+            if frame is None:
+                frame = encode_frame(f"[{timestamp}] [mention] {pseudo} in #{room}: {message}")
+                event = client_manager.encode_event(mention_event(pseudo, room, message))
+            if user_room == room:
+                client_manager.deliver_direct(username, frame, event)
+                marked.append(client_socket)
+            else:
+                client_manager.send_to_user(username, frame, event)
+            if len(notified) >= MAX_MENTIONS:
+                break
+        return marked
+    
+    def _normalize_room(self, name):
+        """Canonical room name, or None if it is not valid"""
+        room = name.strip().lstrip('#').lower()
+        return room if ROOM_NAME_PATTERN.match(room) else None
+    
+    def _change_room(self, room, pseudo, client_socket, client_manager, security_manager=None):
+        """Move a client to a room and announce it to both rooms"""
+        previous_room = client_manager.join_room(client_socket, room)
+        if previous_room is None:
+            return
+        if previous_room == room:
+            self._send_to_client(client_socket, f"You are already in #{room}\n", security_manager)
+            return
+        
+        client_manager.broadcast_message(f"{pseudo} left #{previous_room}", room=previous_room,
+                                         event=leave_event(pseudo, previous_room))
+        client_manager.broadcast_message(f"{pseudo} joined #{room}", exclude_client=client_socket, room=room,
+                                         event=join_event(pseudo, room))
+        count = client_manager.get_room_count(room)
+        self._send_to_client(client_socket, f"Joined #{room} ({count} user{'s' if count != 1 else ''})\n", security_manager)
+        self.send_history(client_socket, room)
+    
     def _send_to_client(self, client_socket, message, security_manager=None):
         """Send message to a specific client (no encryption)"""
         try:
             client_socket.send(message.encode('utf-8'))
         except Exception as e:
-            print(f"Error sending message to client: {e}")
+            log.error('send.error', "Error sending message to client: {error}", error=e)
     
-    def _broadcast_message(self, message, client_manager, exclude_client=None, security_manager=None):
-        """Broadcast message to all clients (no encryption)"""
-        client_manager.broadcast_message(message, exclude_client=exclude_client)
+    def _send_frame(self, client_socket, frame):
+        """Send an already encoded reply to a specific client"""
+        try:
+            client_socket.send(frame)
+        except Exception as e:
+            log.error('send.error', "Error sending message to client: {error}", error=e)
+    
+    def _broadcast_frame(self, frame, client_manager, exclude_client=None, security_manager=None, room=None,
+                         event=None, skip=()):
+        """Broadcast an encoded message to all clients of a room (no encryption)"""
+        client_manager.broadcast_frame(frame, exclude_client=exclude_client, room=room, chat=True, event=event,
+                                       skip=skip)
     
     def handle_message_loop(self, client_socket, pseudo, client_manager, server_running, security_manager=None):
         """Handle the main message reception loop"""
         while server_running():
             try:
-                raw_message = client_socket.recv(1024)
-                if not raw_message:
+                # Every line that arrived together is handled in one wakeup
+                messages = client_socket.read_lines()
+                if not messages:
                     break
-                
-                # No decryption - direct message handling
-                message = raw_message.decode('utf-8')
                     
-                action = self.process_message(message, pseudo, client_socket, client_manager, security_manager)
-                if action == 'disconnect':
+                if not self._process_lines(messages, pseudo, client_socket, client_manager, security_manager):
                     break
                     
             except socket.error:
-                break
\ No newline at end of file
+                break
+    
+    async def handle_message_loop_async(self, client_socket, pseudo, client_manager, server_running, security_manager=None):
+        """Handle the main message reception loop (event-loop version)"""
+        while server_running():
+            try:
+                messages = await client_socket.read_lines()
+                if not messages:
+                    break
+                    
+                if not self._process_lines(messages, pseudo, client_socket, client_manager, security_manager):
+                    break
+                    
+            except socket.error:
+                break
+    
+    def _process_lines(self, messages, pseudo, client_socket, client_manager, security_manager=None):
+        """Process a batch of received lines, False once the client should disconnect"""
+        for message in messages:
+            started = MESSAGE_SECONDS.start()
+            action = self.process_message(message, pseudo, client_socket, client_manager, security_manager)
+            MESSAGE_SECONDS.stop(started)
+            if action == 'disconnect':
+                return False
+        return True
\ No newline at end of file
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Metrics for Schrimp Chat Server
+Counters and log-bucketed latency histograms recorded at the server hooks,
+exposed in the Prometheus text format on a local HTTP port and summarized
+by the /stats command
+"""
+
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Histogram buckets are powers of two seconds, from about 1 us to 16 s
+MIN_EXPONENT = -20
+MAX_EXPONENT = 4
+BUCKET_BOUNDS = tuple(2.0 ** exponent for exponent in range(MIN_EXPONENT, MAX_EXPONENT + 1))
+LAST_BUCKET = len(BUCKET_BOUNDS)   # index of the +Inf bucket
+
+# Per-message timings only time one call in this many (a power of two)
+DEFAULT_SAMPLE_EVERY = 8
+
+# Updates are not locked: they run on every message, and an increment lost
+# to a thread switch once in a long while is cheaper than a lock each time
+
+
+# ==============================================================================
+# METRIC TYPES
+# ==============================================================================
+
+class Counter:
+    """Monotonic counter"""
+
+    metric_type = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [(self.name, self.value)]
+
+
+class Histogram:
+    """Latency histogram with one bucket per power of two seconds"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, sample_every=1):
+        self.name = name
+        self.help_text = help_text
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)   # last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.calls = 0                                 # every call of start(), timed or not
+        self.sample_mask = sample_every - 1
+
+    def start(self):
+        """Count a call, returns its start time when it is sampled and 0.0 otherwise"""
+        self.calls += 1
+        if self.calls & self.sample_mask:
+            return 0.0
+        return time.perf_counter()
+
+    def stop(self, started):
+        """Record a call begun with start(), if it was sampled"""
+        if started:
+            self.observe(time.perf_counter() - started)
+
+    def observe(self, seconds):
+        """Record one duration, a frexp picks the bucket without any search"""
+        index = math.frexp(seconds)[1] - MIN_EXPONENT
+        if index < 0 or seconds <= 0:
+            index = 0
+        elif index > LAST_BUCKET:
+            index = LAST_BUCKET
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding a percentile, None when empty"""
+        counts = list(self.counts)
+        count = sum(counts)
+        if not count:
+            return None
+        rank = fraction * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else math.inf
+        return math.inf
+
+    def samples(self):
+        counts = list(self.counts)
+        count, total = sum(counts), self.total
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKET_BOUNDS, counts):
+            cumulative += bucket_count
+            samples.append((f'{self.name}_bucket{{le="{bound:.9g}"}}', cumulative))
+        samples.append((f'{self.name}_bucket{{le="+Inf"}}', count))
+        samples.append((f'{self.name}_sum', total))
+        samples.append((f'{self.name}_count', count))
+        return samples
+
+    def families(self):
+        """Extra metric families: the exact call count of a sampled histogram"""
+        if not self.sample_mask:
+            return []
+        name = self.name.rsplit('_seconds', 1)[0] + '_total'
+        return [(name, f"Calls of {self.name}, 1 in {self.sample_mask + 1} timed", 'counter', self.calls)]
+
+
+class Callback:
+    """Value read from a function when the metrics are collected"""
+
+    def __init__(self, name, help_text, function, metric_type='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.function = function
+        self.metric_type = metric_type
+
+    def samples(self):
+        return [(self.name, self.function())]
+
+
+# ==============================================================================
+# REGISTRY
+# ==============================================================================
+
+class Metrics:
+    """Registry of every metric of the process"""
+
+    def __init__(self):
+        self.metrics = {}   # {name: metric} in registration order
+        self.started = time.time()
+
+    def counter(self, name, help_text):
+        return self.metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name, help_text, sample_every=1):
+        return self.metrics.setdefault(name, Histogram(name, help_text, sample_every))
+
+    def callback(self, name, help_text, function, metric_type='gauge'):
+        """Register (or replace) a metric computed on collection"""
+        self.metrics[name] = Callback(name, help_text, function, metric_type)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            for sample_name, value in metric.samples():
+                lines.append(f"{sample_name} {value}")
+            if isinstance(metric, Histogram):
+                for name, help_text, metric_type, value in metric.families():
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {metric_type}")
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def format_stats(self):
+        """Human readable summary for the /stats command"""
+        uptime = max(time.time() - self.started, 1e-9)
+        lines = [f"Server stats (up {uptime:.0f} s):"]
+        for metric in list(self.metrics.values()):
+            label = metric.name.replace('schrimp_', '', 1)
+            if isinstance(metric, Histogram):
+                if not metric.count:
+                    continue
+                calls = metric.calls if metric.sample_mask else metric.count
+                p50, p99 = metric.percentile(0.5), metric.percentile(0.99)
+                lines.append(f"  {label}: {calls} ({calls / uptime:.2f}/s), "
+                             f"avg {metric.total / metric.count * 1e6:.0f} us, "
+                             f"p50 <= {_format_seconds(p50)}, p99 <= {_format_seconds(p99)}")
+            elif metric.metric_type == 'counter':
+                value = metric.samples()[0][1]
+                lines.append(f"  {label}: {value} ({value / uptime:.2f}/s)")
+            else:
+                lines.append(f"  {label}: {metric.samples()[0][1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_seconds(seconds):
+    if seconds == math.inf:
+        return "inf"
+    if seconds >= 1:
+        return f"{seconds:.0f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.0f} ms"
+    return f"{seconds * 1e6:.0f} us"
+
+
+# ==============================================================================
+# HTTP ENDPOINT
+# ==============================================================================
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves GET /metrics"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1', registry=None):
+    """Serve the Prometheus endpoint from a daemon thread, returns the HTTP server"""
+    http_server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    http_server.daemon_threads = True
+    http_server.metrics = registry or metrics
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server
+
+
+# Process-wide registry used by every component
+metrics = Metrics()
+
+# Hooks shared by the threaded and event-loop servers
+CONNECTIONS_ACCEPTED = metrics.counter('schrimp_connections_accepted_total', "TCP connections accepted")
+AUTH_FAILURES = metrics.counter('schrimp_auth_failures_total', "Clients that gave a wrong password")
+HANDSHAKE_SECONDS = metrics.histogram('schrimp_handshake_seconds', "Time from accept to a registered username")
+MESSAGE_SECONDS = metrics.histogram('schrimp_message_processing_seconds', "Time to process one received line",
+                                    DEFAULT_SAMPLE_EVERY)
+BROADCAST_RECIPIENTS = metrics.counter('schrimp_broadcast_recipients_total', "Frames queued to local clients")
+BROADCAST_SECONDS = metrics.histogram('schrimp_broadcast_fanout_seconds', "Time to queue one frame to every recipient",
+                                      DEFAULT_SAMPLE_EVERY)
+RATE_LIMITED = metrics.counter('schrimp_rate_limited_total', "Messages refused by the rate limiter")
+FILTERED = metrics.counter('schrimp_filtered_messages_total', "Messages changed by the content filter")
+DISCONNECTS = metrics.counter('schrimp_disconnects_total', "Registered clients that left")
+CONNECTIONS_REJECTED = metrics.counter('schrimp_connections_rejected_total', "Connections refused by the connection caps")
+HANDSHAKE_TIMEOUTS = metrics.counter('schrimp_handshake_timeouts_total', "Clients dropped for an unanswered prompt")
+IDLE_REAPED = metrics.counter('schrimp_idle_reaped_total', "Clients dropped for inactivity")
+DIRECT_FRAMES = metrics.counter('schrimp_direct_frames_total', "Private messages and mentions delivered to a local client")
+NETWORK_ERRORS = metrics.counter('schrimp_network_errors_total', "Clients dropped after a send error")
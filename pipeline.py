@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Message pipeline for Schrimp Chat Server
+Every received line goes through an ordered list of named stages; stages
+that only record what happened can be deferred to worker threads that run
+them in batches, and one message in a few is timed stage by stage
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from server_log import log
+from metrics import metrics, DEFAULT_SAMPLE_EVERY
+
+
+DEFAULT_STAGE_WORKERS = 0     # threads running deferred stages, 0 runs them inline
+MAX_DEFERRED = 10000          # messages queued per worker before the reader runs them itself
+CLOSE_TIMEOUT = 5.0           # seconds close() waits for the workers to run what is queued
+
+
+# ==============================================================================
+# TIMESTAMPS
+# ==============================================================================
+
+class TimestampCache:
+    """Chat timestamp string, formatted once per second instead of once per message"""
+
+    def __init__(self, time_format="%H:%M:%S"):
+        self.time_format = time_format
+        self._cached = (None, "")   # (second, text), replaced as a whole so readers need no lock
+
+    def now(self):
+        second = int(time.time())
+        cached = self._cached
+        if cached[0] == second:
+            return cached[1]
+        text = time.strftime(self.time_format, time.localtime(second))
+        self._cached = (second, text)
+        return text
+
+
+# ==============================================================================
+# PIPELINE
+# ==============================================================================
+
+class MessageContext:
+    """State of one received line as it goes through the stages"""
+
+    __slots__ = ('message', 'pseudo', 'client_socket', 'client_manager', 'security_manager',
+                 'room', 'timestamp', 'frame', 'marked', 'timed')
+
+    def __init__(self, message, pseudo, client_socket, client_manager, security_manager=None):
+        self.message = message
+        self.pseudo = pseudo
+        self.client_socket = client_socket
+        self.client_manager = client_manager
+        self.security_manager = security_manager
+        self.room = None
+        self.timestamp = None
+        self.frame = None
+        self.marked = ()     # local clients sent a highlighted copy in place of the room frame
+        self.timed = False
+
+
+class Stage:
+    """Named step of the pipeline with its latency histogram"""
+
+    __slots__ = ('name', 'function', 'seconds')
+
+    def __init__(self, name, function, sample_every):
+        self.name = name
+        self.function = function   # callable(context), returns an action to stop the pipeline
+        self.seconds = metrics.histogram(f'schrimp_stage_{name}_seconds',
+                                         f"Time spent in the {name} stage, 1 in {sample_every} messages timed")
+
+
+def run_stages(stages, context):
+    """Run stages in order until one returns an action, returns it or None"""
+    if not context.timed:
+        for stage in stages:
+            action = stage.function(context)
+            if action is not None:
+                return action
+        return None
+
+    for stage in stages:
+        started = time.perf_counter()
+        action = stage.function(context)
+        stage.seconds.observe(time.perf_counter() - started)
+        if action is not None:
+            return action
+    return None
+
+
+class Pipeline:
+    """Ordered stages applied to every received line"""
+
+    def __init__(self, workers=DEFAULT_STAGE_WORKERS, sample_every=DEFAULT_SAMPLE_EVERY):
+        self.stages = []     # run by the reader, in order
+        # Run after them, on the workers when there are some: these stages must
+        # not change the message or write to connections
+        self.deferred = []
+        self.sample_every = sample_every
+        self.sample_mask = sample_every - 1
+        self.runs = itertools.count(1)   # shared by every reader, next() is atomic under the GIL
+        self.workers = StageWorkers(workers) if workers > 0 else None
+
+    def add_stage(self, name, function, deferred=False, before=None):
+        """Register a stage at the end, or before another one of the same kind"""
+        stages = self.deferred if deferred else self.stages
+        index = len(stages)
+        if before is not None:
+            index = next(i for i, stage in enumerate(stages) if stage.name == before)
+        stage = Stage(name, function, self.sample_every)
+        stages.insert(index, stage)
+        return stage
+
+    def remove_stage(self, name):
+        self.stages = [stage for stage in self.stages if stage.name != name]
+        self.deferred = [stage for stage in self.deferred if stage.name != name]
+
+    def run(self, context, default_action='continue'):
+        """Run a line through the stages, returns the action of the one that stopped it"""
+        context.timed = not next(self.runs) & self.sample_mask
+        action = run_stages(self.stages, context)
+        if action is not None:
+            return action
+        if self.deferred and (self.workers is None or not self.workers.submit(self.deferred, context)):
+            run_stages(self.deferred, context)
+        return default_action
+
+    def close(self):
+        """Run every deferred message still queued and stop the workers"""
+        if self.workers:
+            self.workers.close()
+
+
+# ==============================================================================
+# DEFERRED STAGES
+# ==============================================================================
+
+class StageWorkers:
+    """Threads running deferred stages in batches, the messages of a room always on the same one"""
+
+    def __init__(self, count):
+        self.queues = [deque() for _ in range(count)]
+        self.conditions = [threading.Condition() for _ in range(count)]
+        self.closed = False
+        self.worker_batches = [0] * count   # one slot per worker, each written by its own thread only
+        self.threads = [threading.Thread(target=self._run, args=(index,), daemon=True) for index in range(count)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, stages, context):
+        """Queue a message for its worker, False when it is full or closed"""
+        index = hash(context.room) % len(self.queues)
+        queue = self.queues[index]
+        with self.conditions[index]:
+            if self.closed or len(queue) >= MAX_DEFERRED:
+                return False
+            queue.append((stages, context))
+            self.conditions[index].notify()
+        return True
+
+    def get_batch_count(self):
+        """Batches run by every worker so far"""
+        return sum(self.worker_batches)
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """Stop taking messages and wait, at most timeout seconds, for the queued ones"""
+        self.closed = True
+        for condition in self.conditions:
+            with condition:
+                condition.notify()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        left = sum(len(queue) for queue in self.queues)
+        if left:
+            log.warning('pipeline.close', "Pipeline: {count} messages left in the deferred stages", count=left)
+
+    def _run(self, index):
+        """Take every queued message in one wakeup and run its deferred stages"""
+        queue, condition = self.queues[index], self.conditions[index]
+        while True:
+            with condition:
+                while not queue and not self.closed:
+                    condition.wait()
+                if not queue:
+                    return
+                batch = list(queue)
+                queue.clear()
+            self.worker_batches[index] += 1
+            for stages, context in batch:
+                try:
+                    run_stages(stages, context)
+                except Exception as e:
+                    log.error('pipeline.error', "Deferred stage failed: {error}", error=e)
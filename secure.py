@@ -4,78 +4,250 @@ Basic security features for Schrimp Chat Server
 No encryption - just rate limiting, anti-spam, and content filtering
 """
 
+import os
+import re
+import threading
 import time
-from collections import defaultdict, deque
+from collections import OrderedDict
+from server_log import log
+from metrics import RATE_LIMITED, FILTERED
 
 
-class AntiSpam:
-    def __init__(self, max_messages=15, time_window=60):
-        self.max_messages = max_messages
-        self.time_window = time_window
-        self.user_messages = defaultdict(deque)
-        self.last_messages = defaultdict(str)
-    
-    def check_rate_limit(self, username):
-        current_time = time.time()
-        user_queue = self.user_messages[username]
-        
-        while user_queue and current_time - user_queue[0] > self.time_window:
-            user_queue.popleft()
-        
-        if len(user_queue) >= self.max_messages:
-            return False
+MAX_WORD_LENGTH = 200
+DEFAULT_MAX_KEYS = 100000  # most usernames or IPs tracked by the rate limiter
+IP_ALLOWANCE = 3           # an IP may send as much as this many users
+
+
+class WordMatcher:
+    """Banned words compiled once into a trie-shaped regex, reused for every message"""
+    
+    def __init__(self, pattern):
+        self.pattern = re.compile(pattern)
+        self._fallback = None
+    
+    def sub(self, replacement, message):
+        # Matching the lowercased text with a case-sensitive pattern is much
+        # faster than IGNORECASE, and the spans line up while lengths agree
+        lowered = message.lower()
+        if len(lowered) != len(message):
+            if self._fallback is None:
+                self._fallback = re.compile(self.pattern.pattern, re.IGNORECASE)
+            return self._fallback.sub(replacement, message)
         
-        user_queue.append(current_time)
-        return True
+        pieces = []
+        last = 0
+        for match in self.pattern.finditer(lowered):
+            start, end = match.span()
+            pieces.append(message[last:start])
+            pieces.append(replacement(match))
+            last = end
+        if not pieces:
+            return message
+        pieces.append(message[last:])
+        return ''.join(pieces)
+
+
+def build_matcher(words):
+    """Compile banned words into a WordMatcher, None if there are none"""
+    trie = {}
+    for word in words:
+        word = word.strip().lower()
+        if not word or len(word) > MAX_WORD_LENGTH:
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+    
+    if not trie:
+        return None
+    return WordMatcher(_trie_pattern(trie))
+
+
+def _trie_pattern(node):
+    # Branches share their prefixes, and the optional group after a complete
+    # word makes the match greedy, so the longest banned word wins
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    if '' in node:
+        return '(?:' + '|'.join(branches) + ')?'
+    if len(branches) == 1:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')'
+
+
+def _mask(match):
+    return '*' * len(match.group())
+
+
+class RateLimiter:
+    """GCRA limiter storing one float per key, idle keys evicted in LRU order"""
+    
+    def __init__(self, max_messages, time_window, max_keys=DEFAULT_MAX_KEYS):
+        if max_messages < 1:
+            raise ValueError(f"rate limit must allow at least 1 message, got {max_messages}")
+        self.interval = time_window / max_messages          # seconds earned per message
+        self.tolerance = self.interval * (max_messages - 1)  # burst allowance
+        self.max_keys = max_keys
+        self.arrivals = OrderedDict()  # {key: theoretical arrival time}, least recently used first
+    
+    def check(self, key, now):
+        """New arrival time if a message from key conforms now, None if it must wait"""
+        arrival = max(self.arrivals.get(key, now), now)
+        if arrival - now > self.tolerance:
+            return None
+        return arrival + self.interval
+    
+    def commit(self, key, arrival, now):
+        self.arrivals[key] = arrival
+        self.arrivals.move_to_end(key)
+        self.evict(now)
+    
+    def evict(self, now):
+        # A key whose arrival time has passed is back to a full burst, exactly
+        # like an unknown key, so dropping it loses nothing
+        arrivals = self.arrivals
+        while arrivals:
+            key, arrival = next(iter(arrivals.items()))
+            if arrival > now and len(arrivals) <= self.max_keys:
+                break
+            del arrivals[key]
+
+
+class AntiSpam:
+    def __init__(self, max_messages=15, time_window=60, ip_max_messages=None, max_keys=DEFAULT_MAX_KEYS):
+        if ip_max_messages is None:
+            ip_max_messages = max_messages * IP_ALLOWANCE
+        self.lock = threading.Lock()
+        # Per IP as well, so reconnecting under a new name does not reset the limit
+        self.user_limiter = RateLimiter(max_messages, time_window, max_keys)
+        self.ip_limiter = RateLimiter(ip_max_messages, time_window, max_keys)
+        self.max_keys = max_keys
+        self.last_messages = OrderedDict()  # {username: hash of last message}
+    
+    def check_rate_limit(self, username, ip=None):
+        now = time.monotonic()
+        with self.lock:
+            user_arrival = self.user_limiter.check(username, now)
+            if user_arrival is None:
+                return False
+            if ip is not None:
+                ip_arrival = self.ip_limiter.check(ip, now)
+                if ip_arrival is None:
+                    return False
+                self.ip_limiter.commit(ip, ip_arrival, now)
+            self.user_limiter.commit(username, user_arrival, now)
+            return True
     
     def check_duplicate(self, username, message):
-        if self.last_messages[username] == message:
-            return False
-        
-        self.last_messages[username] = message
-        return True
+        message_hash = hash(message)
+        with self.lock:
+            if self.last_messages.get(username) == message_hash:
+                return False
+            self.last_messages[username] = message_hash
+            self.last_messages.move_to_end(username)
+            if len(self.last_messages) > self.max_keys:
+                self.last_messages.popitem(last=False)
+            return True
 
 
 class ContentFilter:
-    def __init__(self, max_length=500):
+    def __init__(self, max_length=500, word_file=None):
         self.max_length = max_length
         self.banned_words = ['spam', 'hack', 'exploit']
+        self.word_file = word_file
+        self._matcher = build_matcher(self.banned_words)
+        self._watcher = None
+        if word_file:
+            self.load_words(word_file)
+    
+    def set_banned_words(self, words):
+        # Compile first, then swap: messages keep using the previous matcher meanwhile
+        matcher = build_matcher(words)
+        self.banned_words = list(words)
+        self._matcher = matcher
+    
+    def load_words(self, path):
+        with open(path, encoding='utf-8') as word_file:
+            words = [line.strip() for line in word_file]
+        self.set_banned_words([word for word in words if word and not word.startswith('#')])
+    
+    def start_watching(self, interval=5.0):
+        """Reload the word file in the background whenever it changes"""
+        if not self.word_file or self._watcher:
+            return
+        self._watcher = threading.Thread(target=self._watch_loop, args=(interval,), daemon=True)
+        self._watcher.start()
+    
+    def _watch_loop(self, interval):
+        last_modified = self._modified_time()
+        while True:
+            time.sleep(interval)
+            modified = self._modified_time()
+            if modified == last_modified:
+                continue
+            last_modified = modified
+            try:
+                self.load_words(self.word_file)
+                log.info('filter.reload', "Reloaded {count} banned words from {path}",
+                         count=len(self.banned_words), path=self.word_file)
+            except (OSError, UnicodeDecodeError, re.error) as e:
+                log.error('filter.reload', "Could not reload banned words: {error}", error=e)
+    
+    def _modified_time(self):
+        try:
+            return os.stat(self.word_file).st_mtime_ns
+        except OSError:
+            return None
     
     def filter_message(self, message):
         if not message or not message.strip():
             return None
         
-        if len(message) > self.max_length:
-            return f"{message[:self.max_length]}... [truncated]"
+        truncated = len(message) > self.max_length
+        if truncated:
+            message = message[:self.max_length]
         
-        for word in self.banned_words:
-            if word.lower() in message.lower():
-                message = message.replace(word, "*" * len(word))
+        # Single case-insensitive pass masking every banned word
+        matcher = self._matcher
+        if matcher is not None:
+            message = matcher.sub(_mask, message)
         
+        if truncated:
+            return f"{message}... [truncated]"
         return message
 
 
 class SecurityManager:
-    def __init__(self, enable_security=True):
+    def __init__(self, enable_security=True, banned_words_file=None, max_messages=15, time_window=60):
         if enable_security:
-            self.anti_spam = AntiSpam()
-            self.content_filter = ContentFilter()
+            self.anti_spam = AntiSpam(max_messages, time_window)
+            self.content_filter = ContentFilter(word_file=banned_words_file)
+            self.content_filter.start_watching()
             self.enabled = True
         else:
             self.anti_spam = None
             self.content_filter = None
             self.enabled = False
     
-    def check_rate_limit(self, username):
+    def check_rate_limit(self, username, ip=None):
         if not self.enabled or not self.anti_spam:
             return True
-        return self.anti_spam.check_rate_limit(username)
+        allowed = self.anti_spam.check_rate_limit(username, ip)
+        if not allowed:
+            RATE_LIMITED.inc()
+        return allowed
     
     def filter_content(self, message):
         if not self.enabled or not self.content_filter:
             return message
         filtered = self.content_filter.filter_message(message)
-        return filtered if filtered is not None else message
+        if filtered is None:
+            return message
+        if filtered != message:
+            FILTERED.inc()
+        return filtered
     
     def check_duplicate(self, username, message):
         if not self.enabled or not self.anti_spam:
@@ -4,9 +4,25 @@ Main Chat Server - Schrimp
 Core server implementation that orchestrates all components
 """
 
+import os
+import signal
 import socket
 import threading
-from client_manager import ClientManager
+import time
+from client_manager import ClientManager, DEFAULT_ROOM, encode_frame
+from history import MessageHistory, DirectInbox, DEFAULT_HISTORY_BYTES, DEFAULT_REPLAY_COUNT, DEFAULT_INBOX_SIZE
+from chat_log import ChatLog, DEFAULT_SEGMENT_BYTES
+from connection import SocketConnection, OutboundStats, DEFAULT_HIGH_WATER, POLICY_DROP_OLDEST
+from bus import BusClient
+from federation import Federation
+from handoff import (HandoffListener, take_over, spawn_successor, sd_notify, DEFAULT_DRAIN_TIMEOUT,
+                     HANDOFF_PARK_TIMEOUT, HANDOFF_FLUSH_TIMEOUT, RESTART_NOTICE)
+from server_log import log
+from admission import (AdmissionControl, refuse, DEFAULT_BACKLOG, DEFAULT_MAX_CLIENTS, DEFAULT_MAX_PER_IP,
+                       DEFAULT_HANDSHAKE_TIMEOUT, DEFAULT_IDLE_TIMEOUT, PHASE_AUTH, PHASE_USERNAME, PHASE_CHAT)
+from metrics import metrics, start_metrics_server, CONNECTIONS_ACCEPTED, AUTH_FAILURES, HANDSHAKE_SECONDS
+from binary_protocol import join_event, leave_event
+from pipeline import DEFAULT_STAGE_WORKERS
 
 # Try to import security components (anti-spam, rate limiting, etc.)
 try:
@@ -18,14 +34,8 @@ except ImportError:
 from auth_handler import AuthHandler
 from message_handler import MessageHandler
 
-# Try to import security features (optional)
-try:
-    from secure import SecurityManager, generate_session_token
-    SECURITY_AVAILABLE = True
-except ImportError:
-    SECURITY_AVAILABLE = False
-    print("⚠️  Security features not available (missing cryptography library)")
-    print("   Install with: pip install cryptography")
+
+ACCEPT_POLL_INTERVAL = 0.5   # seconds between checks of the stop flags by the accept loop
 
 
 # ========================================================
@@ -36,22 +46,67 @@ except ImportError:
 class ChatServer:
     """Main chat server class that coordinates all components"""
     
-    def __init__(self, host='0.0.0.0', port=3031, password=None):
+    def __init__(self, host='0.0.0.0', port=3031, password=None,
+                 high_water=DEFAULT_HIGH_WATER, slow_consumer_policy=POLICY_DROP_OLDEST,
+                 history_bytes=DEFAULT_HISTORY_BYTES, history_replay=DEFAULT_REPLAY_COUNT,
+                 log_dir=None, log_segment_bytes=DEFAULT_SEGMENT_BYTES, banned_words_file=None,
+                 rate_limit=15, reuse_port=False, log_level='info', log_json=False, log_content=True,
+                 metrics_port=None, backlog=DEFAULT_BACKLOG, max_clients=DEFAULT_MAX_CLIENTS,
+                 max_per_ip=DEFAULT_MAX_PER_IP, handshake_timeout=DEFAULT_HANDSHAKE_TIMEOUT,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, inbox_size=DEFAULT_INBOX_SIZE,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT, handoff_path=None, takeover=False,
+                 stage_workers=DEFAULT_STAGE_WORKERS):
         self.host = host
         self.port = port
+        self.reuse_port = reuse_port   # several worker processes share the port
         self.server_socket = None
         self.running = False
+        self.bus = None
+        self.federation = None
+        self.metrics_port = metrics_port   # local Prometheus endpoint, disabled when None
+        self.backlog = backlog
+        self.admission = AdmissionControl(max_clients, max_per_ip, handshake_timeout, idle_timeout)
+        
+        # Graceful stop and hot restart
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self.handoff_path = handoff_path   # Unix socket a successor takes the server over from
+        self.takeover = takeover           # take over from the server at handoff_path on start
+        self.handoff_listener = None
+        self.handing_off = False
+        self.handoff_complete = threading.Event()
+        self.accept_stopped = threading.Event()
+        self.interrupt = None              # pipe waking the client readers for a handoff
+        
+        # Settings of the process-wide log, applied here so spawned workers get them too
+        log.configure(level=log_level, json_output=log_json, log_content=log_content)
+        
+        # Outbound queue settings shared by every connection
+        self.high_water = high_water
+        self.slow_consumer_policy = slow_consumer_policy
+        self.outbound_stats = OutboundStats()
         
         # Initialize components
         self.client_manager = ClientManager()
+        self.client_manager.inbox = DirectInbox(inbox_size) if inbox_size > 0 else None
+        self.client_manager.dispatch = self.dispatch
         self.auth_handler = AuthHandler(password)
-        self.message_handler = MessageHandler()
+        self.history = MessageHistory(history_bytes, history_replay) if history_bytes > 0 else None
+        self.chat_log = ChatLog(log_dir, log_segment_bytes) if log_dir else None
+        self.message_handler = MessageHandler(history=self.history, chat_log=self.chat_log, stage_workers=stage_workers)
+        self.restore_history()
         
         # Initialize security (rate limiting, anti-spam) - NO encryption
         if SECURITY_AVAILABLE:
-            self.security_manager = SecurityManager(enable_security=True)
+            self.security_manager = SecurityManager(
+                enable_security=True,
+                banned_words_file=banned_words_file,
+                max_messages=rate_limit
+            )
         else:
             self.security_manager = None
+        
+        self.register_metrics()
 
     # --------------------------------------------------------------------------
     # SERVER MANAGEMENT
@@ -60,28 +115,39 @@ class ChatServer:
     def start(self):
         """Starts the chat server"""
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(10)
+            if self.handoff_path:
+                self.interrupt = os.pipe()
+            self.server_socket, adopted = self.take_over()
+            if self.server_socket is None:
+                self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if self.reuse_port:
+                    self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                self.server_socket.bind((self.host, self.port))
+                self.server_socket.listen(self.backlog)
+            self.server_socket.settimeout(ACCEPT_POLL_INTERVAL)
             self.running = True
+            threading.Thread(target=self.admission.run_reaper, args=(lambda: self.running,), daemon=True).start()
+            if self.federation:
+                self.federation.start()
+            self.start_metrics()
+            self.print_banner()
+            for client in adopted:
+                client.sock.setblocking(True)
+                threading.Thread(target=self.handle_adopted_client, args=(client,), daemon=True).start()
+            self.start_handoff_listener()
             
-            print(f"Chat server started on {self.host}:{self.port}")
-            if self.security_manager:
-                print("Security: Rate limiting and anti-spam ENABLED")
-            else:
-                print("Security: DISABLED")
-            if self.auth_handler.password:
-                print(f"Password required: {self.auth_handler.password}")
-            else:
-                print("No password required")
-            print(f"Connection: nc {self.host} {self.port}")
-            print("=" * 50)
-            
-            while self.running:
+            while self.running and not self.handing_off:
                 try:
                     client_socket, client_address = self.server_socket.accept()
-                    print(f"New connection from {client_address[0]}:{client_address[1]}")
+                    CONNECTIONS_ACCEPTED.inc()
+                    
+                    # Refuse over the caps before spending a thread on it
+                    notice = self.admission.admit(client_address[0])
+                    if notice:
+                        refuse(client_socket, notice)
+                        continue
+                    log.debug('client.accept', "New connection from {ip}:{port}", ip=client_address[0], port=client_address[1])
                     
                     # Create a thread for each client
                     client_thread = threading.Thread(
@@ -91,84 +157,390 @@ class ChatServer:
                     client_thread.daemon = True
                     client_thread.start()
                     
+                except socket.timeout:
+                    continue
                 except socket.error:
                     if self.running:
-                        print("Error accepting connection")
+                        log.error('server.accept', "Error accepting connection")
+            
+            self.accept_stopped.set()
+            if self.handing_off:
+                self.handoff_complete.wait()
                         
         except Exception as e:
-            print(f"Server startup error: {e}")
+            log.error('server.start', "Server startup error: {error}", error=e)
         finally:
             self.stop()
 
+    def register_metrics(self):
+        """Expose the state of this server as collected metrics"""
+        metrics.callback('schrimp_connected_clients', "Clients registered on this process",
+                         lambda: len(self.client_manager.clients))
+        metrics.callback('schrimp_remote_clients', "Clients of other workers or linked nodes",
+                         lambda: len(self.client_manager.remote_users))
+        metrics.callback('schrimp_rooms', "Rooms with at least one local client",
+                         lambda: len(self.client_manager.rooms))
+        metrics.callback('schrimp_outbound_dropped_total', "Frames dropped for slow consumers",
+                         lambda: self.outbound_stats.dropped_oldest + self.outbound_stats.dropped_disconnect, 'counter')
+        metrics.callback('schrimp_outbound_evicted_total', "Slow consumers disconnected",
+                         lambda: self.outbound_stats.evicted_clients, 'counter')
+        if self.history:
+            metrics.callback('schrimp_history_bytes', "Bytes held by the message history",
+                             lambda: self.history.used_bytes)
+    
+    def start_metrics(self):
+        """Serve the Prometheus endpoint on the local interface if a port is set"""
+        if self.metrics_port:
+            start_metrics_server(self.metrics_port)
+    
+    def restore_history(self):
+        """Refill the in-memory history from the tail of the persistent log"""
+        if not self.history or not self.chat_log:
+            return
+        for _, room, frame in self.chat_log.read_tail(self.history.max_bytes):
+            self.history.append(room, frame)
+    
+    # --------------------------------------------------------------------------
+    # MULTI-PROCESS BUS
+    # --------------------------------------------------------------------------
+    
+    def attach_bus(self, path, on_lost=None):
+        """Join the local bus shared by the worker processes of this machine"""
+        self.bus = BusClient(path, self.client_manager, self.deliver_remote_frame, self.deliver_remote_direct,
+                             on_lost=on_lost)
+        self.client_manager.bus = self.bus
+    
+    def attach_federation(self, link_port=None, peers=(), secret=None):
+        """Link this node with other Schrimp nodes, started with the server"""
+        self.federation = Federation(
+            self.client_manager,
+            self.deliver_remote_frame,
+            listen_host=self.host,
+            listen_port=link_port,
+            peers=peers,
+            secret=secret,
+            deliver_direct=self.deliver_remote_direct
+        )
+        self.client_manager.federation = self.federation
+    
+    def deliver_remote_frame(self, room, frame, chat, event=None):
+        """Deliver a frame published by another worker or node to our own clients"""
+        self.dispatch(self._deliver_remote_frame, room, frame, chat, event)
+    
+    def _deliver_remote_frame(self, room, frame, chat, event):
+        if chat and self.history:
+            self.history.append(room, frame)
+        if chat and self.chat_log:
+            self.chat_log.append(room, frame)
+        self.client_manager.deliver_frame(frame, room=room, event=event)
+    
+    def deliver_remote_direct(self, username, frame, event=None):
+        """Deliver a private frame routed here by another worker or node"""
+        self.dispatch(self.client_manager.deliver_direct, username, frame, event)
+    
+    def dispatch(self, callback, *args):
+        """Run a callback from a bus or link thread where client connections may be used"""
+        callback(*args)
+    
+    def print_banner(self):
+        """Print the startup summary"""
+        print(f"Chat server started on {self.host}:{self.port}")
+        if self.security_manager:
+            print("Security: Rate limiting and anti-spam ENABLED")
+        else:
+            print("Security: DISABLED")
+        if self.auth_handler.password:
+            print(f"Password required: {self.auth_handler.password}")
+        else:
+            print("No password required")
+        print(f"Outbound queue: {self.high_water} bytes per client, policy {self.slow_consumer_policy}")
+        admission = self.admission
+        print(f"Admission: {admission.max_clients or 'unlimited'} clients, {admission.max_per_ip or 'unlimited'} per IP, "
+              f"backlog {self.backlog}, handshake timeout {admission.handshake_timeout or 'off'}, "
+              f"idle timeout {admission.idle_timeout or 'off'}")
+        if self.chat_log:
+            print(f"Chat log: {self.chat_log.directory} (recovered in {self.chat_log.recovery_seconds * 1000:.1f} ms)")
+        if self.bus:
+            print("Workers: sharing the port through SO_REUSEPORT, linked by the local bus")
+        if self.federation:
+            listening = f"links on port {self.federation.listen_port}" if self.federation.listen_port else "no inbound links"
+            peers = ", ".join(f"{host}:{port}" for host, port in self.federation.peers) or "none"
+            print(f"Federation: node {self.federation.node_id}, {listening}, peers {peers}")
+        if self.metrics_port:
+            print(f"Metrics: http://127.0.0.1:{self.metrics_port}/metrics")
+        pipeline = self.message_handler.pipeline
+        if pipeline.workers:
+            deferred = ", ".join(stage.name for stage in pipeline.deferred)
+            print(f"Pipeline: {len(pipeline.workers.threads)} workers for the deferred stages ({deferred})")
+        if self.handoff_path:
+            print(f"Hot restart: SIGHUP or --takeover, handoff socket {self.handoff_path}")
+        print(f"Connection: nc {self.host} {self.port}")
+        print("=" * 50)
+
     # --------------------------------------------------------------------------
     # CLIENT HANDLING
     # --------------------------------------------------------------------------
     
+    def wrap_socket(self, sock, address):
+        """Client connection with its outbound queue and writer thread"""
+        return SocketConnection(
+            sock,
+            address,
+            self.high_water,
+            self.slow_consumer_policy,
+            self.outbound_stats,
+            interrupt=self.interrupt[0] if self.interrupt else None
+        )
+    
     def handle_client(self, client_socket, client_address):
         """Handles a connected client"""
-        pseudo = None
+        client_socket = self.wrap_socket(client_socket, client_address)
+        accepted_at = time.perf_counter()
+        session = self.open_client(client_socket, client_address[0])
         
         try:
             # ------------------------------------------------------------------
             # AUTHENTICATION PROCESS
             # ------------------------------------------------------------------
             
-            # Send welcome message and check if password is required
-            authenticated = self.auth_handler.send_welcome_message(client_socket)
-            
-            # Authenticate if password is required
-            if not authenticated:
+            # Send welcome message, then the password prompt if one is required
+            if not self.auth_handler.send_welcome_message(client_socket):
                 authenticated = self.auth_handler.authenticate_client(client_socket)
-                if not authenticated:
+                if not self.password_checked(session, authenticated):
                     return
             
             # ------------------------------------------------------------------
             # USER REGISTRATION
             # ------------------------------------------------------------------
             
-            if authenticated:
-                # Get and validate username
-                pseudo = self.auth_handler.get_username(client_socket, client_address, self.client_manager)
-                
-                # Register the client
-                self.client_manager.add_client(client_socket, pseudo, client_address[0])
-                
-                # Announce user joined
-                join_msg = f"{pseudo} joined the chat!"
-                self.client_manager.broadcast_message(join_msg, exclude_client=client_socket)
-                
-                # Send connection info to client
-                self.auth_handler.send_connection_info(client_socket, pseudo, self.client_manager.get_client_count())
-                
-                # --------------------------------------------------------------
-                # MESSAGE HANDLING LOOP
-                # --------------------------------------------------------------
-                
-                # Handle messages until client disconnects
-                self.message_handler.handle_message_loop(
-                    client_socket, 
-                    pseudo, 
-                    self.client_manager, 
-                    lambda: self.running
-                )
+            pseudo = self.auth_handler.get_username(client_socket, client_address, self.client_manager)
+            if pseudo is None:
+                return
+            self.register_client(client_socket, pseudo, client_address[0], session, accepted_at)
+            
+            # ------------------------------------------------------------------
+            # MESSAGE HANDLING LOOP
+            # ------------------------------------------------------------------
+            
+            # Handle messages until client disconnects
+            self.message_handler.handle_message_loop(
+                client_socket, 
+                pseudo, 
+                self.client_manager, 
+                lambda: self.running,
+                self.security_manager
+            )
                         
         except Exception as e:
-            print(f"Error with client {client_address}: {e}")
+            log.error('client.error', "Error with client {address}: {error}", address=client_address, error=e)
         finally:
-            # ------------------------------------------------------------------
-            # CLEANUP ON DISCONNECTION
-            # ------------------------------------------------------------------
+            self.finish_client(client_socket, session)
+    
+    def handle_adopted_client(self, adopted):
+        """Serve a client taken over from the previous process, already past its handshake"""
+        client_socket = self.wrap_socket(adopted.sock, adopted.address)
+        session = self.adopt_client(client_socket, adopted)
+        try:
+            self.message_handler.handle_message_loop(
+                client_socket,
+                adopted.username,
+                self.client_manager,
+                lambda: self.running,
+                self.security_manager
+            )
+        except Exception as e:
+            log.error('client.error', "Error with client {address}: {error}", address=adopted.address, error=e)
+        finally:
+            self.finish_client(client_socket, session)
+    
+    # Steps shared by both server modes, which only differ in how they wait
+    # for client input
+    
+    def open_client(self, client_socket, ip):
+        """Start the admission session of a new connection at its first prompt"""
+        return self.admission.open(
+            client_socket,
+            ip,
+            PHASE_AUTH if self.auth_handler.password else PHASE_USERNAME
+        )
+    
+    def password_checked(self, session, authenticated):
+        """Move a session on to the username prompt, False if the password was wrong"""
+        if not authenticated:
+            AUTH_FAILURES.inc()
+            return False
+        self.admission.enter(session, PHASE_USERNAME)
+        return True
+    
+    def register_client(self, client_socket, pseudo, ip, session, accepted_at):
+        """Register a client past its handshake, announce it and send what it missed"""
+        self.client_manager.add_client(client_socket, pseudo, ip)
+        self.admission.enter(session, PHASE_CHAT)
+        HANDSHAKE_SECONDS.observe(time.perf_counter() - accepted_at)
+        
+        # Announce user joined
+        join_msg = f"{pseudo} joined the chat!"
+        self.client_manager.broadcast_message(join_msg, exclude_client=client_socket, room=DEFAULT_ROOM,
+                                              event=join_event(pseudo, DEFAULT_ROOM))
+        
+        # Send connection info to client
+        self.auth_handler.send_connection_info(client_socket, pseudo, self.client_manager.get_client_count())
+        self.message_handler.send_history(client_socket, DEFAULT_ROOM)
+        self.message_handler.send_inbox_notice(client_socket, pseudo, self.client_manager)
+    
+    def adopt_client(self, client_socket, adopted):
+        """Register a taken over client quietly, in the room it was in, with its unread input"""
+        if adopted.binary:
+            client_socket.use_binary()
+        client_socket.line_buffer.feed(adopted.pending_input)
+        self.admission.adopt(adopted.address[0])
+        session = self.admission.open(client_socket, adopted.address[0], PHASE_CHAT)
+        self.client_manager.add_client(client_socket, adopted.username, adopted.address[0], adopted.room)
+        return session
+    
+    def finish_client(self, client_socket, session):
+        """Remove a departing client, announce it and close its connection"""
+        # ------------------------------------------------------------------
+        # CLEANUP ON DISCONNECTION
+        # ------------------------------------------------------------------
+        
+        # A handed over connection lives on in the successor process
+        if client_socket.handed_off:
+            return
+        
+        # Remove client and announce departure
+        departed_room = self.client_manager.get_room(client_socket)
+        departed_pseudo = self.client_manager.remove_client(client_socket)
+        if departed_pseudo and self.running:
+            disconnect_msg = f"{departed_pseudo} left the chat"
+            self.client_manager.broadcast_message(disconnect_msg, room=departed_room,
+                                                  event=leave_event(departed_pseudo, departed_room))
             
-            # Remove client and announce departure
-            departed_pseudo = self.client_manager.remove_client(client_socket)
-            if departed_pseudo:
-                disconnect_msg = f"{departed_pseudo} left the chat"
-                self.client_manager.broadcast_message(disconnect_msg)
-                
+        self.admission.close(session)
+        client_socket.close()
+
+    # --------------------------------------------------------------------------
+    # DRAIN AND HOT RESTART
+    # --------------------------------------------------------------------------
+    
+    def install_signal_handlers(self):
+        """SIGTERM drains the clients before stopping, SIGHUP starts a hot restart"""
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.request_drain())
+        if self.handoff_path:
+            signal.signal(signal.SIGHUP, lambda signum, frame: spawn_successor())
+    
+    def request_drain(self):
+        """Stop the server, giving clients time to receive what is queued for them"""
+        self.draining = True
+        self.running = False
+    
+    def drain_clients(self):
+        """Stop accepting, tell every client about the restart and let their output flush"""
+        self.draining = False
+        self.close_listener()
+        self.call_on_loop(self.client_manager.deliver_frame, encode_frame(RESTART_NOTICE.rstrip("\n")))
+        with self.client_manager.lock:
+            connections = list(self.client_manager.clients)
+        flushed = self.wait_flushed(connections, self.drain_timeout)
+        log.info('server.drain', "Drained {flushed} of {count} clients", flushed=len(flushed), count=len(connections))
+        return connections
+    
+    def wait_flushed(self, connections, timeout):
+        """Wait until connections have no output pending, returns the set of flushed ones"""
+        deadline = time.monotonic() + timeout
+        pending = set(connections)
+        while True:
+            pending = {connection for connection in pending if connection.pending_output()}
+            if not pending or time.monotonic() >= deadline:
+                break
+            time.sleep(0.01)
+        return set(connections) - pending
+    
+    def close_listener(self):
+        if self.server_socket:
             try:
-                client_socket.close()
-            except:
+                self.call_on_loop(self.server_socket.close)
+            except socket.error:
                 pass
+    
+    def call_on_loop(self, callback, *args):
+        """Run a callback where client connections may be used and return its result"""
+        return callback(*args)
+    
+    def take_over(self):
+        """Listener and clients of the server at handoff_path when taking over, else (None, [])"""
+        if not (self.takeover and self.handoff_path):
+            return None, []
+        received = take_over(self.handoff_path)
+        if received is None:
+            log.warning('handoff.none', "No server to take over at {path}, starting fresh", path=self.handoff_path)
+            return None, []
+        listener, clients, history = received
+        if self.history and not self.history.used_bytes:
+            for room, frame in history:
+                self.history.append(room, frame)
+        log.info('handoff.received', "Took over {count} clients from the previous process", count=len(clients))
+        return listener, clients
+    
+    def start_handoff_listener(self):
+        """Wait for a successor at handoff_path and tell systemd this process is the server"""
+        if self.handoff_path:
+            self.handoff_listener = HandoffListener(self.handoff_path, self)
+        sd_notify("READY=1")
+    
+    def prepare_handoff(self):
+        """Stop accepting and reading, flush client output, returns what a successor takes over"""
+        self.handing_off = True
+        listener = self.handoff_listener_socket()
+        
+        # Clients still logging in are asked to come back
+        for connection, session in list(self.admission.sessions.items()):
+            if session.phase != PHASE_CHAT:
+                self.call_on_loop(connection.disconnect, RESTART_NOTICE)
+        
+        with self.client_manager.lock:
+            registered = list(self.client_manager.clients.items())
+        frozen = self.freeze_clients([connection for connection, _ in registered])
+        flushed = self.wait_flushed(list(frozen), HANDOFF_FLUSH_TIMEOUT)
+        
+        clients = []
+        for connection, client_info in registered:
+            session = self.admission.sessions.get(connection)
+            if session is not None:
+                self.admission.close(session)
+            if connection in flushed:
+                clients.append((connection.fileno(), client_info.pseudo, connection.address,
+                                client_info.room, frozen[connection], connection.binary))
+            else:
+                # Output stuck in a write cannot follow the socket, the client reconnects
+                self.client_manager.remove_client(connection)
+                self.call_on_loop(connection.disconnect, RESTART_NOTICE)
+        # Deferred stages of the last messages still have to reach the chat log
+        self.message_handler.close()
+        history = self.history.frames() if self.history else []
+        return listener, clients, history
+    
+    def handoff_listener_socket(self):
+        """Listening socket for the successor, once this process stopped accepting"""
+        self.accept_stopped.wait()
+        return self.server_socket
+    
+    def freeze_clients(self, connections):
+        """Stop the client readers, returns {connection: input not processed yet}"""
+        for connection in connections:
+            connection.handed_off = True
+        os.write(self.interrupt[1], b"\0")
+        deadline = time.monotonic() + HANDOFF_PARK_TIMEOUT
+        frozen = {}
+        for connection in connections:
+            if connection.parked.wait(max(0.0, deadline - time.monotonic())):
+                frozen[connection] = connection.line_buffer.pending_bytes()
+        return frozen
+    
+    def complete_handoff(self, count):
+        log.info('handoff.done', "Handed {count} clients over to the successor", count=count)
+        self.running = False
+        self.handoff_complete.set()
 
     # --------------------------------------------------------------------------
     # SERVER SHUTDOWN
@@ -177,9 +549,31 @@ class ChatServer:
     def stop(self):
         """Stops the server"""
         self.running = False
+        if self.draining:
+            # The drain timeout was their time to flush, closing each one
+            # with its own flush deadline could outlast the service manager
+            for client_socket in self.drain_clients():
+                client_socket.abort()
         if self.server_socket:
             try:
                 self.server_socket.close()
             except:
                 pass
+        if self.handoff_listener and not self.handing_off:
+            self.handoff_listener.close()
+            try:
+                os.unlink(self.handoff_path)
+            except OSError:
+                pass
+        self.message_handler.close()
+        if self.chat_log:
+            self.chat_log.close()
+        if self.bus:
+            self.bus.close()
+        if self.federation:
+            self.federation.stop()
+        log.flush()
+        if self.federation:
+            print(self.federation.summary())
+        print(self.outbound_stats.summary())
         print("Server stopped")
\ No newline at end of file
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Server log for Schrimp Chat Server
+Client and server threads only append a record to a queue; a background
+thread formats the records and writes them in batches, as text or JSON
+lines, so a slow stdout or journald never stalls a chat thread
+"""
+
+import atexit
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+
+# Levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {value: name.upper() for name, value in LEVELS.items()}
+
+FLUSH_INTERVAL = 0.05      # seconds between two batches written by the writer thread
+MAX_PENDING = 100000       # records queued before new ones are dropped
+
+
+# ==============================================================================
+# SERVER LOG
+# ==============================================================================
+
+class ServerLog:
+    """Leveled logger with a queue and a batching writer thread"""
+
+    def __init__(self, level=INFO, json_output=False, log_content=True, stream=None):
+        self.level = level
+        self.json_output = json_output
+        self.log_content = log_content    # chat lines are only logged when this is set
+        self.stream = stream
+        self.pending = deque()            # (timestamp, level, event, template, fields)
+        self.dropped = 0
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def configure(self, level=None, json_output=None, log_content=None):
+        """Change the settings, None keeps the current value"""
+        if level is not None:
+            self.level = LEVELS[level] if isinstance(level, str) else level
+        if json_output is not None:
+            self.json_output = json_output
+        if log_content is not None:
+            self.log_content = log_content
+
+    # --------------------------------------------------------------------------
+    # LOGGING
+    # --------------------------------------------------------------------------
+
+    def debug(self, event, template, **fields):
+        if self.level <= DEBUG:
+            self._enqueue(DEBUG, event, template, fields)
+
+    def info(self, event, template, **fields):
+        if self.level <= INFO:
+            self._enqueue(INFO, event, template, fields)
+
+    def warning(self, event, template, **fields):
+        if self.level <= WARNING:
+            self._enqueue(WARNING, event, template, fields)
+
+    def error(self, event, template, **fields):
+        if self.level <= ERROR:
+            self._enqueue(ERROR, event, template, fields)
+
+    def chat(self, room, user, text):
+        """Log a chat line, unless message content logging is turned off"""
+        if self.log_content and self.level <= INFO:
+            self._enqueue(INFO, 'chat', "#{room} {user}: {text}", {'room': room, 'user': user, 'text': text})
+
+    def _enqueue(self, level, event, template, fields):
+        """Queue a record, formatting is left to the writer thread"""
+        if len(self.pending) >= MAX_PENDING:
+            self.dropped += 1
+            return
+        self.pending.append((time.time(), level, event, template, fields))
+        if self._writer is None:
+            self._start()
+
+    # --------------------------------------------------------------------------
+    # WRITER
+    # --------------------------------------------------------------------------
+
+    def _start(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                self._writer.start()
+
+    def flush(self):
+        """Write every queued record now, from the calling thread"""
+        self._write_batch()
+
+    def _write_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self._write_batch()
+
+    def _write_batch(self):
+        """Format and write everything queued so far in one write"""
+        with self._lock:
+            count = len(self.pending)
+            if not count and not self.dropped:
+                return
+            lines = [self._format(*self.pending.popleft()) for _ in range(count)]
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(self._format(time.time(), WARNING, 'log.dropped',
+                                          "{count} log records dropped, writer fell behind", {'count': dropped}))
+            stream = self.stream or sys.stdout
+            try:
+                stream.write("".join(lines))
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    def _format(self, timestamp, level, event, template, fields):
+        """Render one record as a text or JSON line"""
+        try:
+            message = template.format(**fields)
+        except (KeyError, IndexError, ValueError):
+            message = template
+        if self.json_output:
+            record = {'ts': round(timestamp, 3), 'level': LEVEL_NAMES[level].lower(), 'event': event, 'msg': message}
+            for key, value in fields.items():
+                record.setdefault(key, value if isinstance(value, (int, float, bool, type(None))) else str(value))
+            return json.dumps(record, ensure_ascii=False) + "\n"
+        clock = time.strftime('%H:%M:%S', time.localtime(timestamp))
+        return f"{clock} {LEVEL_NAMES[level]:<7} {message}\n"
+
+
+# Process-wide log used by every component
+log = ServerLog()
+atexit.register(log.flush)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Tests of the timer wheel driving the handshake and idle deadlines
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from admission import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = TimerWheel(resolution=1.0, slots=8)
+        self.start = self.wheel.time
+
+    def test_nothing_due_before_the_deadline(self):
+        self.wheel.schedule('a', self.start + 2.5)
+        self.assertEqual(self.wheel.advance(self.start + 2.0), [])
+        self.assertEqual(self.wheel.advance(self.start + 3.0), ['a'])
+
+    def test_items_returned_once(self):
+        self.wheel.schedule('a', self.start + 1.0)
+        self.assertEqual(self.wheel.advance(self.start + 5.0), ['a'])
+        self.assertEqual(self.wheel.advance(self.start + 20.0), [])
+
+    def test_deadlines_in_order_of_slots(self):
+        for item, delay in (('c', 3.5), ('a', 0.5), ('b', 1.5)):
+            self.wheel.schedule(item, self.start + delay)
+        self.assertEqual(self.wheel.advance(self.start + 4.0), ['a', 'b', 'c'])
+
+    def test_past_deadline_due_on_next_tick(self):
+        self.wheel.schedule('late', self.start - 10.0)
+        self.assertEqual(self.wheel.advance(self.start + 1.0), ['late'])
+
+    def test_far_deadline_capped_at_one_turn(self):
+        # The owner checks the real deadline and schedules the item again
+        self.wheel.schedule('far', self.start + 100.0)
+        self.assertEqual(self.wheel.advance(self.start + 6.0), [])
+        self.assertEqual(self.wheel.advance(self.start + 7.0), ['far'])
+
+    def test_advance_between_ticks_keeps_position(self):
+        self.wheel.schedule('a', self.start + 1.5)
+        self.assertEqual(self.wheel.advance(self.start + 0.9), [])
+        self.assertEqual(self.wheel.advance(self.start + 1.9), [])
+        self.assertEqual(self.wheel.advance(self.start + 2.0), ['a'])
+
+
+if __name__ == "__main__":
+    unittest.main()
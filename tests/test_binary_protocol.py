@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Tests of the msgpack subset and the frame buffer of binary_protocol
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import binary_protocol
+from binary_protocol import (FrameBuffer, FRAME_HEADER, MAX_FRAME_LENGTH, EVENT_LINE, chat_event,
+                             encode_event, packb, unpackb)
+from line_reader import LineBuffer
+
+
+VALUES = [
+    None, True, False,
+    0, 1, 127, 128, 255, 256, 65535, 65536, 2 ** 32 - 1, 2 ** 32, 2 ** 64 - 1,
+    -1, -32, -33, -128, -129, -32768, -32769, -2 ** 31, -2 ** 31 - 1, -2 ** 63,
+    0.0, 1.5, -2.25, 1e300,
+    "", "a", "x" * 31, "x" * 32, "x" * 255, "x" * 256, "x" * 65536, "héllo ✓",
+    b"", b"\x00\xff", b"y" * 256, b"y" * 65536,
+    [], [1, "two", None], list(range(16)), list(range(65536)),
+    {}, {"t": "msg", "user": "alice"}, {str(i): i for i in range(16)}, {1: "int key"},
+    {"nested": [{"a": [1, 2, {"b": None}]}]},
+]
+
+
+class SubsetCodecTest(unittest.TestCase):
+    """The built-in subset, whether or not msgpack is installed"""
+
+    def setUp(self):
+        self.installed = binary_protocol.msgpack
+        binary_protocol.msgpack = None
+
+    def tearDown(self):
+        binary_protocol.msgpack = self.installed
+
+    def test_round_trip(self):
+        for value in VALUES:
+            with self.subTest(value=repr(value)[:40]):
+                self.assertEqual(unpackb(packb(value)), value)
+
+    def test_tuple_packs_as_array(self):
+        self.assertEqual(unpackb(packb((1, 2))), [1, 2])
+
+    def test_smallest_encodings(self):
+        self.assertEqual(packb(5), b"\x05")
+        self.assertEqual(packb(-1), b"\xff")
+        self.assertEqual(packb("ab"), b"\xa2ab")
+        self.assertEqual(packb([]), b"\x90")
+        self.assertEqual(packb({}), b"\x80")
+        self.assertEqual(packb(200), b"\xcc\xc8")
+
+    def test_out_of_range_integer(self):
+        with self.assertRaises(ValueError):
+            packb(2 ** 64)
+        with self.assertRaises(ValueError):
+            packb(-2 ** 63 - 1)
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            packb(object())
+
+    def test_malformed_input(self):
+        for data in (b"", b"\xa5ab", b"\xcd\x01", b"\x92\x01", b"\xc1", b"\x01\x02", b"\x81\x90\x01"):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    unpackb(data)
+
+    def test_invalid_utf8(self):
+        with self.assertRaises(ValueError):
+            unpackb(b"\xa2\xff\xfe")
+
+    @unittest.skipIf(binary_protocol.msgpack is None, "msgpack is not installed")
+    def test_compatible_with_msgpack(self):
+        msgpack = self.installed
+        for value in VALUES:
+            with self.subTest(value=repr(value)[:40]):
+                self.assertEqual(msgpack.unpackb(packb(value), raw=False, strict_map_key=False), value)
+                self.assertEqual(unpackb(msgpack.packb(value, use_bin_type=True)), value)
+
+
+class FrameBufferTest(unittest.TestCase):
+
+    def test_frames_split_anywhere(self):
+        payload = packb([{'t': EVENT_LINE, 'text': 'one'}, {'t': EVENT_LINE, 'text': 'two'}])
+        data = FRAME_HEADER.pack(len(payload)) + payload
+        data += encode_event({'t': 'msg', 'text': 'hi'})
+        for split in range(len(data) + 1):
+            with self.subTest(split=split):
+                frame_buffer = FrameBuffer()
+                frame_buffer.feed(data[:split])
+                frame_buffer.feed(data[split:])
+                self.assertEqual(frame_buffer.pop_all(), ['one', 'two', 'hi'])
+
+    def test_oversized_frame(self):
+        frame_buffer = FrameBuffer()
+        with self.assertRaises(ConnectionResetError):
+            frame_buffer.feed(FRAME_HEADER.pack(MAX_FRAME_LENGTH + 1))
+
+    def test_malformed_frame(self):
+        frame_buffer = FrameBuffer()
+        with self.assertRaises(ConnectionResetError):
+            frame_buffer.feed(FRAME_HEADER.pack(1) + b"\xc1")
+
+    def test_pending_bytes_round_trip(self):
+        frame = encode_event({'t': EVENT_LINE, 'text': 'later'})
+        frame_buffer = FrameBuffer()
+        frame_buffer.feed(encode_event({'t': EVENT_LINE, 'text': 'queued'}) + frame[:3])
+        successor = FrameBuffer()
+        successor.feed(frame_buffer.pending_bytes() + frame[3:])
+        self.assertEqual(successor.pop_all(), ['queued', 'later'])
+
+    def test_after_line_buffer_keeps_frames_split_as_lines(self):
+        # Frame bytes hold newlines and are not UTF-8, the line buffer splits them
+        frame = encode_event({'t': EVENT_LINE, 'text': 'one\ntwo'})
+        line_buffer = LineBuffer()
+        line_buffer.feed(b"/binary\n" + frame + frame[:5])
+        self.assertEqual(line_buffer.pop_line(), '/binary')
+        frame_buffer = FrameBuffer.after(line_buffer)
+        frame_buffer.feed(frame[5:])
+        self.assertEqual(frame_buffer.pop_all(), ['one two', 'one two'])
+
+    def test_chat_event_fields(self):
+        event = unpackb(encode_event(chat_event('alice', 'general', 'hello'))[FRAME_HEADER.size:])
+        self.assertEqual((event['t'], event['user'], event['room'], event['text']),
+                         ('msg', 'alice', 'general', 'hello'))
+
+
+if __name__ == "__main__":
+    unittest.main()
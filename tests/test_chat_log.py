@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests of the chat log records and of the recovery of a torn tail
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from chat_log import ChatLog, INDEX_ENTRY, encode_record, scan_records
+
+
+def frame(number):
+    return f"[12:00:00] alice: message {number}\n".encode('utf-8')
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_scan_round_trip(self):
+        data = encode_record(1.5, 'general', frame(1)) + encode_record(2.5, 'x', frame(2))
+        records = [(timestamp, room, body) for _, _, timestamp, room, body in scan_records(data)]
+        self.assertEqual(records, [(1.5, 'general', frame(1)), (2.5, 'x', frame(2))])
+
+    def test_scan_stops_at_damage(self):
+        first = encode_record(1.0, 'general', frame(1))
+        damaged = bytearray(encode_record(2.0, 'general', frame(2)))
+        damaged[-1] ^= 0xff
+        self.assertEqual(len(list(scan_records(first + bytes(damaged) + first))), 1)
+
+    def test_scan_stops_at_truncation(self):
+        data = encode_record(1.0, 'general', frame(1)) + encode_record(2.0, 'general', frame(2))[:-3]
+        self.assertEqual(len(list(scan_records(data))), 1)
+
+
+class RecoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='schrimp-log-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, count, **options):
+        chat_log = ChatLog(self.directory, sync=False, **options)
+        for number in range(count):
+            chat_log.append('general', frame(number), timestamp=1000.0 + number)
+        chat_log.close()
+
+    def segment(self, extension='log'):
+        return os.path.join(self.directory, f"{1:010d}.{extension}")
+
+    def frames(self, **options):
+        chat_log = ChatLog(self.directory, sync=False, **options)
+        try:
+            return [body for _, _, body in chat_log.read_tail(1 << 30)]
+        finally:
+            chat_log.close()
+
+    def test_reopen_keeps_every_record(self):
+        self.write(50)
+        self.assertEqual(self.frames(), [frame(number) for number in range(50)])
+
+    def test_torn_tail_is_truncated(self):
+        self.write(10)
+        intact = os.path.getsize(self.segment())
+        with open(self.segment(), 'ab') as log_file:
+            log_file.write(encode_record(2000.0, 'general', frame(10))[:-5])
+
+        self.assertEqual(self.frames(), [frame(number) for number in range(10)])
+        self.assertEqual(os.path.getsize(self.segment()), intact)
+
+    def test_garbage_tail_is_truncated(self):
+        self.write(10)
+        intact = os.path.getsize(self.segment())
+        with open(self.segment(), 'ab') as log_file:
+            log_file.write(os.urandom(100))
+
+        self.assertEqual(len(self.frames()), 10)
+        self.assertEqual(os.path.getsize(self.segment()), intact)
+
+    def test_damage_past_the_last_index_entry(self):
+        # A small index interval puts several entries in the segment
+        self.write(200, index_interval=512)
+        size = os.path.getsize(self.segment())
+        with open(self.segment(), 'r+b') as log_file:
+            log_file.seek(size - 10)
+            log_file.write(b"\x00" * 10)
+
+        frames = self.frames(index_interval=512)
+        self.assertEqual(frames, [frame(number) for number in range(199)])
+        self.assertLess(os.path.getsize(self.segment()), size)
+
+    def test_index_pointing_past_the_end_is_dropped(self):
+        self.write(200, index_interval=512)
+        with open(self.segment(), 'r+b') as log_file:
+            log_file.truncate(os.path.getsize(self.segment()) // 2)
+
+        frames = self.frames(index_interval=512)
+        self.assertEqual(frames, [frame(number) for number in range(len(frames))])
+        with open(self.segment('idx'), 'rb') as index_file:
+            index = list(INDEX_ENTRY.iter_unpack(index_file.read()))
+        self.assertTrue(all(offset < os.path.getsize(self.segment()) for _, offset in index))
+
+    def test_appends_after_recovery_follow_the_intact_records(self):
+        self.write(10)
+        with open(self.segment(), 'ab') as log_file:
+            log_file.write(b"torn")
+        chat_log = ChatLog(self.directory, sync=False)
+        chat_log.append('general', frame(10), timestamp=2000.0)
+        chat_log.close()
+        self.assertEqual(self.frames(), [frame(number) for number in range(11)])
+
+
+if __name__ == "__main__":
+    unittest.main()
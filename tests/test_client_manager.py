@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests of the sorted roster behind /users paging and prefix search
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from client_manager import ClientManager, USERS_PAGE_SIZE
+from server_log import log
+
+
+class NullConnection:
+    """Connection stub recording what is sent to it"""
+
+    binary = False
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data, encoded=False):
+        self.sent.append(data)
+        return len(data)
+
+
+def listed(listing):
+    """Usernames of an encoded /users listing, in order"""
+    return [line.split()[1] for line in listing.decode('utf-8').splitlines() if line.startswith('  • ')]
+
+
+class RosterTest(unittest.TestCase):
+
+    def setUp(self):
+        log.configure(level='error')
+        self.client_manager = ClientManager()
+        self.connections = {}
+
+    def connect(self, *names):
+        for name in names:
+            connection = NullConnection()
+            self.connections[name] = connection
+            self.client_manager.add_client(connection, name, '127.0.0.1')
+
+    def test_roster_sorted_with_remote_users(self):
+        self.connect('carol', 'alice')
+        self.client_manager.add_remote('bob', '10.0.0.2', 'general')
+        self.assertEqual(self.client_manager.roster, ['alice', 'bob', 'carol'])
+
+    def test_departures_leave_the_roster(self):
+        self.connect('alice', 'bob')
+        self.client_manager.add_remote('carol', '10.0.0.2', 'general')
+        self.client_manager.remove_client(self.connections['alice'])
+        self.client_manager.remove_remote('carol')
+        self.assertEqual(self.client_manager.roster, ['bob'])
+
+    def test_pages(self):
+        names = [f"user{number:03d}" for number in range(USERS_PAGE_SIZE * 2 + 5)]
+        self.connect(*reversed(names))
+        pages = [listed(self.client_manager.get_users_page(page)) for page in (1, 2, 3)]
+        self.assertEqual(pages, [names[:USERS_PAGE_SIZE], names[USERS_PAGE_SIZE:USERS_PAGE_SIZE * 2],
+                                 names[USERS_PAGE_SIZE * 2:]])
+
+    def test_page_out_of_range_clamped(self):
+        self.connect('alice', 'bob')
+        self.assertIn(b"page 1/1", self.client_manager.get_users_page(0))
+        self.assertIn(b"page 1/1", self.client_manager.get_users_page(99))
+
+    def test_cached_page_follows_changes(self):
+        self.connect('alice')
+        self.assertEqual(listed(self.client_manager.get_users_page(1)), ['alice'])
+        self.connect('bob')
+        self.assertEqual(listed(self.client_manager.get_users_page(1)), ['alice', 'bob'])
+
+    def test_prefix_search(self):
+        self.connect('alice', 'albert', 'bob', 'al')
+        self.assertEqual(listed(self.client_manager.find_users('al')), ['al', 'albert', 'alice'])
+        self.assertEqual(listed(self.client_manager.find_users('b')), ['bob'])
+        self.assertIn(b"No user matches", self.client_manager.find_users('z'))
+
+    def test_prefix_search_capped(self):
+        self.connect(*(f"user{number:03d}" for number in range(USERS_PAGE_SIZE + 1)))
+        listing = self.client_manager.find_users('user')
+        self.assertEqual(len(listed(listing)), USERS_PAGE_SIZE)
+        self.assertIn(f"(first {USERS_PAGE_SIZE})".encode('utf-8'), listing)
+
+
+if __name__ == "__main__":
+    unittest.main()
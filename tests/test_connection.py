@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Tests of the bounded outbound queue and its slow-consumer policies
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from connection import OutboundQueue, OutboundStats, POLICY_DROP_OLDEST, POLICY_DISCONNECT
+
+
+class OutboundQueueTest(unittest.TestCase):
+
+    def test_fifo_under_high_water(self):
+        queue = OutboundQueue(high_water=100)
+        for data in (b"a", b"bb", b"ccc"):
+            self.assertTrue(queue.push(data))
+        self.assertEqual(queue.pending_bytes, 6)
+        self.assertEqual(queue.pop_all(), [b"a", b"bb", b"ccc"])
+        self.assertEqual((len(queue), queue.pending_bytes), (0, 0))
+
+    def test_drop_oldest_keeps_the_newest(self):
+        stats = OutboundStats()
+        queue = OutboundQueue(high_water=10, policy=POLICY_DROP_OLDEST, stats=stats)
+        for data in (b"1111", b"2222", b"3333", b"4444"):
+            self.assertTrue(queue.push(data))
+        self.assertEqual(queue.pop_all(), [b"3333", b"4444"])
+        self.assertEqual(stats.dropped_oldest, 2)
+
+    def test_drop_oldest_stays_under_high_water(self):
+        queue = OutboundQueue(high_water=10, policy=POLICY_DROP_OLDEST)
+        for number in range(100):
+            queue.push(bytes(number % 7 + 1))
+            self.assertLessEqual(queue.pending_bytes, 10)
+            self.assertEqual(queue.pending_bytes, sum(len(frame) for frame in queue.frames))
+
+    def test_frame_larger_than_high_water_still_queued(self):
+        queue = OutboundQueue(high_water=10, policy=POLICY_DROP_OLDEST)
+        queue.push(b"small")
+        self.assertTrue(queue.push(b"x" * 50))
+        self.assertEqual(queue.pop_all(), [b"x" * 50])
+
+    def test_disconnect_evicts_and_clears(self):
+        stats = OutboundStats()
+        queue = OutboundQueue(high_water=10, policy=POLICY_DISCONNECT, stats=stats)
+        self.assertTrue(queue.push(b"1111"))
+        self.assertTrue(queue.push(b"2222"))
+        self.assertFalse(queue.push(b"3333"))
+        self.assertEqual((len(queue), queue.pending_bytes), (0, 0))
+        self.assertEqual((stats.evicted_clients, stats.dropped_disconnect), (1, 3))
+
+    def test_first_frame_never_evicts(self):
+        queue = OutboundQueue(high_water=10, policy=POLICY_DISCONNECT)
+        self.assertTrue(queue.push(b"x" * 50))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            OutboundQueue(policy='ignore')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests of the banned-word matcher and the hot reload of the word file
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from secure import ContentFilter, build_matcher, MAX_WORD_LENGTH, _mask
+
+
+def mask(words, message):
+    return build_matcher(words).sub(_mask, message)
+
+
+class WordMatcherTest(unittest.TestCase):
+
+    def test_no_words(self):
+        self.assertIsNone(build_matcher(['', '  ', 'x' * (MAX_WORD_LENGTH + 1)]))
+
+    def test_case_insensitive_and_case_kept(self):
+        self.assertEqual(mask(['Spam'], "SPAM spam SpAm ham"), "**** **** **** ham")
+
+    def test_longest_word_wins(self):
+        self.assertEqual(mask(['ha', 'hack', 'hacker'], "hackers hacks hat"), "******s ****s **t")
+
+    def test_shared_prefixes(self):
+        self.assertEqual(mask(['car', 'cat', 'cow'], "cart cat cow cab"), "***t *** *** cab")
+
+    def test_special_characters_are_literal(self):
+        self.assertEqual(mask(['a.b', '(x)'], "a.b axb (x)"), "*** axb ***")
+
+    def test_lowercasing_that_changes_length(self):
+        # 'İ' lowercases to two characters, the spans of the lowered text would be off by one
+        self.assertEqual(mask(['spam'], "İ SPAM"), "İ ****")
+        self.assertEqual(mask(['spam'], "İ ok"), "İ ok")
+
+    def test_no_match_returns_the_message(self):
+        message = "nothing here"
+        self.assertIs(build_matcher(['spam']).sub(_mask, message), message)
+
+
+class ContentFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.txt')
+        os.close(handle)
+        self.write("# comment\nfoo\n\nbar\n")
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def write(self, text, mtime_ns=None):
+        with open(self.path, 'w', encoding='utf-8') as word_file:
+            word_file.write(text)
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    def test_word_file_replaces_the_defaults(self):
+        content_filter = ContentFilter(word_file=self.path)
+        self.assertEqual(content_filter.banned_words, ['foo', 'bar'])
+        self.assertEqual(content_filter.filter_message("foo bar spam"), "*** *** spam")
+
+    def test_set_banned_words(self):
+        content_filter = ContentFilter()
+        content_filter.set_banned_words(['ham'])
+        self.assertEqual(content_filter.filter_message("spam and ham"), "spam and ***")
+        content_filter.set_banned_words([])
+        self.assertEqual(content_filter.filter_message("spam and ham"), "spam and ham")
+
+    def test_truncated_before_masking(self):
+        content_filter = ContentFilter(max_length=6)
+        self.assertEqual(content_filter.filter_message("a spam message"), "a ****... [truncated]")
+
+    def test_reload_when_the_file_changes(self):
+        content_filter = ContentFilter(word_file=self.path)
+        sleeps = []
+
+        def sleep(interval):
+            # The file changes during the first wait, the second one ends the loop
+            sleeps.append(interval)
+            if len(sleeps) > 1:
+                raise StopIteration
+            self.write("baz\n", mtime_ns=time.time_ns() + 10 ** 9)
+
+        with mock.patch('secure.time.sleep', sleep), self.assertRaises(StopIteration):
+            content_filter._watch_loop(5.0)
+        self.assertEqual(content_filter.banned_words, ['baz'])
+        self.assertEqual(content_filter.filter_message("foo baz"), "foo ***")
+
+    def test_failed_reload_keeps_the_words(self):
+        content_filter = ContentFilter(word_file=self.path)
+        with self.assertRaises(OSError):
+            content_filter.load_words(self.path + '.missing')
+        self.assertEqual(content_filter.filter_message("foo"), "***")
+
+
+if __name__ == "__main__":
+    unittest.main()
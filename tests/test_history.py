@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests of the byte-bounded message history and the private inboxes
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from history import MessageHistory, DirectInbox, ENTRY_OVERHEAD
+
+
+def frame(number, size=10):
+    return f"{number:0{size}d}".encode('utf-8')
+
+
+class MessageHistoryTest(unittest.TestCase):
+
+    def test_recent_is_oldest_first_and_capped(self):
+        history = MessageHistory(replay_count=3)
+        for number in range(5):
+            history.append('general', frame(number))
+        self.assertEqual(history.recent('general'), [frame(2), frame(3), frame(4)])
+        self.assertEqual(history.recent('general', 10), [frame(number) for number in range(5)])
+        self.assertEqual(history.recent('general', 0), [])
+        self.assertEqual(history.recent('other'), [])
+
+    def test_budget_evicts_the_oldest_frames(self):
+        cost = len(frame(0)) + ENTRY_OVERHEAD
+        history = MessageHistory(max_bytes=cost * 3)
+        for number in range(5):
+            history.append('general', frame(number))
+        self.assertEqual(history.recent('general'), [frame(2), frame(3), frame(4)])
+        self.assertEqual(history.used_bytes, cost * 3)
+
+    def test_budget_is_shared_by_every_room(self):
+        cost = len(frame(0)) + ENTRY_OVERHEAD
+        history = MessageHistory(max_bytes=cost * 3)
+        history.append('a', frame(1))
+        history.append('b', frame(2))
+        history.append('b', frame(3))
+        history.append('b', frame(4))
+        # The globally oldest frame went, and its room with it
+        self.assertEqual(history.recent('a'), [])
+        self.assertNotIn('a', history.rooms)
+        self.assertEqual(history.frames(), [('b', frame(2)), ('b', frame(3)), ('b', frame(4))])
+
+    def test_frame_larger_than_the_budget_is_not_kept(self):
+        history = MessageHistory(max_bytes=ENTRY_OVERHEAD + 5)
+        history.append('general', frame(1, size=4))
+        history.append('general', frame(2, size=6))
+        self.assertEqual(history.recent('general'), [frame(1, size=4)])
+
+    def test_zero_budget_keeps_nothing(self):
+        history = MessageHistory(max_bytes=0)
+        history.append('general', frame(1))
+        self.assertEqual((history.frames(), history.used_bytes), ([], 0))
+
+
+class DirectInboxTest(unittest.TestCase):
+
+    def test_capacity_keeps_the_newest(self):
+        inbox = DirectInbox(capacity=2)
+        for number in range(3):
+            inbox.append('alice', '10.0.0.1', frame(number))
+        self.assertEqual(inbox.recent('alice', '10.0.0.1'), [frame(1), frame(2)])
+
+    def test_keyed_by_name_and_address(self):
+        inbox = DirectInbox()
+        inbox.append('alice', '10.0.0.1', frame(1))
+        self.assertEqual(inbox.recent('alice', '10.0.0.2'), [])
+        self.assertEqual(inbox.recent('bob', '10.0.0.1'), [])
+
+    def test_least_recently_written_inbox_evicted(self):
+        inbox = DirectInbox(max_inboxes=2)
+        inbox.append('alice', 'ip', frame(1))
+        inbox.append('bob', 'ip', frame(2))
+        inbox.append('alice', 'ip', frame(3))
+        inbox.append('carol', 'ip', frame(4))
+        self.assertEqual(list(inbox.inboxes), [('alice', 'ip'), ('carol', 'ip')])
+        self.assertEqual(inbox.recent('bob', 'ip'), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests of the line framing of client input
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from line_reader import LineBuffer
+
+
+class LineBufferTest(unittest.TestCase):
+
+    def test_lines_split_anywhere(self):
+        data = "héllo\nsecond ✓ line\n\nlast\n".encode('utf-8')
+        for split in range(len(data) + 1):
+            with self.subTest(split=split):
+                line_buffer = LineBuffer()
+                line_buffer.feed(data[:split])
+                line_buffer.feed(data[split:])
+                self.assertEqual(line_buffer.pop_all(), ["héllo", "second ✓ line", "", "last"])
+
+    def test_multibyte_character_one_byte_at_a_time(self):
+        line_buffer = LineBuffer()
+        for byte in "日本\n".encode('utf-8'):
+            line_buffer.feed(bytes([byte]))
+        self.assertEqual(line_buffer.pop_all(), ["日本"])
+
+    def test_partial_line_kept_until_newline(self):
+        line_buffer = LineBuffer()
+        line_buffer.feed(b"hal")
+        self.assertFalse(line_buffer)
+        self.assertIsNone(line_buffer.pop_line())
+        line_buffer.feed(b"f\n")
+        self.assertEqual(line_buffer.pop_line(), "half")
+
+    def test_long_line_capped(self):
+        line_buffer = LineBuffer(max_line_length=8)
+        line_buffer.feed(b"0123456789abcdef\nnext\n")
+        self.assertEqual(line_buffer.pop_all(), ["01234567", "next"])
+
+    def test_unterminated_long_line_discarded_up_to_newline(self):
+        line_buffer = LineBuffer(max_line_length=8)
+        line_buffer.feed(b"0123456789")
+        line_buffer.feed(b"more of the same line")
+        line_buffer.feed(b" still\nnext\n")
+        self.assertEqual(line_buffer.pop_all(), ["01234567", "next"])
+        self.assertLessEqual(len(line_buffer.buffer), 8)
+
+    def test_cap_inside_a_character(self):
+        line_buffer = LineBuffer(max_line_length=4)
+        line_buffer.feed("abc✓\n".encode('utf-8'))
+        self.assertEqual(line_buffer.pop_all(), ["abc�"])
+
+    def test_finish_queues_the_remainder(self):
+        line_buffer = LineBuffer()
+        line_buffer.feed(b"done\nno newline")
+        line_buffer.finish()
+        self.assertEqual(line_buffer.pop_all(), ["done", "no newline"])
+        self.assertEqual(line_buffer.buffer, bytearray())
+
+    def test_pending_bytes_round_trip(self):
+        line_buffer = LineBuffer()
+        line_buffer.feed("first ✓\nsecond\npart".encode('utf-8'))
+        line_buffer.pop_line()
+        successor = LineBuffer()
+        successor.feed(line_buffer.pending_bytes() + b"ial\n")
+        self.assertEqual(successor.pop_all(), ["second", "partial"])
+
+    def test_pending_bytes_exact_while_popping_one_line_at_a_time(self):
+        line_buffer = LineBuffer()
+        line_buffer.feed(b"/binary\n\xa4\xff\nrest")
+        line_buffer.pop_line()
+        self.assertEqual(line_buffer.pending_bytes(), b"\xa4\xff\nrest")
+        line_buffer.pop_all()
+        self.assertIsNone(line_buffer.raw)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests of the message pipeline, its deferred stages and the command registry
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pipeline import Pipeline, MessageContext
+from message_handler import MessageHandler
+from server_log import log
+
+
+def context(message='hello', room='general'):
+    chat_context = MessageContext(message, 'alice', None, None)
+    chat_context.room = room
+    return chat_context
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        log.configure(level='error')
+        self.calls = []
+
+    def stage(self, name, action=None):
+        def function(chat_context):
+            self.calls.append((name, chat_context.message))
+            return action
+        return function
+
+    def test_stages_run_in_order(self):
+        pipeline = Pipeline()
+        for name in ('one', 'two', 'three'):
+            pipeline.add_stage(name, self.stage(name))
+        self.assertEqual(pipeline.run(context()), 'continue')
+        self.assertEqual([name for name, _ in self.calls], ['one', 'two', 'three'])
+
+    def test_action_stops_the_pipeline_and_skips_deferred(self):
+        pipeline = Pipeline()
+        pipeline.add_stage('one', self.stage('one'))
+        pipeline.add_stage('two', self.stage('two', 'disconnect'))
+        pipeline.add_stage('three', self.stage('three'))
+        pipeline.add_stage('log', self.stage('log'), deferred=True)
+        self.assertEqual(pipeline.run(context()), 'disconnect')
+        self.assertEqual([name for name, _ in self.calls], ['one', 'two'])
+
+    def test_deferred_stages_run_last_inline(self):
+        pipeline = Pipeline()
+        pipeline.add_stage('log', self.stage('log'), deferred=True)
+        pipeline.add_stage('one', self.stage('one'))
+        pipeline.run(context())
+        self.assertEqual([name for name, _ in self.calls], ['one', 'log'])
+
+    def test_add_before_and_remove(self):
+        pipeline = Pipeline()
+        pipeline.add_stage('one', self.stage('one'))
+        pipeline.add_stage('three', self.stage('three'))
+        pipeline.add_stage('two', self.stage('two'), before='three')
+        pipeline.remove_stage('one')
+        self.assertEqual([stage.name for stage in pipeline.stages], ['two', 'three'])
+
+    def test_workers_keep_the_order_of_a_room(self):
+        pipeline = Pipeline(workers=3)
+        pipeline.add_stage('log', self.stage('log'), deferred=True)
+        for number in range(200):
+            pipeline.run(context(str(number), room=f"room{number % 5}"))
+        pipeline.close()
+        self.assertEqual(len(self.calls), 200)
+        for room in range(5):
+            numbers = [int(message) for _, message in self.calls if int(message) % 5 == room]
+            self.assertEqual(numbers, sorted(numbers))
+        self.assertGreater(pipeline.workers.get_batch_count(), 0)
+
+    def test_deferred_stages_run_off_the_reader(self):
+        pipeline = Pipeline(workers=1)
+        threads = []
+        pipeline.add_stage('log', lambda chat_context: threads.append(threading.current_thread()), deferred=True)
+        pipeline.run(context())
+        pipeline.close()
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_closed_workers_run_the_stages_inline(self):
+        pipeline = Pipeline(workers=1)
+        pipeline.add_stage('log', self.stage('log'), deferred=True)
+        pipeline.close()
+        pipeline.run(context())
+        self.assertEqual(self.calls, [('log', 'hello')])
+
+
+class CommandRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = MessageHandler()
+        self.arguments = []
+
+    def command(self, chat_context, argument):
+        self.arguments.append(argument)
+        return 'continue'
+
+    def test_chat_stage_layout(self):
+        pipeline = self.handler.pipeline
+        self.assertEqual([stage.name for stage in pipeline.stages],
+                         ['rate_limit', 'filter', 'command', 'format', 'mentions', 'broadcast', 'history'])
+        self.assertEqual([stage.name for stage in pipeline.deferred], ['log', 'persist'])
+
+    def test_registered_command_runs_case_insensitively(self):
+        self.handler.register_command('/Ping', self.command)
+        self.assertEqual(self.handler._stage_command(context('/PING now')), 'continue')
+        self.assertEqual(self.handler._stage_command(context('/ping')), 'continue')
+        self.assertEqual(self.arguments, ['now', ''])
+
+    def test_command_without_argument_given_one_is_chat(self):
+        self.handler.register_command('/ping', self.command, takes_argument=False)
+        self.assertIsNone(self.handler._stage_command(context('/ping now')))
+        self.assertEqual(self.handler._stage_command(context('/ping')), 'continue')
+        self.assertEqual(self.arguments, [''])
+
+    def test_unknown_command_and_chat_pass_through(self):
+        self.assertIsNone(self.handler._stage_command(context('/nothing')))
+        self.assertIsNone(self.handler._stage_command(context('hello /ping')))
+
+    def test_registration_replaces_a_builtin(self):
+        self.handler.register_command('/quit', self.command)
+        self.assertEqual(self.handler._stage_command(context('/quit')), 'continue')
+        self.assertEqual(self.arguments, [''])
+
+
+if __name__ == "__main__":
+    unittest.main()
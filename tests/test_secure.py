@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests of the GCRA rate limiter
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from secure import RateLimiter, AntiSpam
+
+
+def send(limiter, key, now):
+    """One message through the limiter, True if it conforms"""
+    arrival = limiter.check(key, now)
+    if arrival is None:
+        return False
+    limiter.commit(key, arrival, now)
+    return True
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_burst_then_limited(self):
+        limiter = RateLimiter(max_messages=3, time_window=3.0)
+        self.assertEqual([send(limiter, 'alice', 0.0) for _ in range(4)], [True, True, True, False])
+
+    def test_one_message_earned_per_interval(self):
+        limiter = RateLimiter(max_messages=3, time_window=3.0)
+        for _ in range(3):
+            send(limiter, 'alice', 0.0)
+        self.assertFalse(send(limiter, 'alice', 0.9))
+        self.assertTrue(send(limiter, 'alice', 1.0))
+        self.assertFalse(send(limiter, 'alice', 1.5))
+        self.assertTrue(send(limiter, 'alice', 2.0))
+
+    def test_full_burst_after_idle(self):
+        limiter = RateLimiter(max_messages=3, time_window=3.0)
+        for _ in range(3):
+            send(limiter, 'alice', 0.0)
+        self.assertEqual([send(limiter, 'alice', 10.0) for _ in range(4)], [True, True, True, False])
+
+    def test_steady_rate_never_limited(self):
+        limiter = RateLimiter(max_messages=15, time_window=60.0)
+        self.assertTrue(all(send(limiter, 'alice', second * 4.0) for second in range(100)))
+
+    def test_refused_message_costs_nothing(self):
+        limiter = RateLimiter(max_messages=2, time_window=2.0)
+        send(limiter, 'alice', 0.0)
+        send(limiter, 'alice', 0.0)
+        for _ in range(10):
+            self.assertFalse(send(limiter, 'alice', 0.5))
+        self.assertTrue(send(limiter, 'alice', 1.0))
+
+    def test_keys_are_independent(self):
+        limiter = RateLimiter(max_messages=1, time_window=1.0)
+        self.assertTrue(send(limiter, 'alice', 0.0))
+        self.assertFalse(send(limiter, 'alice', 0.0))
+        self.assertTrue(send(limiter, 'bob', 0.0))
+
+    def test_idle_keys_evicted(self):
+        limiter = RateLimiter(max_messages=2, time_window=2.0)
+        send(limiter, 'alice', 0.0)
+        send(limiter, 'bob', 5.0)
+        self.assertEqual(list(limiter.arrivals), ['bob'])
+
+    def test_zero_messages_refused(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(max_messages=0, time_window=60.0)
+
+    def test_least_recently_used_evicted_past_max_keys(self):
+        limiter = RateLimiter(max_messages=2, time_window=200.0, max_keys=3)
+        for key in ('a', 'b', 'c', 'd'):
+            send(limiter, key, 0.0)
+        self.assertEqual(list(limiter.arrivals), ['b', 'c', 'd'])
+
+
+class AntiSpamTest(unittest.TestCase):
+
+    def test_ip_limit_spans_usernames(self):
+        anti_spam = AntiSpam(max_messages=2, time_window=60, ip_max_messages=3)
+        results = [anti_spam.check_rate_limit(f"user{number}", '10.0.0.1') for number in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+
+    def test_duplicate_message(self):
+        anti_spam = AntiSpam()
+        self.assertTrue(anti_spam.check_duplicate('alice', 'hello'))
+        self.assertFalse(anti_spam.check_duplicate('alice', 'hello'))
+        self.assertTrue(anti_spam.check_duplicate('bob', 'hello'))
+
+
+if __name__ == "__main__":
+    unittest.main()